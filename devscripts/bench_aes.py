@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+from __future__ import print_function, unicode_literals
+
+# Compares the throughput of AES-128-CBC decryption with the list based
+# implementation youtube-dl used to have, the table driven one and, if
+# pycryptodome or pycrypto is installed, the accelerated backend.
+
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from youtube_dl import aes
+from youtube_dl.utils import bytes_to_intlist, intlist_to_bytes
+
+KEY = IV = b'\x20\x15' + b'\0' * 14
+SIZE = 256 * 1024
+
+
+def list_cbc_decrypt(data, key, iv):
+    expanded_key = aes.key_expansion(key)
+    decrypted_data = []
+    previous_cipher_block = iv
+    for i in range(0, len(data), aes.BLOCK_SIZE_BYTES):
+        block = data[i:i + aes.BLOCK_SIZE_BYTES]
+        decrypted_block = aes._reference_aes_decrypt(block, expanded_key)
+        decrypted_data += aes.xor(decrypted_block, previous_cipher_block)
+        previous_cipher_block = block
+    return decrypted_data
+
+
+def bench(name, func, size):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    print('%-12s %8.3f MB/s' % (name, size / elapsed / 1e6))
+
+
+def main():
+    data = os.urandom(SIZE)
+    # The list based implementation is too slow for the whole data
+    list_data = data[:SIZE // 16]
+    bench('list', lambda: intlist_to_bytes(list_cbc_decrypt(
+        bytes_to_intlist(list_data), bytes_to_intlist(KEY), bytes_to_intlist(IV))), len(list_data))
+
+    backend = aes._CryptoAES
+    aes._CryptoAES = None
+    try:
+        bench('tables', lambda: aes.aes_cbc_decrypt_bytes(data, KEY, IV), SIZE)
+    finally:
+        aes._CryptoAES = backend
+
+    if backend is not None:
+        bench('backend', lambda: aes.aes_cbc_decrypt_bytes(data, KEY, IV), SIZE)
+    else:
+        print('backend      not available')
+
+
+if __name__ == '__main__':
+    main()
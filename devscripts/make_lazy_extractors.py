@@ -16,6 +16,7 @@ if os.path.exists(lazy_extractors_filename):
 
 from youtube_dl.extractor import _ALL_CLASSES
 from youtube_dl.extractor.common import InfoExtractor, SearchInfoExtractor
+from youtube_dl.urldispatch import ie_host_suffixes
 
 with open('devscripts/lazy_load_template.py', 'rt') as f:
     module_template = f.read()
@@ -27,6 +28,7 @@ module_contents = [
 ie_template = '''
 class {name}({bases}):
     _VALID_URL = {valid_url!r}
+    _URL_HOST_SUFFIXES = {host_suffixes!r}
     _module = '{module}'
 '''
 
@@ -52,6 +54,7 @@ def build_lazy_ie(ie, name):
         name=name,
         bases=', '.join(map(get_base_name, ie.__bases__)),
         valid_url=valid_url,
+        host_suffixes=ie_host_suffixes(ie),
         module=ie.__module__)
     if ie.suitable.__func__ is not InfoExtractor.suitable.__func__:
         s += '\n' + getsource(ie.suitable)
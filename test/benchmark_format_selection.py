@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+from __future__ import print_function, unicode_literals
+
+# Allow direct execution
+import os
+import sys
+import time
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import copy
+
+from test.helper import FakeYDL
+
+FORMAT_SPECS = [
+    'bestvideo[height<=1080][fps>30]+bestaudio/best',
+    'bestvideo[ext=mp4][height<=720]+bestaudio[ext=m4a]/best[ext=mp4]/best',
+    '(bestvideo[vcodec^=avc1][tbr<5000]/bestvideo)+(bestaudio[abr<=128]/bestaudio),worst',
+]
+
+DURATION = 1
+
+
+def calls_per_second(func):
+    count = 0
+    start = time.time()
+    while True:
+        func()
+        count += 1
+        elapsed = time.time() - start
+        if elapsed >= DURATION:
+            return count / elapsed
+
+
+def make_formats(count=200):
+    # Sorted from worst to best, like after InfoExtractor._sort_formats
+    formats = []
+    for i in range(count):
+        kind = i % 4
+        f = {
+            'format_id': '%d' % i,
+            'url': 'http://localhost/%d' % i,
+            'ext': ('mp4', 'webm')[i % 2],
+            'tbr': 100 + i * 50,
+            'protocol': 'https',
+            'http_headers': {'User-Agent': 'benchmark', 'Accept': '*/*'},
+        }
+        if kind == 0:
+            f.update({'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 32 + i, 'ext': 'm4a'})
+        else:
+            f.update({
+                'vcodec': ('avc1.64001f', 'vp9')[i % 2],
+                'acodec': 'none' if kind != 3 else 'mp4a.40.2',
+                'height': 144 + i * 12, 'width': 256 + i * 21, 'fps': (24, 30, 60)[i % 3],
+            })
+        formats.append(f)
+    return formats
+
+
+class BenchmarkFormatSelection(unittest.TestCase):
+    def test_format_selection(self):
+        ydl = FakeYDL()
+        ctx = {'formats': make_formats(), 'incomplete_formats': False}
+
+        def build_and_copy(format_spec):
+            # A lower bound of what every video used to cost: compiling the
+            # specification again and deep copying the formats, which was
+            # then done for every node of the selector
+            selector = ydl._compile_format_selector(format_spec)
+            return list(selector(copy.deepcopy(ctx)))
+
+        for format_spec in FORMAT_SPECS:
+            selector = ydl.build_format_selector(format_spec)
+            self.assertEqual(
+                [f['format_id'] for f in build_and_copy(format_spec)],
+                [f['format_id'] for f in selector(ctx)])
+
+            before = calls_per_second(lambda: build_and_copy(format_spec))
+            after = calls_per_second(lambda: list(ydl.build_format_selector(format_spec)(ctx)))
+            print('\n%s\nbefore: %10.0f selections/s\nafter:  %10.0f selections/s (x%.1f)' % (
+                format_spec, before, after, after / before))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+from __future__ import print_function, unicode_literals
+
+# Allow direct execution
+import os
+import sys
+import time
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from youtube_dl.jsinterp import JSInterpreter
+
+# Shaped like the signature functions of YouTube players
+SIG_CODE = '''
+var Xy={a:function(a){a.reverse()},b:function(a,b){a.splice(0,b)},
+c:function(a,b){var c=a[0];a[0]=a[b%a.length];a[b%a.length]=c}};
+var sig=function(a){a=a.split("");Xy.c(a,3);Xy.a(a,5);Xy.b(a,2);Xy.c(a,47);Xy.a(a,1);Xy.b(a,3);return a.join("")};
+'''
+SIG_ARGS = ['abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.abcdefghijklmnopqrstuvwxyz']
+
+DURATION = 1
+
+
+def calls_per_second(func):
+    count = 0
+    start = time.time()
+    while True:
+        func()
+        count += 1
+        elapsed = time.time() - start
+        if elapsed >= DURATION:
+            return count / elapsed
+
+
+class BenchmarkJSInterpreter(unittest.TestCase):
+    def test_signature_function(self):
+        jsi = JSInterpreter(SIG_CODE)
+        func_m = jsi.code.index('var sig=function(a){') + len('var sig=function(a){')
+        code = jsi.code[func_m:jsi.code.index('}', func_m)]
+
+        def interpret():
+            # What every call used to do: interpret the source text again
+            local_vars = {'a': SIG_ARGS[0]}
+            for stmt in code.split(';'):
+                res, abort = jsi.interpret_statement(stmt, local_vars)
+                if abort:
+                    return res
+
+        compiled = jsi.extract_function('sig')
+        self.assertEqual(interpret(), compiled(SIG_ARGS))
+
+        before = calls_per_second(interpret)
+        after = calls_per_second(lambda: compiled(SIG_ARGS))
+        print('\ninterpreted: %10.0f calls/s\ncompiled:    %10.0f calls/s (x%.1f)' % (
+            before, after, after / before))
+
+
+if __name__ == '__main__':
+    unittest.main()
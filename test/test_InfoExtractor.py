@@ -11,6 +11,10 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from test.helper import FakeYDL, expect_dict, expect_value
 from youtube_dl.compat import compat_etree_fromstring
+from youtube_dl.downloader.dash import (
+    count_template_fragments,
+    iter_template_fragments,
+)
 from youtube_dl.extractor.common import InfoExtractor
 from youtube_dl.extractor import YoutubeIE, get_info_extractor
 from youtube_dl.utils import encode_data_uri, strip_jsonp, ExtractorError, RegexNotFoundError
@@ -667,6 +671,46 @@ jwplayer("mediaplayer").setup({"abouttext":"Visit Indie DB","aboutlink":"http:\/
                 self.ie._sort_formats(formats)
                 expect_value(self, formats, expected_formats, None)
 
+    def test_parse_mpd_segment_template(self):
+        with io.open('./test/testdata/mpd/segment_template.mpd',
+                     mode='r', encoding='utf-8') as f:
+            formats = self.ie._parse_mpd_formats(
+                compat_etree_fromstring(f.read().encode('utf-8')),
+                mpd_base_url='http://unknown/', mpd_url='http://unknown/manifest.mpd')
+        formats = dict((f['format_id'], f) for f in formats)
+
+        video = formats['video1']
+        self.assertEqual(video['protocol'], 'http_dash_segments')
+        self.assertEqual(video['fragments'], [{'path': 'init-video1.mp4'}])
+        self.assertEqual(count_template_fragments(video['fragment_template']), 3)
+        self.assertEqual(list(iter_template_fragments(video['fragment_template'])), [
+            {'path': 'seg-video1-0.m4s', 'duration': 4.0},
+            {'path': 'seg-video1-4000.m4s', 'duration': 4.0},
+            {'path': 'seg-video1-8000.m4s', 'duration': 2.0},
+        ])
+
+        audio = formats['audio1']
+        self.assertEqual(audio['fragments'], [{'path': 'init-audio1.mp4'}])
+        self.assertEqual(count_template_fragments(audio['fragment_template']), 3)
+        self.assertEqual(list(iter_template_fragments(audio['fragment_template'])), [
+            {'path': 'seg-audio1-00001.m4s', 'duration': 4.0},
+            {'path': 'seg-audio1-00002.m4s', 'duration': 4.0},
+            {'path': 'seg-audio1-00003.m4s', 'duration': 4.0},
+        ])
+
+        # r=-1 is a single segment
+        fragment_template = {
+            'media': 'seg-%(Time)d.m4s',
+            'timescale': 1000,
+            's': [{'t': 0, 'd': 4000, 'r': -1}, {'d': 2000, 'r': 1}],
+        }
+        self.assertEqual(count_template_fragments(fragment_template), 3)
+        self.assertEqual(list(iter_template_fragments(fragment_template)), [
+            {'path': 'seg-0.m4s', 'duration': 4.0},
+            {'path': 'seg-4000.m4s', 'duration': 2.0},
+            {'path': 'seg-6000.m4s', 'duration': 2.0},
+        ])
+
     def test_parse_f4m_formats(self):
         _TEST_CASES = [
             (
@@ -10,14 +10,18 @@ import unittest
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import copy
+import io
+import json
+import random
+import time
 
-from test.helper import FakeYDL, assertRegexpMatches
+from test.helper import FakeYDL, assertRegexpMatches, try_rm
 from youtube_dl import YoutubeDL
 from youtube_dl.compat import compat_str, compat_urllib_error
 from youtube_dl.extractor import YoutubeIE
 from youtube_dl.extractor.common import InfoExtractor
 from youtube_dl.postprocessor.common import PostProcessor
-from youtube_dl.utils import ExtractorError, match_filter_func
+from youtube_dl.utils import ExtractorError, MaxDownloadsReached, OnDemandPagedList, match_filter_func
 
 TEST_URL = 'http://localhost/sample.mp4'
 
@@ -462,6 +466,69 @@ class TestFormatSelection(unittest.TestCase):
             pass
         self.assertEqual(ydl.downloaded_info_dicts, [])
 
+    def test_compiled_format_selector(self):
+        formats = [
+            {'format_id': 'v1', 'ext': 'mp4', 'height': 720, 'fps': 30, 'acodec': 'none', 'url': TEST_URL},
+            {'format_id': 'v2', 'ext': 'mp4', 'height': 1080, 'fps': 60, 'acodec': 'none', 'url': TEST_URL},
+            {'format_id': 'v3', 'ext': 'mp4', 'height': 2160, 'fps': 60, 'acodec': 'none', 'url': TEST_URL},
+            {'format_id': 'a1', 'ext': 'm4a', 'vcodec': 'none', 'url': TEST_URL},
+        ]
+        ydl = YDL()
+        format_spec = 'bestvideo[height<=1080][fps>30]+bestaudio/best'
+        selector = ydl.build_format_selector(format_spec)
+        self.assertIs(ydl.build_format_selector(format_spec), selector)
+
+        formats_copy = copy.deepcopy(formats)
+        ctx = {'formats': formats, 'incomplete_formats': False}
+        selected = list(selector(ctx))
+        self.assertEqual([f['format_id'] for f in selected], ['v2+a1'])
+        # The selected formats are the given ones, which are left untouched
+        self.assertIs(selected[0]['requested_formats'][0], formats[1])
+        self.assertEqual(formats, formats_copy)
+        self.assertIs(ctx['formats'], formats)
+
+        self.assertEqual(
+            [f['format_id'] for f in selector(ctx)], ['v2+a1'])
+
+    def test_format_sort(self):
+        formats = [
+            {'format_id': 'low-fps', 'ext': 'mp4', 'height': 1080, 'fps': 30, 'tbr': 4000, 'url': TEST_URL},
+            {'format_id': 'high-fps', 'ext': 'mp4', 'height': 720, 'fps': 60, 'tbr': 3000, 'url': TEST_URL},
+            {'format_id': 'small', 'ext': 'webm', 'height': 360, 'fps': 60, 'tbr': 500, 'url': TEST_URL},
+        ]
+        info_dict = _make_result(formats)
+
+        ydl = YDL()
+        ie = YoutubeIE(ydl)
+        ie._sort_formats(info_dict['formats'])
+        self.assertEqual(
+            [f['format_id'] for f in info_dict['formats']], ['small', 'high-fps', 'low-fps'])
+
+        ydl = YDL({'format_sort': ['fps', 'height']})
+        ydl.process_ie_result(copy.deepcopy(info_dict))
+        self.assertEqual(ydl.downloaded_info_dicts[0]['format_id'], 'high-fps')
+
+        ydl = YDL({'format_sort': ['fps'], 'format': 'worst'})
+        ydl.process_ie_result(copy.deepcopy(info_dict))
+        self.assertEqual(ydl.downloaded_info_dicts[0]['format_id'], 'low-fps')
+
+        # Formats are listed in the same order
+        ydl = YDL({'format_sort': ['fps', 'height'], 'listformats': True})
+        listed = []
+        ydl.list_formats = lambda info: listed.extend(f['format_id'] for f in info['formats'])
+        ydl.process_ie_result(copy.deepcopy(info_dict))
+        self.assertEqual(listed, ['low-fps', 'small', 'high-fps'])
+
+        # Ties keep the ranking of the extractor
+        formats = [
+            {'format_id': f_id, 'ext': 'mp4', 'fps': 30, 'tbr': tbr, 'url': TEST_URL}
+            for f_id, tbr in (('a', 3000), ('b', 2000), ('c', 1000))]
+        info_dict = _make_result(formats)
+        ie._sort_formats(info_dict['formats'], field_preference=('format_id',))
+        ydl = YDL({'format_sort': ['fps']})
+        ydl.process_ie_result(info_dict)
+        self.assertEqual(ydl.downloaded_info_dicts[0]['format_id'], 'c')
+
     def test_default_format_spec(self):
         ydl = YDL({'simulate': True})
         self.assertEqual(ydl._default_format_spec({}), 'bestvideo+bestaudio/best')
@@ -782,6 +849,288 @@ class TestYoutubeDL(unittest.TestCase):
         result = get_ids({'playlist_items': '2-4,3-4,3'})
         self.assertEqual(result, [2, 3, 4])
 
+    def test_lazy_playlist(self):
+        listed = []
+
+        def make_entry(i):
+            listed.append(i)
+            return {'id': compat_str(i), 'title': compat_str(i), 'url': TEST_URL}
+
+        def get_page(pagenum):
+            for i in range(pagenum * 3 + 1, min(pagenum * 3 + 4, 11)):
+                yield make_entry(i)
+
+        class LazyYDL(YDL):
+            def process_info(self, info_dict):
+                # Entries are listed as they are processed
+                self.downloaded_info_dicts.append((int(info_dict['id']), max(listed)))
+
+        def get_ids(entries, params):
+            del listed[:]
+            params['lazy_playlist'] = True
+            ydl = LazyYDL(params)
+            res = ydl.process_ie_result({
+                '_type': 'playlist',
+                'id': 'test',
+                'entries': entries,
+                'extractor': 'test:playlist',
+                'extractor_key': 'test:playlist',
+                'webpage_url': 'http://example.com',
+            })
+            self.assertEqual(res['entries'], [])
+            return ydl.downloaded_info_dicts
+
+        result = get_ids((make_entry(i) for i in range(1, 11)), {'playliststart': 3, 'playlistend': 5})
+        self.assertEqual(result, [(3, 3), (4, 4), (5, 5)])
+
+        result = get_ids((make_entry(i) for i in range(1, 11)), {'playlist_items': '7,2-3'})
+        self.assertEqual(result, [(2, 2), (3, 3), (7, 7)])
+
+        result = get_ids(OnDemandPagedList(get_page, 3), {'playliststart': 2})
+        self.assertEqual(
+            result, [(i, min((i - 1) // 3 * 3 + 3, 10)) for i in range(2, 11)])
+
+        # playlist_index is padded to a width not depending on the number of
+        # entries, which is unknown
+        info = {'id': '1', 'ext': 'mp4', 'playlist_index': 7}
+        for params, filename in (
+                ({}, '00007-1.mp4'),
+                ({'playlistend': 120}, '007-1.mp4'),
+                ({'playlist_items': '7,2-30'}, '07-1.mp4')):
+            params['outtmpl'] = '%(playlist_index)s-%(id)s.%(ext)s'
+            self.assertEqual(YoutubeDL(params).prepare_filename(info), filename)
+
+        result = get_ids(OnDemandPagedList(get_page, 3), {'playlist_items': '5,8'})
+        self.assertEqual(result, [(5, 6), (8, 9)])
+
+    def test_concurrent_playlist_entries(self):
+        entries = [{
+            'id': compat_str(i),
+            'title': compat_str(i),
+            'url': TEST_URL,
+        } for i in range(1, 11)]
+        playlist = {
+            '_type': 'playlist',
+            'id': 'test',
+            'entries': entries,
+            'extractor': 'test:playlist',
+            'extractor_key': 'test:playlist',
+            'webpage_url': 'http://example.com',
+        }
+
+        class ConcurrentYDL(FakeYDL):
+            def __init__(self, *args, **kwargs):
+                super(ConcurrentYDL, self).__init__(*args, **kwargs)
+                self.printed = []
+
+            def process_video_result(self, info_dict, download=True):
+                # Make entries reach process_info out of order
+                time.sleep(random.random() * 0.05)
+                return super(ConcurrentYDL, self).process_video_result(info_dict, download)
+
+            def to_stdout(self, message, skip_eol=False, check_quiet=False):
+                self.printed.append(message)
+
+        ydl = ConcurrentYDL({
+            'concurrent_playlist_entries': 4,
+            'simulate': True,
+            'forcefilename': True,
+            'outtmpl': '%(autonumber)s-%(playlist_index)s-%(id)s.%(ext)s',
+            'max_downloads': 7,
+        })
+        self.assertRaises(MaxDownloadsReached, ydl.process_ie_result, playlist)
+        self.assertEqual(
+            ydl.printed, ['%05d-%05d-%d.mp4' % (i, i, i) for i in range(1, 8)])
+
+        # All the formats of an entry are processed before the next entry
+        for entry in entries:
+            entry['formats'] = [
+                {'format_id': f, 'url': TEST_URL, 'ext': 'mp4'} for f in ('a', 'b')]
+        ydl = ConcurrentYDL({
+            'concurrent_playlist_entries': 4,
+            'simulate': True,
+            'forcefilename': True,
+            'format': 'a,b',
+            'outtmpl': '%(autonumber)s-%(id)s-%(format_id)s',
+        })
+        ydl.process_ie_result(playlist)
+        self.assertEqual(ydl.printed, [
+            '%05d-%d-%s' % (2 * i - 1 + j, i, f)
+            for i in range(1, 11) for j, f in enumerate(('a', 'b'))])
+
+    def test_concurrent_playlist_entries_failure(self):
+        playlist = {
+            '_type': 'playlist',
+            'id': 'test',
+            'entries': [{
+                'id': compat_str(i),
+                'title': compat_str(i),
+                'url': TEST_URL,
+            } for i in range(1, 5)],
+            'extractor': 'test:playlist',
+            'extractor_key': 'test:playlist',
+            'webpage_url': 'http://example.com',
+        }
+        processed = []
+
+        class FailingYDL(YDL):
+            def process_video_result(self, info_dict, download=True):
+                if info_dict['id'] == '1':
+                    raise ExtractorError('broken')
+                elif info_dict['id'] == '2':
+                    # Still extracting when the first entry fails
+                    time.sleep(3)
+                return super(FailingYDL, self).process_video_result(info_dict, download)
+
+            def process_info(self, info_dict):
+                self._wait_entry_turn('start')
+                processed.append(info_dict['id'])
+
+        ydl = FailingYDL({'concurrent_playlist_entries': 2})
+        start = time.time()
+        self.assertRaises(ExtractorError, ydl.process_ie_result, playlist)
+        # The entry in progress is not waited for
+        self.assertTrue(time.time() - start < 2)
+        time.sleep(3.5)
+        # and it is stopped at its next turn
+        self.assertEqual(processed, [])
+
+    def test_dump_json_lines(self):
+        def make_playlist():
+            return {
+                '_type': 'playlist',
+                'id': 'test',
+                'entries': [{
+                    'id': compat_str(i),
+                    'title': compat_str(i),
+                    'url': TEST_URL,
+                } for i in range(1, 4)],
+                'extractor': 'test:playlist',
+                'extractor_key': 'test:playlist',
+                'webpage_url': 'http://example.com',
+            }
+
+        class JSONYDL(FakeYDL):
+            def __init__(self, *args, **kwargs):
+                super(JSONYDL, self).__init__(*args, **kwargs)
+                self.printed = []
+
+            def to_stdout(self, message, skip_eol=False, check_quiet=False):
+                self.printed.append(message)
+
+        ydl = JSONYDL({
+            'simulate': True,
+            'forcejson': True,
+            'json_fields': ['id', 'playlist_index', 'missing'],
+        })
+        res = ydl.process_ie_result(make_playlist())
+        self.assertEqual(
+            [json.loads(line) for line in ydl.printed],
+            [{'id': compat_str(i), 'playlist_index': i} for i in range(1, 4)])
+        self.assertEqual([e['id'] for e in res['entries']], ['1', '2', '3'])
+
+        # As with --dump-json
+        ydl = JSONYDL({'simulate': True, 'forcejson': True, 'keep_playlist_results': False})
+        res = ydl.process_ie_result(make_playlist())
+        self.assertEqual(len(ydl.printed), 3)
+        self.assertEqual(res['entries'], [])
+
+        ydl = JSONYDL({
+            'simulate': True,
+            'forcejson': True,
+            'dump_single_json': True,
+            'keep_playlist_results': False,
+        })
+        res = ydl.process_ie_result(make_playlist())
+        self.assertEqual(len(ydl.printed), 3)
+        self.assertEqual([e['id'] for e in res['entries']], ['1', '2', '3'])
+
+    def test_download_batch(self):
+        extracted = []
+
+        class BatchIE(InfoExtractor):
+            _VALID_URL = r'https?://batch\.example/(?P<id>\w+)'
+
+            def _real_extract(self, url):
+                video_id = self._match_id(url)
+                extracted.append(video_id)
+                if video_id == 'broken':
+                    raise ExtractorError('broken video', expected=True)
+                return {
+                    'id': video_id,
+                    'title': video_id,
+                    'url': TEST_URL,
+                }
+
+        class BatchYDL(YDL):
+            def trouble(self, message=None, tb=None):
+                return YoutubeDL.trouble(self, message, tb)
+
+            def to_stderr(self, message):
+                self.msgs.append(message)
+
+        log_fn = 'test_download_batch.log'
+        urls = [
+            'http://batch.example/a',
+            'http://batch.example/b',
+            'https://batch.example/a',
+            'http://batch.example/broken',
+            'http://batch.example/c',
+        ]
+
+        def run_batch(prefetch):
+            ydl = BatchYDL({'ignoreerrors': True, 'batch_log': log_fn, 'batch_prefetch': prefetch})
+            ydl.add_info_extractor(BatchIE())
+            # URLs are pulled lazily
+            retcode = ydl.download_batch(url for url in urls)
+            return retcode, [info['id'] for info in ydl.downloaded_info_dicts]
+
+        for prefetch in (False, True):
+            try:
+                del extracted[:]
+                self.assertEqual(run_batch(prefetch), (1, ['a', 'b', 'c']))
+                self.assertEqual(extracted, ['a', 'b', 'broken', 'c'])
+                with io.open(log_fn, encoding='utf-8') as log_file:
+                    records = [json.loads(line) for line in log_file]
+                self.assertEqual(
+                    [(r['url'], r['status']) for r in records],
+                    [(urls[0], 'ok'), (urls[1], 'ok'), (urls[2], 'duplicate'),
+                     (urls[3], 'error'), (urls[4], 'ok')])
+                self.assertEqual(records[0]['id'], 'a')
+
+                # Only the failed URL is retried
+                del extracted[:]
+                self.assertEqual(run_batch(prefetch), (1, []))
+                self.assertEqual(extracted, ['broken'])
+            finally:
+                try_rm(log_fn)
+
+    def test_batch_prefetch_output(self):
+        class PrefetchIE(InfoExtractor):
+            _VALID_URL = r'https?://prefetch\.example/(?P<id>\w+)'
+
+            def _real_extract(self, url):
+                video_id = self._match_id(url)
+                self.to_screen('%s: extracting' % video_id)
+                return {'id': video_id, 'title': video_id, 'url': TEST_URL}
+
+        class PrefetchYDL(FakeYDL):
+            def to_screen(self, message, skip_eol=False):
+                self.to_stdout(message, skip_eol, check_quiet=True)
+
+            def process_info(self, info_dict):
+                self.to_screen('%s: downloading' % info_dict['id'])
+
+        ydl = PrefetchYDL({'batch_prefetch': True, 'quiet': False})
+        ydl._screen_file = io.StringIO()
+        ydl.add_info_extractor(PrefetchIE())
+        ydl.download_batch(['http://prefetch.example/%s' % i for i in ('a', 'b', 'c')])
+        # Background extractions are reported when their URL is processed
+        self.assertEqual(
+            [line.split('] ')[-1] for line in ydl._screen_file.getvalue().splitlines()
+             if 'ing' in line],
+            ['%s: %s' % (i, stage) for i in ('a', 'b', 'c') for stage in ('extracting', 'downloading')])
+
     def test_urlopen_no_file_protocol(self):
         # see https://github.com/rg3/youtube-dl/issues/8227
         ydl = YDL()
@@ -8,9 +8,12 @@ import sys
 import unittest
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from youtube_dl import aes
 from youtube_dl.aes import aes_decrypt, aes_encrypt, aes_cbc_decrypt, aes_cbc_encrypt, aes_decrypt_text
+from youtube_dl.aes import aes_cbc_decrypt_bytes, aes_cbc_encrypt_bytes, aes_ctr_decrypt_bytes, key_expansion
 from youtube_dl.utils import bytes_to_intlist, intlist_to_bytes
 import base64
+import random
 
 # the encrypted data can be generate with 'devscripts/generate_aes_testdata.py'
 
@@ -34,6 +37,16 @@ class TestAES(unittest.TestCase):
         decrypted = intlist_to_bytes(aes_cbc_decrypt(data, self.key, self.iv))
         self.assertEqual(decrypted.rstrip(b'\x08'), self.secret_msg)
 
+    def test_cbc_decrypt_partial_block(self):
+        data = bytes_to_intlist(
+            b"\x97\x92+\xe5\x0b\xc3\x18\x91ky9m&\xb3\xb5@\xe6'\xc2\x96.\xc8u\x88\xab9-[\x9e|\xf1\xcd"
+        ) * 2
+        for size in (1, 15, 17, 33):
+            padded = data[:size] + [0] * (-size % 16)
+            decrypted = aes_cbc_decrypt(data[:size], self.key, self.iv)
+            self.assertEqual(len(decrypted), size)
+            self.assertEqual(decrypted, aes_cbc_decrypt(padded, self.key, self.iv)[:size])
+
     def test_cbc_encrypt(self):
         data = bytes_to_intlist(self.secret_msg)
         encrypted = intlist_to_bytes(aes_cbc_encrypt(data, self.key, self.iv))
@@ -58,6 +71,55 @@ class TestAES(unittest.TestCase):
         decrypted = (aes_decrypt_text(encrypted, password, 32))
         self.assertEqual(decrypted, self.secret_msg)
 
+    def test_tables(self):
+        rnd = random.Random(0)
+        for key_size in (16, 24, 32):
+            expanded_key = key_expansion([rnd.randint(0, 255) for _ in range(key_size)])
+            for _ in range(10):
+                block = [rnd.randint(0, 255) for _ in range(16)]
+                self.assertEqual(
+                    aes_encrypt(block, expanded_key),
+                    aes._reference_aes_encrypt(block, expanded_key))
+                self.assertEqual(
+                    aes_decrypt(block, expanded_key),
+                    aes._reference_aes_decrypt(block, expanded_key))
+
+    def test_bytes(self):
+        rnd = random.Random(0)
+        data = intlist_to_bytes([rnd.randint(0, 255) for _ in range(100)])
+        iv = intlist_to_bytes(self.iv)
+        for key_size in (16, 24, 32):
+            key = intlist_to_bytes([rnd.randint(0, 255) for _ in range(key_size)])
+            encrypted = aes_cbc_encrypt_bytes(data, key, iv)
+            self.assertEqual(len(encrypted), 112)
+            self.assertEqual(
+                encrypted, intlist_to_bytes(aes_cbc_encrypt(
+                    bytes_to_intlist(data), bytes_to_intlist(key), self.iv)))
+            for buf in (encrypted, bytearray(encrypted), memoryview(encrypted)):
+                self.assertEqual(aes_cbc_decrypt_bytes(buf, key, iv), data + b'\x0c' * 12)
+
+            # The counter wraps around
+            counter = [0xff] * 15 + [0xfe]
+            keystream = []
+            for _ in range(7):
+                keystream += aes._reference_aes_encrypt(counter, key_expansion(bytes_to_intlist(key)))
+                counter = aes.inc(counter)
+            self.assertEqual(
+                aes_ctr_decrypt_bytes(data, key, intlist_to_bytes([0xff] * 15 + [0xfe])),
+                intlist_to_bytes(aes.xor(bytes_to_intlist(data), keystream)))
+
+    def test_pure_python(self):
+        backend = aes._CryptoAES
+        aes._CryptoAES = None
+        try:
+            self.test_cbc_decrypt()
+            self.test_cbc_decrypt_partial_block()
+            self.test_cbc_encrypt()
+            self.test_decrypt_text()
+            self.test_bytes()
+        finally:
+            aes._CryptoAES = backend
+
 
 if __name__ == '__main__':
     unittest.main()
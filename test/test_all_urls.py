@@ -14,9 +14,14 @@ from test.helper import gettestcases
 
 from youtube_dl.extractor import (
     FacebookIE,
+    gen_extractor_classes,
     gen_extractors,
     YoutubeIE,
 )
+from youtube_dl.urldispatch import (
+    URLDispatchIndex,
+    url_host_suffixes,
+)
 
 
 class TestAllURLsMatching(unittest.TestCase):
@@ -138,6 +143,40 @@ class TestAllURLsMatching(unittest.TestCase):
                 len(ie_list), 1,
                 'Multiple extractors with the same IE_NAME "%s" (%s)' % (ie_name, ', '.join(ie_list)))
 
+    def test_url_host_suffixes(self):
+        self.assertEqual(
+            url_host_suffixes(r'https?://(?:www\.)?example\.com/(?P<id>\d+)'),
+            ('example.com',))
+        self.assertEqual(
+            url_host_suffixes(r'https?://(?:[^/]+\.)?(?:Example\.com|example\.org)/'),
+            ('example.com', 'example.org'))
+        self.assertEqual(
+            url_host_suffixes(r'(?x)https?://(?:www\.)?  example\.com  /'),
+            ('example.com',))
+        # Optional scheme
+        self.assertEqual(url_host_suffixes(r'(?:https?://)?example\.com/'), None)
+        # The host may span slashes
+        self.assertEqual(url_host_suffixes(r'https?://.+\.example\.com/'), None)
+        # No slash after the host
+        self.assertEqual(url_host_suffixes(r'https?://example\.com/?'), None)
+        self.assertEqual(url_host_suffixes(r'https?://example\.com(?:/|$)'), None)
+        self.assertEqual(url_host_suffixes(r'https?://[^/]+/embed/'), None)
+        # Alternatives at top level
+        self.assertEqual(
+            url_host_suffixes(r'https?://example\.com/|example:(?P<id>\d+)'), None)
+
+    def test_dispatch_index(self):
+        ies = gen_extractor_classes()
+        index = URLDispatchIndex(ies)
+        for tc in gettestcases(include_onlymatching=True):
+            url = tc['url']
+            candidates = index.candidates(url)
+            self.assertEqual(
+                next(ie for ie in candidates if ie.suitable(url)),
+                next(ie for ie in ies if ie.suitable(url)), url)
+        self.assertEqual(
+            index.candidates('http://example.com/video.mp4')[-1].ie_key(), 'Generic')
+
 
 if __name__ == '__main__':
     unittest.main()
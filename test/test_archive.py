@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+# Allow direct execution
+import io
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+from test.helper import try_rm
+from youtube_dl.archive import (
+    DownloadArchive,
+    SqliteDownloadArchive,
+    open_download_archive,
+    sqlite3,
+)
+
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestDownloadArchive(unittest.TestCase):
+    def setUp(self):
+        self.filename = os.path.join(TEST_DIR, 'testdata', 'archive_test.txt')
+        self.db_filename = os.path.join(TEST_DIR, 'testdata', 'archive_test.sqlite')
+        self.tearDown()
+
+    def tearDown(self):
+        try_rm(self.filename)
+        try_rm(self.db_filename)
+
+    def test_text_archive(self):
+        with io.open(self.filename, 'w', encoding='utf-8') as f:
+            f.write('youtube abc\nyoutube déf\n')
+        archive = open_download_archive(self.filename)
+        self.assertTrue(isinstance(archive, DownloadArchive))
+        self.assertTrue('youtube abc' in archive)
+        self.assertTrue('youtube déf' in archive)
+        self.assertFalse('youtube xyz' in archive)
+
+        archive.add('youtube xyz')
+        self.assertTrue('youtube xyz' in archive)
+        with io.open(self.filename, 'r', encoding='utf-8') as f:
+            self.assertEqual(f.read(), 'youtube abc\nyoutube déf\nyoutube xyz\n')
+
+        # Entries recorded by other processes are picked up
+        other = open_download_archive(self.filename)
+        self.assertTrue('youtube abc' in other)
+        archive.add('vimeo 123')
+        self.assertTrue('vimeo 123' in other)
+
+    def test_missing_text_archive(self):
+        archive = open_download_archive(self.filename)
+        self.assertFalse('youtube abc' in archive)
+        archive.add('youtube abc')
+        self.assertTrue('youtube abc' in open_download_archive(self.filename))
+
+    @unittest.skipIf(sqlite3 is None, 'sqlite3 is not available')
+    def test_sqlite_archive(self):
+        archive = open_download_archive(self.db_filename)
+        self.assertTrue(isinstance(archive, SqliteDownloadArchive))
+        self.assertFalse('youtube abc' in archive)
+        archive.add('youtube abc')
+        archive.add('youtube abc')
+        self.assertTrue('youtube abc' in archive)
+
+        other = open_download_archive(self.db_filename)
+        self.assertTrue('youtube abc' in other)
+        other.add('vimeo 123')
+        self.assertTrue('vimeo 123' in archive)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,7 +13,11 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 
 from test.helper import FakeYDL
-from youtube_dl.cache import Cache
+from youtube_dl.cache import (
+    Cache,
+    MemoryLRU,
+    sqlite3,
+)
 
 
 def _is_empty(d):
@@ -54,6 +58,99 @@ class TestCache(unittest.TestCase):
         self.assertFalse(os.path.exists(self.test_dir))
         self.assertEqual(c.load('test_cache', 'k.'), None)
 
+    def test_cache_eviction(self):
+        ydl = FakeYDL({
+            'cachedir': self.test_dir,
+        })
+        c = Cache(ydl)
+        c.store('test_cache', 'a', 1, max_entries=2)
+        c.store('test_cache', 'b', 2, max_entries=2)
+        section_dir = os.path.join(self.test_dir, 'test_cache')
+        os.utime(os.path.join(section_dir, 'a.json'), (1000, 1000))
+        os.utime(os.path.join(section_dir, 'b.json'), (2000, 2000))
+        # Loading makes a the most recently used entry
+        self.assertEqual(Cache(ydl).load('test_cache', 'a'), 1)
+        c.store('test_cache', 'c', 3, max_entries=2)
+        self.assertEqual(sorted(os.listdir(section_dir)), ['a.json', 'c.json'])
+        self.assertEqual(c.load('test_cache', 'b'), None)
+
+    def test_cache_ttl(self):
+        ydl = FakeYDL({
+            'cachedir': self.test_dir,
+        })
+        c = Cache(ydl)
+        c.store('test_cache', 'k', 1)
+        self.assertEqual(c.load('test_cache', 'k', ttl=3600), 1)
+        fn = os.path.join(self.test_dir, 'test_cache', 'k.json')
+        os.utime(fn, (1000, 1000))
+        self.assertEqual(c.load('test_cache', 'k', ttl=3600), None)
+        self.assertFalse(os.path.exists(fn))
+
+    def test_cache_read_through(self):
+        ydl = FakeYDL({
+            'cachedir': self.test_dir,
+        })
+        c = Cache(ydl)
+        obj = {'x': [1]}
+        c.store('test_cache', 'k', obj)
+        # Data is copied in and out of memory
+        obj['x'].append(2)
+        c.load('test_cache', 'k')['x'].append(3)
+        self.assertEqual(c.load('test_cache', 'k'), {'x': [1]})
+        # Entries stored by another cache (or process) are seen
+        Cache(ydl).store('test_cache', 'k', 'new')
+        os.utime(os.path.join(self.test_dir, 'test_cache', 'k.json'), (1000, 1000))
+        self.assertEqual(c.load('test_cache', 'k'), 'new')
+
+    def test_cache_remove_section(self):
+        ydl = FakeYDL({
+            'cachedir': self.test_dir,
+        })
+        c = Cache(ydl)
+        c.store('test_cache', 'k', 1)
+        c.store('test_cache2', 'k', 2)
+        c.remove('test_cache')
+        self.assertEqual(c.load('test_cache', 'k'), None)
+        self.assertEqual(c.load('test_cache2', 'k'), 2)
+
+    @unittest.skipIf(sqlite3 is None, 'sqlite3 is not available')
+    def test_sqlite_cache(self):
+        fn = os.path.join(self.test_dir, 'cache.sqlite')
+        ydl = FakeYDL({
+            'cachedir': fn,
+        })
+        c = Cache(ydl)
+        obj = {'x': 1, 'y': ['ä', '\\a', True]}
+        self.assertEqual(c.load('test_cache', 'k.'), None)
+        c.store('test_cache', 'k.', obj)
+        self.assertTrue(os.path.isfile(fn))
+        self.assertEqual(Cache(ydl).load('test_cache', 'k.'), obj)
+        self.assertEqual(c.load('test_cache2', 'k.'), None)
+
+        for key in ('a', 'b', 'c'):
+            c.store('test_cache', key, key, max_entries=4)
+        c._store._update('UPDATE cache SET used = 0 WHERE key = ?', ('k.',))
+        c.store('test_cache', 'd', 'd', max_entries=4)
+        self.assertEqual(Cache(ydl).load('test_cache', 'k.'), None)
+        self.assertEqual(c.load('test_cache', 'a'), 'a')
+
+        c._store._update('UPDATE cache SET stored = 0 WHERE key = ?', ('a',))
+        self.assertEqual(c.load('test_cache', 'a', ttl=3600), None)
+
+        c.remove('test_cache')
+        self.assertEqual(c.load('test_cache', 'b'), None)
+
+    def test_memory_lru(self):
+        lru = MemoryLRU(2)
+        lru.put('a', 1)
+        lru.put('b', 2)
+        self.assertEqual(lru.get('a'), 1)
+        lru.put('c', 3)
+        self.assertEqual(len(lru), 2)
+        self.assertEqual(lru.get('b'), None)
+        self.assertEqual(lru.get('a'), 1)
+        self.assertEqual(lru.get('c'), 3)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# coding: utf-8
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import re
+import sys
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from test.helper import try_rm
+from test.test_downloader_http import FakeLogger, http_server_port
+from test.test_remux import audio_pes, psi_tables, video_pes
+from youtube_dl import YoutubeDL
+from youtube_dl.compat import (
+    compat_http_server,
+    compat_struct_pack,
+)
+from youtube_dl.downloader.dash import DashSegmentsFD
+from youtube_dl.downloader import hls
+from youtube_dl.downloader.hls import HlsFD
+from youtube_dl.utils import encodeFilename
+import threading
+
+
+FRAG_COUNT = 20
+
+# Media sequence windows of a live playlist on successive loads
+LIVE_WINDOWS = [
+    (0, 3, False),
+    (1, 3, False),
+    (1, 3, False),
+    (6, 3, False),
+    (7, 3, True),
+]
+
+
+def fragment_data(index):
+    return ('fragment %d;' % index).encode('ascii') * 100
+
+
+def encrypted_fragment_data(index):
+    # Whole AES blocks
+    return fragment_data(index)[:1024]
+
+
+def ts_fragment_data(index):
+    return psi_tables() + audio_pes(90000 + 6000 * index, [b'audio'] * 3) + b''.join(
+        video_pes(90000 + 3000 * (index * 2 + i), i == 0) for i in range(2))
+
+
+def broken_ts_fragment_data(index):
+    # Video only, then audio with an invalid sampling frequency index
+    if index == 0:
+        return psi_tables() + b''.join(
+            video_pes(90000 + 3000 * i, i == 0) for i in range(2))
+    return ts_fragment_data(index).replace(b'\xff\xf1\x50', b'\xff\xf1\x7c')
+
+
+def fake_key(index):
+    return compat_struct_pack('>16B', *range(index, index + 16))
+
+
+class FakeCipher(object):
+    # XOR "cipher" chaining blocks like CBC and checking that it is fed
+    # whole blocks
+    def __init__(self, key, mode, iv):
+        self.key = bytearray(key)
+        self.previous = bytearray(iv)
+
+    def _xor(self, block):
+        return bytearray(b ^ k ^ p for b, k, p in zip(block, self.key, self.previous))
+
+    def decrypt(self, data):
+        assert len(data) % 16 == 0
+        result = bytearray()
+        for pos in range(0, len(data), 16):
+            block = bytearray(data[pos:pos + 16])
+            result += self._xor(block)
+            self.previous = block
+        return bytes(result)
+
+    def encrypt(self, data):
+        result = bytearray()
+        for pos in range(0, len(data), 16):
+            self.previous = self._xor(bytearray(data[pos:pos + 16]))
+            result += self.previous
+        return bytes(result)
+
+
+class FakeAES(object):
+    MODE_CBC = 2
+
+    new = FakeCipher
+
+
+class HTTPTestRequestHandler(compat_http_server.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_data(self, data, content_type='video/mp4'):
+        # Range requests are not supported
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', len(data))
+        self.end_headers()
+        if self.path in self.server.truncated:
+            # Drop the connection in the middle of the data once
+            self.server.truncated.remove(self.path)
+            data = data[:len(data) // 2 + 5]
+        self.wfile.write(data)
+
+    def do_GET(self):
+        mobj = re.match(r'^/frag(\d+)$', self.path)
+        if mobj:
+            index = int(mobj.group(1))
+            # Broken fragments are served only once
+            if index in self.server.broken and index not in self.server.served_broken:
+                self.server.served_broken.add(index)
+                self.send_response(404)
+                self.end_headers()
+                return
+            self.send_data(fragment_data(index))
+        elif self.path == '/index.m3u8':
+            playlist = '#EXTM3U\n#EXT-X-TARGETDURATION:10\n'
+            for i in range(FRAG_COUNT):
+                playlist += '#EXTINF:10,\nfrag%d\n' % i
+            playlist += '#EXT-X-ENDLIST\n'
+            self.send_data(playlist.encode('utf-8'), 'application/x-mpegURL')
+        elif self.path == '/enc.m3u8':
+            playlist = '#EXTM3U\n#EXT-X-TARGETDURATION:10\n'
+            for i in range(FRAG_COUNT):
+                # Keys are rotated on every segment but only two are in use
+                playlist += '#EXT-X-KEY:METHOD=AES-128,URI="key%d"\n#EXTINF:10,\nenc%d\n' % (i % 2, i)
+            playlist += '#EXT-X-ENDLIST\n'
+            self.send_data(playlist.encode('utf-8'), 'application/x-mpegURL')
+        elif re.match(r'^/key\d$', self.path):
+            self.server.key_loads += 1
+            self.send_data(fake_key(int(self.path[4:])), 'application/octet-stream')
+        elif re.match(r'^/enc\d+$', self.path):
+            index = int(self.path[4:])
+            self.send_data(FakeCipher(
+                fake_key(index % 2), FakeAES.MODE_CBC, compat_struct_pack('>8xq', index),
+            ).encrypt(encrypted_fragment_data(index)))
+        elif self.path in ('/ts.m3u8', '/broken-ts.m3u8'):
+            playlist = '#EXTM3U\n#EXT-X-TARGETDURATION:10\n'
+            for i in range(3):
+                playlist += '#EXTINF:10,\n%s%d\n' % (self.path[1:-5], i)
+            playlist += '#EXT-X-ENDLIST\n'
+            self.send_data(playlist.encode('utf-8'), 'application/x-mpegURL')
+        elif re.match(r'^/ts\d+$', self.path):
+            self.send_data(ts_fragment_data(int(self.path[3:])), 'video/mp2t')
+        elif re.match(r'^/broken-ts\d+$', self.path):
+            self.send_data(broken_ts_fragment_data(int(self.path[10:])), 'video/mp2t')
+        elif self.path == '/live.m3u8':
+            start, count, endlist = LIVE_WINDOWS[min(self.server.live_loads, len(LIVE_WINDOWS) - 1)]
+            self.server.live_loads += 1
+            playlist = '#EXTM3U\n#EXT-X-TARGETDURATION:0.1\n#EXT-X-MEDIA-SEQUENCE:%d\n' % start
+            for i in range(start, start + count):
+                playlist += '#EXTINF:0.1,\nfrag%d\n' % i
+            if endlist:
+                playlist += '#EXT-X-ENDLIST\n'
+            self.send_data(playlist.encode('utf-8'), 'application/x-mpegURL')
+        else:
+            assert False
+
+
+class TestFragmentFD(unittest.TestCase):
+    def setUp(self):
+        self.httpd = compat_http_server.HTTPServer(
+            ('127.0.0.1', 0), HTTPTestRequestHandler)
+        self.httpd.broken = set()
+        self.httpd.served_broken = set()
+        self.httpd.truncated = set()
+        self.httpd.live_loads = 0
+        self.httpd.key_loads = 0
+        self.port = http_server_port(self.httpd)
+        self.server_thread = threading.Thread(target=self.httpd.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def download(self, fd_class, params, info_dict):
+        params['logger'] = FakeLogger()
+        ydl = YoutubeDL(params)
+        downloader = fd_class(ydl, params)
+        filename = 'testfile.mp4'
+        try_rm(encodeFilename(filename))
+        try:
+            self.assertTrue(downloader.real_download(filename, info_dict))
+            with open(encodeFilename(filename), 'rb') as f:
+                return f.read()
+        finally:
+            try_rm(encodeFilename(filename))
+
+    def dash_info(self):
+        return {
+            'fragment_base_url': 'http://127.0.0.1:%d/' % self.port,
+            'fragments': [{'path': 'frag%d' % i} for i in range(FRAG_COUNT)],
+        }
+
+    def expected_data(self):
+        return b''.join(fragment_data(i) for i in range(FRAG_COUNT))
+
+    def test_dash_sequential(self):
+        self.assertEqual(
+            self.download(DashSegmentsFD, {}, self.dash_info()),
+            self.expected_data())
+
+    def test_dash_concurrent(self):
+        self.assertEqual(
+            self.download(DashSegmentsFD, {
+                'concurrent_fragment_downloads': 4,
+            }, self.dash_info()),
+            self.expected_data())
+
+    def test_dash_concurrent_retry(self):
+        self.httpd.broken.update([3, 7])
+        self.assertEqual(
+            self.download(DashSegmentsFD, {
+                'concurrent_fragment_downloads': 4,
+                'fragment_retries': 1,
+            }, self.dash_info()),
+            self.expected_data())
+
+    def test_dash_restarted_fragment(self):
+        # The fragment is downloaded again from its start
+        self.httpd.truncated.add('/frag3')
+        self.assertEqual(
+            self.download(DashSegmentsFD, {'retries': 1}, self.dash_info()),
+            self.expected_data())
+
+    def test_dash_concurrent_skip(self):
+        self.httpd.broken.update([3, 7])
+        self.assertEqual(
+            self.download(DashSegmentsFD, {
+                'concurrent_fragment_downloads': 4,
+                'fragment_retries': 0,
+            }, self.dash_info()),
+            b''.join(fragment_data(i) for i in range(FRAG_COUNT) if i not in (3, 7)))
+
+    def test_dash_template(self):
+        info_dict = {
+            'fragment_base_url': 'http://127.0.0.1:%d/' % self.port,
+            'fragments': [{'path': 'frag0'}],
+            'fragment_template': {
+                'media': 'frag%(Number)d',
+                'start_number': 1,
+                'total_number': FRAG_COUNT - 1,
+                'segment_duration': 10.0,
+            },
+        }
+        for workers in (1, 4):
+            self.assertEqual(
+                self.download(DashSegmentsFD, {
+                    'concurrent_fragment_downloads': workers,
+                }, info_dict),
+                self.expected_data())
+
+    def test_no_fragment_files(self):
+        self.download(DashSegmentsFD, {}, self.dash_info())
+        self.assertFalse([
+            fn for fn in os.listdir('.') if fn.startswith('testfile.mp4.part-Frag')])
+
+    def test_keep_fragments(self):
+        self.assertEqual(
+            self.download(DashSegmentsFD, {
+                'keep_fragments': True,
+                'concurrent_fragment_downloads': 4,
+            }, self.dash_info()),
+            self.expected_data())
+        for i in range(FRAG_COUNT):
+            frag_filename = 'testfile.mp4.part-Frag%d' % i
+            with open(frag_filename, 'rb') as f:
+                self.assertEqual(f.read(), fragment_data(i))
+            try_rm(frag_filename)
+
+    def test_hls_concurrent(self):
+        self.assertEqual(
+            self.download(HlsFD, {
+                'concurrent_fragment_downloads': 3,
+            }, {
+                'url': 'http://127.0.0.1:%d/index.m3u8' % self.port,
+            }),
+            self.expected_data())
+
+    def test_hls_encrypted(self):
+        orig = getattr(hls, 'AES', None), hls.can_decrypt_frag
+        hls.AES, hls.can_decrypt_frag = FakeAES, True
+        try:
+            for params in ({}, {'concurrent_fragment_downloads': 4}, {'keep_fragments': True}, {'retries': 1}):
+                self.httpd.key_loads = 0
+                if params.get('retries'):
+                    # Decryption starts over with the fragment
+                    self.httpd.truncated.add('/enc3')
+                # Small blocks so that fragments arrive in pieces
+                params['buffersize'] = 100
+                self.assertEqual(
+                    self.download(HlsFD, params, {
+                        'url': 'http://127.0.0.1:%d/enc.m3u8' % self.port,
+                    }),
+                    b''.join(encrypted_fragment_data(i) for i in range(FRAG_COUNT)))
+                self.assertEqual(self.httpd.key_loads, 2)
+                for i in range(FRAG_COUNT):
+                    try_rm('testfile.mp4.part-Frag%d' % i)
+        finally:
+            hls.AES, hls.can_decrypt_frag = orig
+
+    def test_hls_remux(self):
+        info_dict = {
+            'url': 'http://127.0.0.1:%d/ts.m3u8' % self.port,
+            'ext': 'mp4',
+        }
+        data = self.download(HlsFD, {}, info_dict)
+        self.assertEqual(data[4:8], b'ftyp')
+        # A fragment for each of the first two TS fragments and the last one
+        self.assertEqual(data.count(b'moof'), 3)
+        self.assertTrue(info_dict.get('__remuxed'))
+
+        info_dict = {
+            'url': 'http://127.0.0.1:%d/ts.m3u8' % self.port,
+            'ext': 'mp4',
+        }
+        self.assertEqual(
+            self.download(HlsFD, {'hls_use_mpegts': True}, info_dict),
+            b''.join(ts_fragment_data(i) for i in range(3)))
+        self.assertFalse(info_dict.get('__remuxed'))
+
+        # Fragments that are not MPEG-TS are left alone
+        info_dict = {
+            'url': 'http://127.0.0.1:%d/index.m3u8' % self.port,
+            'ext': 'mp4',
+        }
+        self.assertEqual(self.download(HlsFD, {}, info_dict), self.expected_data())
+        self.assertFalse(info_dict.get('__remuxed'))
+
+        # Nor are streams the remuxer fails on after their first fragment
+        info_dict = {
+            'url': 'http://127.0.0.1:%d/broken-ts.m3u8' % self.port,
+            'ext': 'mp4',
+        }
+        self.assertEqual(
+            self.download(HlsFD, {}, info_dict),
+            b''.join(broken_ts_fragment_data(i) for i in range(3)))
+        self.assertFalse(info_dict.get('__remuxed'))
+
+    def test_hls_live(self):
+        gaps = []
+
+        class LiveHlsFD(HlsFD):
+            def report_live_gap(self, count):
+                gaps.append(count)
+
+        for workers in (1, 3):
+            self.httpd.live_loads = 0
+            del gaps[:]
+            self.assertEqual(
+                self.download(LiveHlsFD, {
+                    'concurrent_fragment_downloads': workers,
+                }, {
+                    'url': 'http://127.0.0.1:%d/live.m3u8' % self.port,
+                    'is_live': True,
+                }),
+                b''.join(fragment_data(i) for i in (0, 1, 2, 3, 6, 7, 8, 9)))
+            self.assertEqual(self.httpd.live_loads, len(LIVE_WINDOWS))
+            self.assertEqual(gaps, [2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,9 +13,16 @@ from test.helper import try_rm
 from youtube_dl import YoutubeDL
 from youtube_dl.compat import compat_http_server
 from youtube_dl.downloader.http import HttpFD
-from youtube_dl.utils import encodeFilename
+from youtube_dl.utils import DownloadError, encodeFilename
+import json
 import ssl
 import threading
+import time
+
+try:
+    import socketserver
+except ImportError:  # Python 2
+    import SocketServer as socketserver
 
 TEST_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -31,6 +38,9 @@ def http_server_port(httpd):
 
 TEST_SIZE = 10 * 1024
 
+SEGMENTED_SIZE = 4 * 1024 * 1024 + 1000
+SEGMENTED_DATA = bytes(bytearray(i % 251 for i in range(SEGMENTED_SIZE)))
+
 
 class HTTPTestRequestHandler(compat_http_server.BaseHTTPRequestHandler):
     def log_message(self, format, *args):
@@ -63,6 +73,45 @@ class HTTPTestRequestHandler(compat_http_server.BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(b'#' * size)
 
+    def serve_segmented(self, range=True):
+        mobj = re.match(r'^bytes=(\d+)-(\d*)', self.headers.get('Range') or '')
+        if not mobj or not range:
+            self.send_response(200)
+            self.send_header('Content-Type', 'video/mp4')
+            self.send_header('Content-Length', SEGMENTED_SIZE)
+            self.end_headers()
+            self.wfile.write(SEGMENTED_DATA)
+            return
+        start = int(mobj.group(1))
+        if start >= SEGMENTED_SIZE:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */%d' % SEGMENTED_SIZE)
+            self.end_headers()
+            return
+        end = min(int(mobj.group(2) or SEGMENTED_SIZE - 1), SEGMENTED_SIZE - 1)
+        self.server.ranges.append((start, end))
+        data = SEGMENTED_DATA[start:end + 1]
+        self.send_response(206)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, SEGMENTED_SIZE))
+        self.send_header('Content-Length', len(data))
+        self.end_headers()
+        if start in self.server.truncated:
+            # Drop the connection in the middle of the range once
+            self.server.truncated.remove(start)
+            data = data[:len(data) // 2]
+        self.wfile.write(data)
+
+    def serve_slowly(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', TEST_SIZE)
+        self.end_headers()
+        for _ in range(10):
+            self.wfile.write(b'#' * (TEST_SIZE // 10))
+            self.wfile.flush()
+            time.sleep(0.05)
+
     def do_GET(self):
         if self.path == '/regular':
             self.serve()
@@ -72,6 +121,12 @@ class HTTPTestRequestHandler(compat_http_server.BaseHTTPRequestHandler):
             self.serve(range=False)
         elif self.path == '/no-range-no-content-length':
             self.serve(range=False, content_length=False)
+        elif self.path == '/slow':
+            self.serve_slowly()
+        elif self.path == '/segmented':
+            self.serve_segmented()
+        elif self.path == '/segmented-no-range':
+            self.serve_segmented(range=False)
         else:
             assert False
 
@@ -121,5 +176,164 @@ class TestHttpFD(unittest.TestCase):
         })
 
 
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, compat_http_server.HTTPServer):
+    daemon_threads = True
+
+
+class TestConcurrentFormats(unittest.TestCase):
+    def setUp(self):
+        self.httpd = ThreadingHTTPServer(
+            ('127.0.0.1', 0), HTTPTestRequestHandler)
+        self.port = http_server_port(self.httpd)
+        self.server_thread = threading.Thread(target=self.httpd.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def test_concurrent_formats(self):
+        statuses = []
+        ydl = YoutubeDL({
+            'logger': FakeLogger(),
+            'outtmpl': 'testfile.%(ext)s',
+            'concurrent_format_downloads': True,
+            # Formats are not merged without ffmpeg
+            'ffmpeg_location': 'nonexistent',
+            'progress_hooks': [statuses.append],
+        })
+        url = 'http://127.0.0.1:%d/slow' % self.port
+        filenames = ['testfile.fvideo.mp4', 'testfile.faudio.m4a']
+        for filename in filenames:
+            try_rm(encodeFilename(filename))
+        try:
+            ydl.process_info({
+                'id': 'testid',
+                'title': 'test',
+                'ext': 'mp4',
+                'extractor': 'test',
+                'requested_formats': [
+                    {'format_id': 'video', 'url': url, 'ext': 'mp4'},
+                    {'format_id': 'audio', 'url': url, 'ext': 'm4a'},
+                ],
+            })
+            for filename in filenames:
+                self.assertEqual(os.path.getsize(encodeFilename(filename)), TEST_SIZE)
+        finally:
+            for filename in filenames:
+                try_rm(encodeFilename(filename))
+
+        # Both downloads are in progress before any of them finishes
+        first_finished = next(
+            i for i, s in enumerate(statuses) if s['status'] == 'finished')
+        self.assertEqual(
+            set(s['filename'] for s in statuses[:first_finished]), set(filenames))
+
+
+class TestSegmentedHttpFD(unittest.TestCase):
+    def setUp(self):
+        self.httpd = ThreadingHTTPServer(
+            ('127.0.0.1', 0), HTTPTestRequestHandler)
+        self.httpd.ranges = []
+        self.httpd.truncated = set()
+        self.port = http_server_port(self.httpd)
+        self.server_thread = threading.Thread(target=self.httpd.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.filename = 'testfile.mp4'
+        self.tearDown()
+
+    def tearDown(self):
+        for fn in (self.filename, self.filename + '.part', self.filename + '.ytdl'):
+            try_rm(encodeFilename(fn))
+
+    def download(self, params, ep='segmented', ydl_class=YoutubeDL):
+        params['logger'] = FakeLogger()
+        ydl = ydl_class(params)
+        downloader = HttpFD(ydl, params)
+        self.assertTrue(downloader.real_download(self.filename, {
+            'url': 'http://127.0.0.1:%d/%s' % (self.port, ep),
+        }))
+        self.assertFalse(os.path.exists(encodeFilename(self.filename + '.ytdl')))
+        with open(encodeFilename(self.filename), 'rb') as f:
+            return f.read()
+
+    def test_segmented(self):
+        self.assertEqual(self.download({'http_connections': 4}), SEGMENTED_DATA)
+        # The probe for the size plus one range per connection
+        self.assertEqual(len(self.httpd.ranges), 5)
+
+    def test_segmented_retry(self):
+        segment_size = -(-SEGMENTED_SIZE // 4)
+        self.httpd.truncated.add(segment_size)
+        self.assertEqual(
+            self.download({'http_connections': 4, 'retries': 1}), SEGMENTED_DATA)
+        # The truncated range is resumed where it was interrupted
+        self.assertEqual(len(self.httpd.ranges), 6)
+        self.assertTrue(any(
+            segment_size < start < 2 * segment_size
+            for start, end in self.httpd.ranges))
+
+    def test_segmented_resume(self):
+        segment_size = -(-SEGMENTED_SIZE // 2)
+        segments = [{
+            'start': start,
+            'end': min(start + segment_size, SEGMENTED_SIZE) - 1,
+            'downloaded': 1000,
+        } for start in (0, segment_size)]
+        data = bytearray(SEGMENTED_SIZE)
+        for seg in segments:
+            data[seg['start']:seg['start'] + 1000] = SEGMENTED_DATA[seg['start']:seg['start'] + 1000]
+        with open(encodeFilename(self.filename + '.part'), 'wb') as f:
+            f.write(bytes(data))
+        with open(encodeFilename(self.filename + '.ytdl'), 'w') as f:
+            json.dump({'downloader': {'http_segments': {
+                'total': SEGMENTED_SIZE,
+                'segments': segments,
+            }}}, f)
+        self.assertEqual(self.download({'http_connections': 2}), SEGMENTED_DATA)
+        self.assertEqual(
+            sorted(self.httpd.ranges[1:]),
+            [(seg['start'] + 1000, seg['end']) for seg in segments])
+
+    def test_segmented_resume_sequentially(self):
+        # Interrupt a segmented download
+        self.httpd.truncated.add(-(-SEGMENTED_SIZE // 2))
+        params = {'http_connections': 2, 'logger': FakeLogger()}
+        downloader = HttpFD(YoutubeDL(params), params)
+        self.assertRaises(DownloadError, downloader.real_download, self.filename, {
+            'url': 'http://127.0.0.1:%d/segmented' % self.port,
+        })
+        self.assertEqual(
+            os.path.getsize(encodeFilename(self.filename + '.part')), SEGMENTED_SIZE)
+        # The preallocated file is not taken for an almost complete one
+        self.assertEqual(self.download({}), SEGMENTED_DATA)
+
+    def test_no_range_support(self):
+        self.assertEqual(
+            len(self.download({'http_connections': 4}, 'no-range')), TEST_SIZE)
+
+        read = []
+
+        class CountingYoutubeDL(YoutubeDL):
+            def urlopen(self, req):
+                response = super(CountingYoutubeDL, self).urlopen(req)
+                response_read = response.read
+
+                def counting_read(*args):
+                    data = response_read(*args)
+                    read.append(len(data))
+                    return data
+                response.read = counting_read
+                return response
+
+        self.assertEqual(
+            self.download({'http_connections': 4}, 'segmented-no-range', CountingYoutubeDL),
+            SEGMENTED_DATA)
+        # The response to the probe for the size is not read
+        self.assertEqual(sum(read), SEGMENTED_SIZE)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -10,11 +10,42 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from youtube_dl import YoutubeDL
 from youtube_dl.compat import compat_http_server, compat_urllib_request
+import gzip
+import io
 import ssl
 import threading
+import zlib
 
 TEST_DIR = os.path.dirname(os.path.abspath(__file__))
 
+COMPRESSED_CONTENT = b'<html><video src="/vid.mp4" /></html>' * 1000
+
+
+def _gzip(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def _raw_deflate(data):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+COMPRESSED_RESPONSES = {
+    '/gzip': ('gzip', _gzip(COMPRESSED_CONTENT)),
+    '/gzip-junk': ('gzip', _gzip(COMPRESSED_CONTENT) + b'\x00junk' * 100),
+    '/gzip-members': ('gzip', _gzip(COMPRESSED_CONTENT[:1000]) + _gzip(COMPRESSED_CONTENT[1000:])),
+    '/deflate': ('deflate', zlib.compress(COMPRESSED_CONTENT)),
+    '/deflate-raw': ('deflate', _raw_deflate(COMPRESSED_CONTENT)),
+}
+
+TRUNCATED_RESPONSES = {
+    '/gzip-truncated': ('gzip', _gzip(COMPRESSED_CONTENT)[:-100]),
+    '/deflate-truncated': ('deflate', zlib.compress(COMPRESSED_CONTENT)[:-100]),
+}
+
 
 def http_server_port(httpd):
     if os.name == 'java' and isinstance(httpd.socket, ssl.SSLSocket):
@@ -51,6 +82,14 @@ class HTTPTestRequestHandler(compat_http_server.BaseHTTPRequestHandler):
             self.send_response(302)
             self.send_header(b'Location', new_url.encode('utf-8'))
             self.end_headers()
+        elif self.path in COMPRESSED_RESPONSES or self.path in TRUNCATED_RESPONSES:
+            encoding, data = COMPRESSED_RESPONSES.get(self.path) or TRUNCATED_RESPONSES[self.path]
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Encoding', encoding)
+            self.send_header('Content-Length', len(data))
+            self.end_headers()
+            self.wfile.write(data)
         elif self.path == '/%E4%B8%AD%E6%96%87.html':
             self.send_response(200)
             self.send_header('Content-Type', 'text/html; charset=utf-8')
@@ -89,6 +128,20 @@ class TestHTTP(unittest.TestCase):
         r = ydl.extract_info('http://127.0.0.1:%d/302' % self.port)
         self.assertEqual(r['entries'][0]['url'], 'http://127.0.0.1:%d/vid.mp4' % self.port)
 
+    def test_content_encoding(self):
+        ydl = YoutubeDL({'logger': FakeLogger()})
+        for path in sorted(COMPRESSED_RESPONSES):
+            resp = ydl.urlopen('http://127.0.0.1:%d%s' % (self.port, path))
+            self.assertEqual(resp.headers.get('Content-Encoding'), None)
+            self.assertEqual(resp.read(10), COMPRESSED_CONTENT[:10])
+            self.assertEqual(resp.read(), COMPRESSED_CONTENT[10:], path)
+            resp.close()
+
+        for path in sorted(TRUNCATED_RESPONSES):
+            resp = ydl.urlopen('http://127.0.0.1:%d%s' % (self.port, path))
+            self.assertRaises((IOError, zlib.error), resp.read)
+            resp.close()
+
 
 class TestHTTPS(unittest.TestCase):
     def setUp(self):
@@ -170,5 +223,59 @@ class TestProxy(unittest.TestCase):
         self.assertEqual(response, 'normal: http://xn--fiq228c.tw/')
 
 
+class KeepAliveRequestHandler(compat_http_server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Do not let an idle connection block the single threaded server forever
+    timeout = 5
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        # Respond with the client port so that connection reuse can be checked
+        data = ('%d' % self.client_address[1]).encode('ascii') * 100
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', len(data))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class TestKeepAlive(unittest.TestCase):
+    def setUp(self):
+        self.httpd = compat_http_server.HTTPServer(
+            ('127.0.0.1', 0), KeepAliveRequestHandler)
+        self.port = http_server_port(self.httpd)
+        self.server_thread = threading.Thread(target=self.httpd.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+
+    def tearDown(self):
+        self.ydl.close_connections()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def client_port(self, ydl, read=True):
+        resp = ydl.urlopen('http://127.0.0.1:%d/' % self.port)
+        data = resp.read() if read else resp.read(5)
+        resp.close()
+        return data[:5]
+
+    @unittest.skipIf(sys.version_info < (3, 0), 'Python 2 does not reuse connections')
+    def test_keep_alive(self):
+        ydl = self.ydl = YoutubeDL({'logger': FakeLogger()})
+        self.assertEqual(self.client_port(ydl), self.client_port(ydl))
+
+    @unittest.skipIf(sys.version_info < (3, 0), 'Python 2 does not reuse connections')
+    def test_partially_read_response(self):
+        ydl = self.ydl = YoutubeDL({'logger': FakeLogger()})
+        first = self.client_port(ydl, read=False)
+        self.assertNotEqual(first, self.client_port(ydl))
+
+    def test_no_keep_alive(self):
+        ydl = self.ydl = YoutubeDL({'logger': FakeLogger(), 'no_keep_alive': True})
+        self.assertNotEqual(self.client_port(ydl), self.client_port(ydl))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -9,6 +9,7 @@ import unittest
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from youtube_dl.jsinterp import JSInterpreter
+from youtube_dl.utils import ExtractorError
 
 
 class TestJSInterpreter(unittest.TestCase):
@@ -112,6 +113,22 @@ class TestJSInterpreter(unittest.TestCase):
         ''')
         self.assertEqual(jsi.call_function('z'), 5)
 
+    def test_compiled_function(self):
+        jsi = JSInterpreter('''
+        function x(a) {
+            var b = [1, 2];
+            b[0] = (a + 1) * 2;
+            return b;
+            unsupported ! statement
+        }''')
+        f = jsi.extract_function('x')
+        # Functions are compiled once and can be called repeatedly
+        self.assertEqual(f([1]), [4, 2])
+        self.assertEqual(f([2]), [6, 2])
+
+        f = jsi.build_function(['a'], 'a = 1; unsupported ! statement; return a')
+        self.assertRaises(ExtractorError, f, [0])
+
 
 if __name__ == '__main__':
     unittest.main()
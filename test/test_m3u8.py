@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+from youtube_dl.m3u8 import (
+    M3U8Parser,
+    parse_m3u8,
+)
+
+
+MEDIA_PLAYLIST = '''#EXTM3U
+#EXT-X-VERSION:4
+#EXT-X-TARGETDURATION:10
+#EXT-X-MEDIA-SEQUENCE:7
+#EXTINF:10.0,
+seg7.ts
+#EXT-X-KEY:METHOD=AES-128,URI="key.bin",IV=0x0102
+#EXTINF:9.5,
+https://cdn.example.com/seg8.ts
+#UPLYNK-SEGMENT:abc,00000000,ad
+#EXTINF:5,
+ad.ts
+#EXT-X-KEY:METHOD=NONE
+#EXT-X-BYTERANGE:100@200
+#EXTINF:10,
+media.ts
+#EXT-X-BYTERANGE:50
+#EXTINF:10,
+media.ts
+#EXT-X-ENDLIST
+'''
+
+
+class TestM3U8Parser(unittest.TestCase):
+    def test_media_playlist(self):
+        playlist = parse_m3u8(MEDIA_PLAYLIST, 'http://example.com/hls/index.m3u8')
+        self.assertTrue(playlist.is_media_playlist)
+        self.assertTrue(playlist.endlist)
+        self.assertEqual(playlist.target_duration, 10)
+        self.assertEqual(playlist.media_sequence, 7)
+        self.assertEqual(playlist.key_methods, set(['AES-128', 'NONE']))
+        self.assertEqual(playlist.ad_segments, 1)
+
+        segments = playlist.segments
+        self.assertEqual(len(segments), 5)
+        self.assertEqual(
+            [s.url for s in segments], [
+                'http://example.com/hls/seg7.ts',
+                'https://cdn.example.com/seg8.ts',
+                'http://example.com/hls/ad.ts',
+                'http://example.com/hls/media.ts',
+                'http://example.com/hls/media.ts',
+            ])
+        self.assertEqual([s.media_sequence for s in segments], [7, 8, 9, 9, 10])
+        self.assertEqual([s.is_ad for s in segments], [False, False, True, False, False])
+        self.assertEqual([s.duration for s in segments], [10, 9.5, 5, 10, 10])
+
+        self.assertEqual(segments[0].key, None)
+        key = segments[1].key
+        self.assertEqual(key['METHOD'], 'AES-128')
+        self.assertEqual(key['URI'], 'http://example.com/hls/key.bin')
+        self.assertEqual(key['IV'], b'\x00' * 14 + b'\x01\x02')
+        self.assertTrue(segments[2].key is key)
+        self.assertEqual(segments[3].key, None)
+
+        self.assertEqual(segments[2].byte_range, None)
+        self.assertEqual(segments[3].byte_range, {'start': 200, 'end': 300})
+        self.assertEqual(segments[4].byte_range, {'start': 300, 'end': 350})
+
+    def test_incremental_feed(self):
+        expected = parse_m3u8(MEDIA_PLAYLIST, 'http://example.com/')
+        for chunk_size in (1, 3, 17):
+            parser = M3U8Parser('http://example.com/')
+            for i in range(0, len(MEDIA_PLAYLIST), chunk_size):
+                parser.feed(MEDIA_PLAYLIST[i:i + chunk_size])
+            playlist = parser.close()
+            self.assertEqual(playlist.segments, expected.segments)
+            self.assertEqual(playlist.tags, expected.tags)
+
+    def test_master_playlist(self):
+        playlist = parse_m3u8('''#EXTM3U
+#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aac",NAME="English",URI="audio/en.m3u8"
+#EXT-X-STREAM-INF:BANDWIDTH=1280000,CODECS="avc1.4d401f,mp4a.40.2",AUDIO="aac"
+low/index.m3u8
+#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aac",NAME="Deutsch",URI="audio/de.m3u8"
+#EXT-X-STREAM-INF:BANDWIDTH=2560000,RESOLUTION=1280x720
+http://other.example.com/hi/index.m3u8
+''', 'http://example.com/master.m3u8')
+        self.assertFalse(playlist.is_media_playlist)
+        self.assertEqual(playlist.segments, [])
+        self.assertEqual([r['NAME'] for r in playlist.renditions], ['English', 'Deutsch'])
+        self.assertEqual(
+            [(attrs['BANDWIDTH'], url, before) for attrs, url, before in playlist.variants], [
+                ('1280000', 'http://example.com/low/index.m3u8', 1),
+                ('2560000', 'http://other.example.com/hi/index.m3u8', 2),
+            ])
+
+
+if __name__ == '__main__':
+    unittest.main()
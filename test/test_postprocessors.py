@@ -4,14 +4,138 @@ from __future__ import unicode_literals
 
 # Allow direct execution
 import os
+import shutil
 import sys
+import tempfile
 import unittest
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from youtube_dl.postprocessor import MetadataFromTitlePP
+from test.helper import FakeYDL
+from youtube_dl.postprocessor import ffmpeg
+from youtube_dl.postprocessor import (
+    ExecAfterDownloadPP,
+    FFmpegEmbedSubtitlePP,
+    FFmpegFixupStretchedPP,
+    FFmpegFusedPP,
+    FFmpegMergerPP,
+    FFmpegMetadataPP,
+    FFmpegPostProcessor,
+    MetadataFromTitlePP,
+    fuse_postprocessors,
+)
 
 
 class TestMetadataFromTitle(unittest.TestCase):
     def test_format_to_regex(self):
         pp = MetadataFromTitlePP(None, '%(title)s - %(artist)s')
         self.assertEqual(pp._titleregex, '(?P<title>.+)\ \-\ (?P<artist>.+)')
+
+
+class TestFFmpegPlan(unittest.TestCase):
+    def test_fuse_postprocessors(self):
+        ydl = FakeYDL()
+        title_pp = MetadataFromTitlePP(ydl, '%(title)s')
+        exec_pp = ExecAfterDownloadPP(ydl, 'true')
+        pps = [
+            FFmpegMergerPP(ydl), FFmpegFixupStretchedPP(ydl), FFmpegMetadataPP(ydl),
+            title_pp, FFmpegMergerPP(ydl), FFmpegMetadataPP(ydl), FFmpegMergerPP(ydl),
+            exec_pp]
+        chain = fuse_postprocessors(pps, ydl)
+        self.assertEqual(len(chain), 5)
+        self.assertTrue(isinstance(chain[0], FFmpegFusedPP))
+        self.assertEqual(chain[0]._pps, pps[:3])
+        self.assertEqual(chain[1], title_pp)
+        self.assertEqual(chain[2]._pps, pps[4:6])
+        self.assertEqual(chain[3:], pps[6:])
+
+    def test_run_plan(self):
+        ydl = FakeYDL()
+        commands = []
+
+        def run_ffmpeg_multiple_files(input_paths, out_path, opts):
+            commands.append((input_paths, out_path, opts))
+
+        pp = FFmpegFusedPP(ydl, [
+            FFmpegMergerPP(ydl), FFmpegFixupStretchedPP(ydl),
+            FFmpegEmbedSubtitlePP(ydl), FFmpegMetadataPP(ydl)])
+        pp.run_ffmpeg_multiple_files = run_ffmpeg_multiple_files
+        # Nothing to remux, ffmpeg is not run
+        info = {'filepath': 'test.mp4', 'ext': 'mp4'}
+        self.assertEqual(FFmpegMetadataPP(ydl).run(info), ([], info))
+        self.assertEqual(commands, [])
+
+        info = {
+            'filepath': 'test.mp4',
+            'ext': 'mp4',
+            'title': 'Test',
+            'stretched_ratio': 2,
+            '__files_to_merge': ['test.f1.mp4', 'test.f2.m4a'],
+            'requested_subtitles': {'en': {'ext': 'vtt'}},
+        }
+        try:
+            pp.run(info)
+        except OSError:
+            pass  # No temporary file to rename
+        self.assertEqual(commands, [(
+            ['test.f1.mp4', 'test.f2.m4a', 'test.en.vtt'], 'test.temp.mp4', [
+                '-map', '0:v:0', '-map', '1:a:0', '-map', '2:0', '-c', 'copy',
+                '-aspect', '2.000000', '-c:s', 'mov_text',
+                '-metadata:s:s:0', 'language=eng', '-metadata', 'title=Test'])])
+
+
+class TestFFmpegCapabilities(unittest.TestCase):
+    def test_probe_once(self):
+        location = tempfile.mkdtemp()
+        probes = []
+        orig_get_exe_version, orig_path = ffmpeg.get_exe_version, os.environ.get('PATH')
+
+        def get_exe_version(exe, *args, **kwargs):
+            probes.append(exe)
+            return '4.0' if os.path.basename(exe) == 'ffmpeg' else False
+
+        ffmpeg.get_exe_version = get_exe_version
+        try:
+            ydl = FakeYDL({'ffmpeg_location': location})
+            for pp_class in (FFmpegMergerPP, FFmpegMetadataPP, FFmpegFusedPP):
+                pp = pp_class(ydl)
+                self.assertEqual(pp.basename, 'ffmpeg')
+                self.assertFalse(pp.probe_available)
+            self.assertEqual(len(probes), 4)
+            versions = FFmpegPostProcessor.get_versions(ydl)
+            versions['rtmpdump'] = False
+            self.assertEqual(FFmpegPostProcessor.get_versions(ydl)['ffmpeg'], '4.0')
+            self.assertFalse('rtmpdump' in FFmpegPostProcessor.get_versions(ydl))
+            self.assertEqual(len(probes), 4)
+
+            # Executables are looked for again in a new PATH
+            os.environ['PATH'] = location
+            FFmpegMergerPP(ydl)
+            self.assertEqual(len(probes), 8)
+        finally:
+            ffmpeg.get_exe_version = orig_get_exe_version
+            if orig_path is None:
+                del os.environ['PATH']
+            else:
+                os.environ['PATH'] = orig_path
+            shutil.rmtree(location)
+
+    def test_parse_capabilities(self):
+        self.assertEqual(ffmpeg._parse_capabilities('muxers', '''File formats:
+ D. = Demuxing supported
+ .E = Muxing supported
+ --
+ DE matroska        Matroska
+  E mp4             MP4 (MPEG-4 Part 14)
+ D  mpegts          MPEG-TS (MPEG-2 Transport Stream)
+'''), set(['matroska', 'mp4']))
+        self.assertEqual(ffmpeg._parse_capabilities('encoders', '''Encoders:
+ V..... = Video
+ A..... = Audio
+ ------
+ V....D libx264              libx264 H.264 / AVC / MPEG-4 AVC
+ A..... libmp3lame           libmp3lame MP3 (MPEG audio layer 3) (codec mp3)
+'''), set(['libx264', 'libmp3lame']))
+        self.assertEqual(ffmpeg._parse_capabilities('bsfs', '''Bitstream filters:
+aac_adtstoasc
+h264_mp4toannexb
+'''), set(['aac_adtstoasc', 'h264_mp4toannexb']))
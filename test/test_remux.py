@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# coding: utf-8
+from __future__ import unicode_literals
+
+# Allow direct execution
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from youtube_dl.compat import compat_struct_pack, compat_struct_unpack
+from youtube_dl.downloader.ism import extract_box_data
+from youtube_dl.downloader.remux import (
+    RemuxError,
+    TSRemuxer,
+    parse_h264_sps,
+)
+
+
+VIDEO_PID, AUDIO_PID, PMT_PID = 0x100, 0x101, 0x1000
+
+# Baseline profile, 320x240
+SPS = b'\x67\x42\xc0\x1e\xf4\x0a\x0f\xc8'
+# High profile, 1920x1088 cropped to 1080
+SPS_CROPPED = b'\x67\x64\x00\x28\xac\xd9\x40\x78\x02\x27\xe5\x40'
+PPS = b'\x68\xce\x3c\x80'
+IDR = b'\x65\x88\x84\x00\x33\xff'
+NON_IDR = b'\x41\x9a\x02\x04'
+
+
+def ts_packets(pid, payload):
+    packets = []
+    for pos in range(0, len(payload), 184):
+        chunk = payload[pos:pos + 184]
+        header = compat_struct_pack(
+            '>BHB', 0x47, (0x4000 if pos == 0 else 0) | pid, 0x10 | (len(packets) & 0xf))
+        stuffing = 184 - len(chunk)
+        if stuffing:
+            # Adaptation field made of stuffing bytes
+            header = header[:3] + compat_struct_pack('>B', 0x30 | (len(packets) & 0xf))
+            header += compat_struct_pack('>B', stuffing - 1)
+            if stuffing > 1:
+                header += b'\x00' + b'\xff' * (stuffing - 2)
+        packets.append(header + chunk)
+    return b''.join(packets)
+
+
+def psi_tables():
+    pat = b'\x00\x01\xc1\x00\x00' + compat_struct_pack('>HH', 1, 0xe000 | PMT_PID)
+    pat = compat_struct_pack('>BH', 0, 0xb000 | (len(pat) + 4)) + pat + b'\x00' * 4
+    pmt = b'\x00\x01\xc1\x00\x00' + compat_struct_pack('>HH', 0xe000 | VIDEO_PID, 0xf000)
+    pmt += compat_struct_pack('>BHH', 0x1b, 0xe000 | VIDEO_PID, 0xf000)
+    pmt += compat_struct_pack('>BHH', 0x0f, 0xe000 | AUDIO_PID, 0xf000)
+    pmt += compat_struct_pack('>BHH', 0x15, 0xe000 | 0x102, 0xf000)  # ID3
+    pmt = compat_struct_pack('>BH', 2, 0xb000 | (len(pmt) + 4)) + pmt + b'\x00' * 4
+    return ts_packets(0, b'\x00' + pat) + ts_packets(PMT_PID, b'\x00' + pmt)
+
+
+def timestamp(prefix, ts):
+    return compat_struct_pack(
+        '>BHH', (prefix << 4) | ((ts >> 29) & 0x0e) | 1,
+        ((ts >> 14) & 0xfffe) | 1, ((ts << 1) & 0xfffe) | 1)
+
+
+def pes(stream_id, payload, pts, dts=None):
+    if dts is None:
+        header = b'\x80\x80\x05' + timestamp(2, pts)
+    else:
+        header = b'\x80\xc0\x0a' + timestamp(3, pts) + timestamp(1, dts)
+    return b'\x00\x00\x01' + compat_struct_pack('>BH', stream_id, 0) + header + payload
+
+
+def video_pes(dts, keyframe):
+    nals = [b'\x09\xf0']
+    if keyframe:
+        nals.extend([SPS, PPS, IDR])
+    else:
+        nals.append(NON_IDR)
+    return ts_packets(VIDEO_PID, pes(
+        0xe0, b''.join(b'\x00\x00\x00\x01' + nal for nal in nals), dts + 3000, dts))
+
+
+def adts_frame(data):
+    # AAC LC, 44100 Hz, stereo
+    length = len(data) + 7
+    return compat_struct_pack(
+        '>BBBBBBB', 0xff, 0xf1, 0x50, 0x80 | (length >> 11),
+        (length >> 3) & 0xff, ((length & 7) << 5) | 0x1f, 0xfc) + data
+
+
+def audio_pes(pts, frames):
+    return ts_packets(AUDIO_PID, pes(0xc0, b''.join(adts_frame(f) for f in frames), pts))
+
+
+def boxes(data):
+    pos = 0
+    while pos < len(data):
+        size, box_type = compat_struct_unpack('>I4s', data[pos:pos + 8])
+        yield box_type, data[pos + 8:pos + size]
+        pos += size
+
+
+def trafs(moof):
+    result = {}
+    for box_type, traf in boxes(moof):
+        if box_type != b'traf':
+            continue
+        track_id = compat_struct_unpack('>I', extract_box_data(traf, [b'tfhd'])[4:8])[0]
+        decode_time = compat_struct_unpack('>Q', extract_box_data(traf, [b'tfdt'])[4:12])[0]
+        trun = extract_box_data(traf, [b'trun'])
+        count = compat_struct_unpack('>I', trun[4:8])[0]
+        entry_size = (len(trun) - 12) // count
+        samples = [
+            compat_struct_unpack('>%dI' % (entry_size // 4), trun[12 + i * entry_size:12 + (i + 1) * entry_size])
+            for i in range(count)]
+        result[track_id] = (decode_time, samples)
+    return result
+
+
+class TestRemux(unittest.TestCase):
+    def test_parse_h264_sps(self):
+        self.assertEqual(parse_h264_sps(SPS), (320, 240))
+        self.assertEqual(parse_h264_sps(SPS_CROPPED), (1920, 1080))
+
+    def test_remux(self):
+        audio_frames = [('frame %d' % i).encode('ascii') * 10 for i in range(4)]
+        remuxer = TSRemuxer()
+        # Samples are only complete once the next PES packet starts
+        self.assertEqual(remuxer.feed(
+            psi_tables() + video_pes(90000, True) + audio_pes(89100, audio_frames[:2]) +
+            video_pes(93000, False)), b'')
+        output = remuxer.feed(
+            psi_tables() + video_pes(96000, False) + audio_pes(89100 + 2 * 2090, audio_frames[2:]))
+        self.assertEqual(remuxer.unremuxed_data(), None)
+        output += remuxer.close()
+
+        self.assertEqual(
+            [box_type for box_type, _ in boxes(output)],
+            [b'ftyp', b'moov', b'moof', b'mdat', b'moof', b'mdat'])
+        moov = extract_box_data(output, [b'moov'])
+        traks = [payload for box_type, payload in boxes(moov) if box_type == b'trak']
+        self.assertEqual(len(traks), 2)
+        video_trak, audio_trak = traks
+        tkhd = extract_box_data(video_trak, [b'tkhd'])
+        self.assertEqual(compat_struct_unpack('>HxxHxx', tkhd[-8:]), (320, 240))
+        stsd = extract_box_data(video_trak, [b'mdia', b'minf', b'stbl', b'stsd'])
+        self.assertTrue(SPS in stsd and PPS in stsd)
+        mdhd = extract_box_data(audio_trak, [b'mdia', b'mdhd'])
+        self.assertEqual(compat_struct_unpack('>I', mdhd[12:16])[0], 44100)
+        stsd = extract_box_data(audio_trak, [b'mdia', b'minf', b'stbl', b'stsd'])
+        self.assertTrue(b'\x05\x02\x12\x10' in stsd)
+
+        fragments = [payload for box_type, payload in boxes(output) if box_type in (b'moof', b'mdat')]
+        first, second = trafs(fragments[0]), trafs(fragments[2])
+        # Audio starts 900 / 90000 s before video
+        self.assertEqual(first[1][0], 900)
+        self.assertEqual(first[2][0], 0)
+        idr_sample = b'\x00\x00\x00\x06' + IDR
+        self.assertEqual(first[1][1], [(3000, len(idr_sample), 0x02000000, 3000)])
+        self.assertEqual(first[2][1], [(1024, len(f), 0x02000000) for f in audio_frames[:2]])
+        self.assertEqual(fragments[1], idr_sample + b''.join(audio_frames[:2]))
+
+        self.assertEqual(second[1][0], 3900)
+        self.assertEqual(second[2][0], 2048)
+        self.assertEqual([s[0] for s in second[1][1]], [3000, 3000])
+        self.assertEqual([s[2] for s in second[1][1]], [0x01010000] * 2)
+        self.assertEqual(fragments[3], (b'\x00\x00\x00\x04' + NON_IDR) * 2 + b''.join(audio_frames[2:]))
+
+        # Sample data is right after each moof
+        data_offset = compat_struct_unpack('>i', extract_box_data(fragments[0], [b'traf', b'trun'])[8:12])[0]
+        self.assertEqual(data_offset, len(fragments[0]) + 16)
+
+    def test_gap(self):
+        def segment(index):
+            # 2 seconds of audio and video
+            start = index * 180000
+            return psi_tables() + audio_pes(start, [b'audio'] * 86) + b''.join(
+                video_pes(start + i * 90000, i == 0) for i in range(2))
+
+        def audio_start(output, frame):
+            # Time in seconds of an audio frame and the video frame at the
+            # same position
+            times = {}
+            for track_id, timescale, index in ((1, 90000, frame // 43), (2, 44100, frame)):
+                starts = []
+                for box_type, payload in boxes(output):
+                    if box_type == b'moof' and track_id in trafs(payload):
+                        decode_time, samples = trafs(payload)[track_id]
+                        for sample in samples:
+                            starts.append(decode_time)
+                            decode_time += sample[0]
+                times[track_id] = float(starts[index]) / timescale
+            return times[1], times[2]
+
+        # The second segment is missing
+        for feeds in ([segment(0), segment(2)], [segment(0) + segment(2)]):
+            remuxer = TSRemuxer()
+            output = b''.join(remuxer.feed(data) for data in feeds) + remuxer.close()
+            video_time, audio_time = audio_start(output, 86)
+            self.assertEqual(video_time, 4)
+            self.assertAlmostEqual(audio_time, 4, places=2)
+            video_time, audio_time = audio_start(output, 2 * 86 - 1)
+            self.assertAlmostEqual(audio_time, 6 - 1024 / 44100.0, places=2)
+
+    def test_missing_stream(self):
+        remuxer = TSRemuxer()
+        # No audio although the PMT has an audio stream
+        self.assertEqual(remuxer.feed(psi_tables() + video_pes(0, True)), b'')
+        output = remuxer.feed(b''.join(
+            video_pes(i * 450000, False) for i in range(1, 4)))
+        self.assertEqual(
+            [box_type for box_type, _ in boxes(output)],
+            [b'ftyp', b'moov', b'moof', b'mdat'])
+        moov = extract_box_data(output, [b'moov'])
+        self.assertEqual(len([b for b, _ in boxes(moov) if b == b'trak']), 1)
+
+    def test_unremuxed_data(self):
+        remuxer = TSRemuxer()
+        first = psi_tables() + video_pes(0, True) + video_pes(3000, False)
+        self.assertEqual(remuxer.feed(first), b'')
+        # Invalid sampling frequency index
+        second = (audio_pes(0, [b'audio']) + audio_pes(2090, [b'audio'])).replace(
+            b'\xff\xf1\x50', b'\xff\xf1\x7c')
+        self.assertRaises(RemuxError, remuxer.feed, second)
+        self.assertEqual(remuxer.unremuxed_data(), first + second)
+
+        remuxer = TSRemuxer()
+        self.assertEqual(remuxer.feed(psi_tables()), b'')
+        self.assertRaises(RemuxError, remuxer.close)
+        self.assertEqual(remuxer.unremuxed_data(), psi_tables())
+
+    def test_unsupported(self):
+        self.assertRaises(RemuxError, TSRemuxer().feed, b'\x00\x00\x00\x18ftypmp42')
+        pmt = b'\x00\x01\xc1\x00\x00' + compat_struct_pack('>HH', 0xe000 | VIDEO_PID, 0xf000)
+        pmt += compat_struct_pack('>BHH', 0x24, 0xe000 | VIDEO_PID, 0xf000)  # HEVC
+        pmt = compat_struct_pack('>BH', 2, 0xb000 | (len(pmt) + 4)) + pmt + b'\x00' * 4
+        self.assertRaises(
+            RemuxError, TSRemuxer().feed,
+            psi_tables()[:188] + ts_packets(PMT_PID, b'\x00' + pmt))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -580,10 +580,12 @@ class TestUtil(unittest.TestCase):
             pl = OnDemandPagedList(get_page, pagesize)
             got = pl.getslice(*sliceargs)
             self.assertEqual(got, expected)
+            self.assertEqual(list(pl.iterslice(*sliceargs)), expected)
 
             iapl = InAdvancePagedList(get_page, size // pagesize + 1, pagesize)
             got = iapl.getslice(*sliceargs)
             self.assertEqual(got, expected)
+            self.assertEqual(list(iapl.iterslice(*sliceargs)), expected)
 
         testPL(5, 2, (), [0, 1, 2, 3, 4])
         testPL(5, 2, (1,), [1, 2, 3, 4])
@@ -10,9 +10,11 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import io
 import re
+import shutil
 import string
 
 from test.helper import FakeYDL
+from youtube_dl.cache import MemoryLRU
 from youtube_dl.extractor import YoutubeIE
 from youtube_dl.compat import compat_str, compat_urlretrieve
 
@@ -81,6 +83,37 @@ class TestSignature(unittest.TestCase):
         if not os.path.exists(self.TESTDATA_DIR):
             os.mkdir(self.TESTDATA_DIR)
 
+    def test_player_cache(self):
+        cache_dir = os.path.join(self.TESTDATA_DIR, 'player_cache_test')
+        if os.path.exists(cache_dir):
+            shutil.rmtree(cache_dir)
+        player_url = 'https://www.youtube.com/yts/jsbin/player-vflTEST00/en_US/base.js'
+        downloads = []
+
+        class TestYoutubeIE(YoutubeIE):
+            _PLAYER_MEMO = MemoryLRU(8)
+            _SIG_FUNC_MEMO = MemoryLRU(64)
+
+            def _download_webpage(self, url, *args, **kwargs):
+                downloads.append(url)
+                return 'a.set("signature",sig(c));var sig=function(a){a=a.split("");a.reverse();return a.join("")};'
+
+        try:
+            ie = TestYoutubeIE(FakeYDL({'cachedir': cache_dir}))
+            self.assertEqual(ie._decrypt_signature('abc.def', 'x', player_url), 'fed.cba')
+            # Another signature length does not download the player again
+            self.assertEqual(ie._decrypt_signature('ab.cdef', 'x', player_url), 'fedc.ba')
+            self.assertEqual(downloads, [player_url])
+
+            # Neither does another process
+            TestYoutubeIE._PLAYER_MEMO = MemoryLRU(8)
+            TestYoutubeIE._SIG_FUNC_MEMO = MemoryLRU(64)
+            ie = TestYoutubeIE(FakeYDL({'cachedir': cache_dir}))
+            self.assertEqual(ie._decrypt_signature('abcd.ef', 'x', player_url), 'fe.dcba')
+            self.assertEqual(downloads, [player_url])
+        finally:
+            shutil.rmtree(cache_dir)
+
 
 def make_tfunc(url, stype, sig_input, expected_sig):
     m = re.match(r'.*-([a-zA-Z0-9_-]+)(?:/watch_as3|/html5player)?\.[a-z]+$', url)
@@ -5,7 +5,6 @@ from __future__ import absolute_import, unicode_literals
 
 import collections
 import contextlib
-import copy
 import datetime
 import errno
 import fileinput
@@ -21,6 +20,7 @@ import shutil
 import subprocess
 import socket
 import sys
+import threading
 import time
 import tokenize
 import traceback
@@ -62,10 +62,10 @@ from .utils import (
     GeoRestrictedError,
     int_or_none,
     ISO3166Utils,
-    locked_file,
     make_HTTPS_handler,
     MaxDownloadsReached,
     orderedSet,
+    OrderedTurns,
     PagedList,
     parse_filesize,
     PerRequestProxyHandler,
@@ -83,6 +83,7 @@ from .utils import (
     sanitized_Request,
     std_headers,
     subtitles_filename,
+    TurnsCancelled,
     UnavailableVideoError,
     url_basename,
     version_tuple,
@@ -91,17 +92,24 @@ from .utils import (
     YoutubeDLCookieProcessor,
     YoutubeDLHandler,
 )
+from .archive import open_download_archive
+from .urldispatch import URLDispatchIndex
 from .cache import Cache
 from .extractor import get_info_extractor, gen_extractor_classes, _LAZY_LOADER
 from .extractor.openload import PhantomJSwrapper
-from .downloader import get_suitable_downloader
+from .downloader import (
+    FileDownloader,
+    get_suitable_downloader,
+)
 from .downloader.rtmp import rtmpdump_version
+from .formatsort import FormatSorter
 from .postprocessor import (
     FFmpegFixupM3u8PP,
     FFmpegFixupM4aPP,
     FFmpegFixupStretchedPP,
     FFmpegMergerPP,
     FFmpegPostProcessor,
+    fuse_postprocessors,
     get_postprocessor,
 )
 from .version import __version__
@@ -155,10 +163,18 @@ class YoutubeDL(object):
     forcefilename:     Force printing final filename.
     forceduration:     Force printing duration.
     forcejson:         Force printing info_dict as JSON.
+                       Videos are printed one JSON object per line as soon
+                       as they are processed.
+    json_fields:       List of the fields of info_dict to print with
+                       forcejson, all of them if not given.
     dump_single_json:  Force printing the info_dict of the whole playlist
                        (or video) as a single JSON line.
     simulate:          Do not download the video files.
     format:            Video format code. See options.py for more information.
+    format_sort:       List of fields of formatsort.SORT_FIELDS to rank the
+                       formats of every video by, most significant first.
+                       Ties keep the order of the extractor, which is the
+                       default ranking unless it asked for another one.
     outtmpl:           Template for output names.
     restrictfilenames: Do not allow "&" and spaces in file names
     ignoreerrors:      Do not stop on download errors.
@@ -169,6 +185,14 @@ class YoutubeDL(object):
     playlist_items:    Specific indices of playlist to download.
     playlistreverse:   Download playlist items in reverse order.
     playlistrandom:    Download playlist items in random order.
+    keep_playlist_results: Whether to keep the results of the entries of
+                       playlists in the playlist result (default is True).
+                       They are always kept with dump_single_json.
+    lazy_playlist:     Process playlist entries as they are listed by the
+                       extractor, not reversed nor shuffled, and do not keep
+                       their results unless dump_single_json is set.
+    concurrent_playlist_entries: Number of playlist entries to extract and
+                       download at the same time (default is 1).
     matchtitle:        Download only matching titles.
     rejecttitle:       Reject downloads for matching titles.
     logger:            Log messages to a logging.Logger instance.
@@ -189,6 +213,8 @@ class YoutubeDL(object):
     daterange:         A DateRange object, download only if the upload_date is in the range.
     skip_download:     Skip the actual download of the video file
     cachedir:          Location of the cache files in the filesystem.
+                       A file name with an SQLite extension (.sqlite,
+                       .sqlite3, .db) stores the cache in a single database.
                        False to disable filesystem cache.
     noplaylist:        Download single video instead of a playlist if in doubt.
     age_limit:         An integer representing the user's age in years.
@@ -204,7 +230,15 @@ class YoutubeDL(object):
                        downloaded. None for no limit.
     download_archive:  File name of a file where all downloads are recorded.
                        Videos already present in the file are not downloaded
-                       again.
+                       again. Files with a .sqlite, .sqlite3 or .db extension
+                       are kept as SQLite databases.
+    batch_log:         File name of a file where download_batch() records the
+                       result of every URL as a JSON line. URLs it has
+                       recorded as successfully processed are skipped when
+                       the batch is run again.
+    batch_prefetch:    Let download_batch() extract the info of the next URL
+                       in the background, with extractor instances of its
+                       own, while the current one is downloaded.
     cookiefile:        File name where cookies should be read from and dumped to.
     nocheckcertificate:Do not verify SSL certificates
     prefer_insecure:   Use HTTP instead of HTTPS to retrieve information.
@@ -253,6 +287,8 @@ class YoutubeDL(object):
                        Progress hooks are guaranteed to be called at least once
                        (with status "finished") if the download is successful.
     merge_output_format: Extension to use when merging formats.
+    concurrent_format_downloads: Download the formats of a merged format
+                       (e.g. bestvideo+bestaudio) at the same time.
     fixup:             Automatically correct known faults of the file.
                        One of:
                        - "never": do nothing
@@ -260,6 +296,8 @@ class YoutubeDL(object):
                        - "detect_or_warn": check whether we can do anything
                                            about it, warn otherwise (default)
     source_address:    Client-side IP address to bind to.
+    no_keep_alive:     Do not keep HTTP connections open for reuse by
+                       subsequent requests.
     call_home:         Boolean, true iff we are allowed to contact the
                        youtube-dl servers for debugging.
     sleep_interval:    Number of seconds to sleep before each download when
@@ -302,7 +340,7 @@ class YoutubeDL(object):
     nopart, updatetime, buffersize, ratelimit, min_filesize, max_filesize, test,
     noresizebuffer, retries, continuedl, noprogress, consoletitle,
     xattr_set_filesize, external_downloader_args, hls_use_mpegts,
-    http_chunk_size.
+    http_chunk_size, http_connections.
 
     The following options are used by the post processors:
     prefer_ffmpeg:     If True, use ffmpeg instead of avconv if both are available,
@@ -341,10 +379,20 @@ class YoutubeDL(object):
             params = {}
         self._ies = []
         self._ies_instances = {}
+        self._ie_index = None
+        # Guards _ie_index and the extractors added on demand
+        self._ies_lock = threading.Lock()
+        # Extractions done ahead by download_batch, by URL
+        self._prefetched_extractions = {}
+        # Compiled format selectors, by format specification
+        self._format_selectors = {}
         self._pps = []
         self._progress_hooks = []
         self._download_retcode = 0
         self._num_downloads = 0
+        # State of the playlist entry processed by the current thread when
+        # playlist entries are processed concurrently
+        self._entry_ctx = threading.local()
         self._screen_file = [sys.stdout, sys.stderr][params.get('logtostderr', False)]
         self._err_file = sys.stderr
         self.params = {
@@ -353,6 +401,9 @@ class YoutubeDL(object):
         }
         self.params.update(params)
         self.cache = Cache(self)
+        self.archive = (
+            open_download_archive(self.params['download_archive'])
+            if self.params.get('download_archive') is not None else None)
 
         def check_deprecated(param, option, suggestion):
             if self.params.get(param) is not None:
@@ -452,6 +503,26 @@ class YoutubeDL(object):
             self._ies_instances[ie.ie_key()] = ie
             ie.set_downloader(self)
 
+    def _candidate_ies(self, url):
+        """
+        Return the info extractors that may be suitable for url, in the
+        order they have to be tried.
+        """
+        with self._ies_lock:
+            index = self._ie_index
+            if not index:
+                # Lazy extractors carry the host suffixes the index is built
+                # from. Otherwise they are computed from the _VALID_URLs,
+                # which only pays off when dispatching more than one URL.
+                if index is None and not _LAZY_LOADER:
+                    self._ie_index = False
+                    return self._ies
+                index = self._ie_index = URLDispatchIndex([])
+            # Extractors are added over time, e.g. by get_info_extractor()
+            for ie in self._ies[len(index):]:
+                index.add(ie)
+        return index.candidates(url)
+
     def get_info_extractor(self, ie_key):
         """
         Get an instance of an IE with name ie_key, it will try to get one from
@@ -460,8 +531,11 @@ class YoutubeDL(object):
         """
         ie = self._ies_instances.get(ie_key)
         if ie is None:
-            ie = get_info_extractor(ie_key)()
-            self.add_info_extractor(ie)
+            with self._ies_lock:
+                ie = self._ies_instances.get(ie_key)
+                if ie is None:
+                    ie = get_info_extractor(ie_key)()
+                    self.add_info_extractor(ie)
         return ie
 
     def add_default_info_extractors(self):
@@ -498,6 +572,11 @@ class YoutubeDL(object):
         return self.to_stdout(message, skip_eol, check_quiet=True)
 
     def _write_string(self, s, out=None):
+        buffered = getattr(self._entry_ctx, 'screen_buffer', None)
+        if buffered is not None:
+            # Output of a background extraction, written when it is used
+            buffered.append((s, out))
+            return
         write_string(s, out=out, encoding=self.params.get('encoding'))
 
     def to_stdout(self, message, skip_eol=False, check_quiet=False):
@@ -511,6 +590,13 @@ class YoutubeDL(object):
 
             self._write_string(output, self._screen_file)
 
+    def to_stdout_json(self, info_dict):
+        """Print the json_fields of info_dict to stdout as a JSON line"""
+        fields = self.params.get('json_fields')
+        if fields:
+            info_dict = dict((k, info_dict[k]) for k in fields if k in info_dict)
+        self.to_stdout(json.dumps(info_dict))
+
     def to_stderr(self, message):
         """Print message to stderr."""
         assert isinstance(message, compat_str)
@@ -560,6 +646,15 @@ class YoutubeDL(object):
         if self.params.get('cookiefile') is not None:
             self.cookiejar.save()
 
+        self.close_connections()
+
+    def close_connections(self):
+        """Close idle persistent HTTP connections"""
+        for handler in self._opener.handlers:
+            pool = getattr(handler, '_connection_pool', None)
+            if pool is not None:
+                pool.close()
+
     def trouble(self, message=None, tb=None):
         """Determine action to take when a download problem appears.
 
@@ -635,7 +730,8 @@ class YoutubeDL(object):
             autonumber_size = self.params.get('autonumber_size')
             if autonumber_size is None:
                 autonumber_size = 5
-            template_dict['autonumber'] = self.params.get('autonumber_start', 1) - 1 + self._num_downloads
+            num_downloads = getattr(self._entry_ctx, 'num_downloads', self._num_downloads)
+            template_dict['autonumber'] = self.params.get('autonumber_start', 1) - 1 + num_downloads
             if template_dict.get('resolution') is None:
                 if template_dict.get('width') and template_dict.get('height'):
                     template_dict['resolution'] = '%dx%d' % (template_dict['width'], template_dict['height'])
@@ -658,7 +754,8 @@ class YoutubeDL(object):
             # For fields playlist_index and autonumber convert all occurrences
             # of %(field)s to %(field)0Nd for backward compatibility
             field_size_compat_map = {
-                'playlist_index': len(str(template_dict['n_entries'])),
+                'playlist_index': len(str(
+                    info_dict.get('n_entries') or self._last_playlist_index())),
                 'autonumber': autonumber_size,
             }
             FIELD_SIZE_COMPAT_RE = r'(?<!%)%\((?P<field>autonumber|playlist_index)\)s'
@@ -774,10 +871,12 @@ class YoutubeDL(object):
         if not ie_key and force_generic_extractor:
             ie_key = 'Generic'
 
+        prefetched = self._prefetched_extractions.pop(url, None)
+
         if ie_key:
             ies = [self.get_info_extractor(ie_key)]
         else:
-            ies = self._ies
+            ies = self._candidate_ies(url)
 
         for ie in ies:
             if not ie.suitable(url):
@@ -789,7 +888,12 @@ class YoutubeDL(object):
                                     'and will probably not work.')
 
             try:
-                ie_result = ie.extract(url)
+                if prefetched is not None and prefetched['ie_key'] == ie.ie_key():
+                    if 'exc_info' in prefetched:
+                        raise prefetched['exc_info'][1]
+                    ie_result = prefetched['result']
+                else:
+                    ie_result = ie.extract(url)
                 if ie_result is None:  # Finished already (backwards compatibility; listformats and friends should be moved here)
                     break
                 if isinstance(ie_result, list):
@@ -849,7 +953,7 @@ class YoutubeDL(object):
             if ((extract_flat == 'in_playlist' and 'playlist' in extra_info) or
                     extract_flat is True):
                 if self.params.get('forcejson', False):
-                    self.to_stdout(json.dumps(ie_result))
+                    self.to_stdout_json(ie_result)
                 return ie_result
 
         if result_type == 'video':
@@ -906,18 +1010,7 @@ class YoutubeDL(object):
             if playlistend == -1:
                 playlistend = None
 
-            playlistitems_str = self.params.get('playlist_items')
-            playlistitems = None
-            if playlistitems_str is not None:
-                def iter_playlistitems(format):
-                    for string_segment in format.split(','):
-                        if '-' in string_segment:
-                            start, end = string_segment.split('-')
-                            for item in range(int(start), int(end) + 1):
-                                yield int(item)
-                        else:
-                            yield int(string_segment)
-                playlistitems = orderedSet(iter_playlistitems(playlistitems_str))
+            playlistitems = self._playlist_items()
 
             ie_entries = ie_result['entries']
 
@@ -932,6 +1025,29 @@ class YoutubeDL(object):
                     '[%s] playlist %s: Downloading %d videos' %
                     (ie_result['extractor'], playlist, num_entries))
 
+            def iter_lazy_entries():
+                if playlistitems:
+                    # Entries are processed in the playlist order
+                    positions = set(i for i in playlistitems if i > 0)
+                    if not positions:
+                        return
+                    first, last = min(positions), max(positions)
+                else:
+                    positions = None
+                    first, last = playliststart + 1, playlistend
+                if isinstance(ie_entries, PagedList):
+                    source = ie_entries.iterslice(first - 1, last)
+                else:
+                    source = itertools.islice(ie_entries, first - 1, last)
+                for pos, entry in enumerate(source, first):
+                    if positions is None or pos in positions:
+                        yield entry
+
+            lazy = (
+                self.params.get('lazy_playlist', False)
+                and not self.params.get('playlistreverse', False)
+                and not self.params.get('playlistrandom', False))
+
             if isinstance(ie_entries, list):
                 n_all_entries = len(ie_entries)
                 if playlistitems:
@@ -942,6 +1058,13 @@ class YoutubeDL(object):
                 self.to_screen(
                     '[%s] playlist %s: Collected %d video ids (downloading %d of them)' %
                     (ie_result['extractor'], playlist, n_all_entries, n_entries))
+            elif lazy:
+                # The number of entries is unknown until they are all listed
+                entries = iter_lazy_entries()
+                n_entries = None
+                self.to_screen(
+                    '[%s] playlist %s: Downloading videos as they are listed' %
+                    (ie_result['extractor'], playlist))
             elif isinstance(ie_entries, PagedList):
                 if playlistitems:
                     entries = []
@@ -972,35 +1095,51 @@ class YoutubeDL(object):
 
             x_forwarded_for = ie_result.get('__x_forwarded_for_ip')
 
-            for i, entry in enumerate(entries, 1):
-                self.to_screen('[download] Downloading video %s of %s' % (i, n_entries))
-                # This __x_forwarded_for_ip thing is a bit ugly but requires
-                # minimal changes
-                if x_forwarded_for:
-                    entry['__x_forwarded_for_ip'] = x_forwarded_for
-                extra = {
-                    'n_entries': n_entries,
-                    'playlist': playlist,
-                    'playlist_id': ie_result.get('id'),
-                    'playlist_title': ie_result.get('title'),
-                    'playlist_uploader': ie_result.get('uploader'),
-                    'playlist_uploader_id': ie_result.get('uploader_id'),
-                    'playlist_index': i + playliststart,
-                    'extractor': ie_result['extractor'],
-                    'webpage_url': ie_result['webpage_url'],
-                    'webpage_url_basename': url_basename(ie_result['webpage_url']),
-                    'extractor_key': ie_result['extractor_key'],
-                }
+            def iter_playlist_jobs():
+                for i, entry in enumerate(entries, 1):
+                    if n_entries is None:
+                        self.to_screen('[download] Downloading video %s' % i)
+                    else:
+                        self.to_screen('[download] Downloading video %s of %s' % (i, n_entries))
+                    # This __x_forwarded_for_ip thing is a bit ugly but requires
+                    # minimal changes
+                    if x_forwarded_for:
+                        entry['__x_forwarded_for_ip'] = x_forwarded_for
+                    extra = {
+                        'n_entries': n_entries,
+                        'playlist': playlist,
+                        'playlist_id': ie_result.get('id'),
+                        'playlist_title': ie_result.get('title'),
+                        'playlist_uploader': ie_result.get('uploader'),
+                        'playlist_uploader_id': ie_result.get('uploader_id'),
+                        'playlist_index': i + playliststart,
+                        'extractor': ie_result['extractor'],
+                        'webpage_url': ie_result['webpage_url'],
+                        'webpage_url_basename': url_basename(ie_result['webpage_url']),
+                        'extractor_key': ie_result['extractor_key'],
+                    }
 
-                reason = self._match_entry(entry, incomplete=True)
-                if reason is not None:
-                    self.to_screen('[download] ' + reason)
-                    continue
+                    reason = self._match_entry(entry, incomplete=True)
+                    if reason is not None:
+                        self.to_screen('[download] ' + reason)
+                        continue
 
-                entry_result = self.process_ie_result(entry,
-                                                      download=download,
-                                                      extra_info=extra)
-                playlist_results.append(entry_result)
+                    yield entry, extra
+
+            keep_results = self._keep_playlist_results()
+            max_workers = self.params.get('concurrent_playlist_entries') or 1
+            # Entries of nested playlists are processed by the worker
+            # processing the nested playlist
+            if max_workers > 1 and getattr(self._entry_ctx, 'turns', None) is None:
+                playlist_results = self._process_entries_concurrently(
+                    iter_playlist_jobs(), download, max_workers, keep_results)
+            else:
+                for entry, extra in iter_playlist_jobs():
+                    entry_result = self.process_ie_result(entry,
+                                                          download=download,
+                                                          extra_info=extra)
+                    if keep_results:
+                        playlist_results.append(entry_result)
             ie_result['entries'] = playlist_results
             self.to_screen('[download] Finished downloading playlist: %s' % playlist)
             return ie_result
@@ -1028,6 +1167,140 @@ class YoutubeDL(object):
         else:
             raise Exception('Invalid result type: %s' % result_type)
 
+    def _playlist_items(self):
+        """Return the indices of playlist_items, None if it is not set"""
+        playlistitems_str = self.params.get('playlist_items')
+        if playlistitems_str is None:
+            return None
+
+        def iter_playlistitems(format):
+            for string_segment in format.split(','):
+                if '-' in string_segment:
+                    start, end = string_segment.split('-')
+                    for item in range(int(start), int(end) + 1):
+                        yield int(item)
+                else:
+                    yield int(string_segment)
+        return orderedSet(iter_playlistitems(playlistitems_str))
+
+    def _last_playlist_index(self):
+        # Used for the width of playlist_index when the number of entries
+        # is unknown (see lazy_playlist)
+        playlistitems = self._playlist_items()
+        if playlistitems and max(playlistitems) > 0:
+            return max(playlistitems)
+        playlistend = self.params.get('playlistend')
+        if playlistend is not None and playlistend > 0:
+            return playlistend
+        # 5 digits, as for autonumber
+        return 10 ** 4
+
+    def _keep_playlist_results(self):
+        # The processed entries are needed to print the whole playlist as
+        # JSON. Otherwise they are not kept in lazy_playlist mode, nor when
+        # asked not to.
+        if self.params.get('dump_single_json', False):
+            return True
+        if self.params.get('lazy_playlist', False):
+            return False
+        return self.params.get('keep_playlist_results', True)
+
+    def _process_entries_concurrently(self, jobs, download, max_workers, keep_results=True):
+        """Process the (entry, extra_info) pairs of jobs on up to max_workers
+        threads and return the results in the order of jobs (or an empty list
+        unless keep_results).
+
+        Download numbering, the max_downloads check, forced printings and
+        download archive writes still happen in the order of jobs.
+
+        When a job fails or processing is interrupted, the entries being
+        processed are stopped at their next turn and not waited for.
+        """
+        turns = OrderedTurns()
+        pending = collections.deque()
+        results = []
+        # Notified whenever a job is done
+        done = threading.Condition()
+
+        def process(n, entry, extra, result):
+            self._entry_ctx.turns = turns
+            self._entry_ctx.n = n
+            try:
+                if turns.is_cancelled(n):
+                    raise TurnsCancelled()
+                outcome = (self.process_ie_result(
+                    entry, download=download, extra_info=extra), None)
+            except BaseException as e:
+                outcome = (None, e)
+            finally:
+                turns.finish(n)
+            with done:
+                result.append(outcome)
+                done.notify_all()
+
+        def collect():
+            with done:
+                while not pending[0][2]:
+                    failed = [n for n, _, result in pending if result and result[0][1] is not None]
+                    if failed:
+                        # Jobs after a failed one would not have been
+                        # processed one at a time, stop them right away
+                        turns.cancel(failed[0])
+                    done.wait()
+            _, thread, result = pending.popleft()
+            thread.join()
+            entry_result, err = result[0]
+            if err is not None:
+                raise err
+            if keep_results:
+                results.append(entry_result)
+
+        try:
+            for n, (entry, extra) in enumerate(jobs):
+                if len(pending) >= max_workers:
+                    collect()
+                result = []
+                thread = threading.Thread(
+                    target=process, args=(n, entry, extra, result))
+                thread.daemon = True
+                thread.start()
+                pending.append((n, thread, result))
+            while pending:
+                collect()
+        except BaseException:
+            # Worker threads are daemonic, those still downloading are left
+            # behind and stop at their next turn
+            turns.cancel()
+            raise
+        return results
+
+    def _wait_entry_turn(self, stage):
+        turns = getattr(self._entry_ctx, 'turns', None)
+        if turns is not None:
+            turns.wait(stage, self._entry_ctx.n)
+
+    def _end_entry_turn(self, stage):
+        turns = getattr(self._entry_ctx, 'turns', None)
+        if turns is not None:
+            held = getattr(self._entry_ctx, 'held_turns', None)
+            if held is not None:
+                held.add(stage)
+            else:
+                turns.advance(stage, self._entry_ctx.n)
+
+    def _hold_entry_turns(self):
+        # Turns ended from now on are only passed by _release_entry_turns(),
+        # so that all the formats of an entry are processed in a row
+        if getattr(self._entry_ctx, 'turns', None) is not None:
+            self._entry_ctx.held_turns = set()
+
+    def _release_entry_turns(self):
+        held = getattr(self._entry_ctx, 'held_turns', None)
+        if held is not None:
+            self._entry_ctx.held_turns = None
+            for stage in held:
+                self._end_entry_turn(stage)
+
     def _build_format_filter(self, filter_spec):
         " Returns a function to filter the formats according to the filter_spec "
 
@@ -1081,10 +1354,13 @@ class YoutubeDL(object):
         if not m:
             raise ValueError('Invalid filter specification %r' % filter_spec)
 
+        key = m.group('key')
+        none_inclusive = m.group('none_inclusive')
+
         def _filter(f):
-            actual_value = f.get(m.group('key'))
+            actual_value = f.get(key)
             if actual_value is None:
-                return m.group('none_inclusive')
+                return none_inclusive
             return op(actual_value, comparison_value)
         return _filter
 
@@ -1113,6 +1389,20 @@ class YoutubeDL(object):
         return '/'.join(req_format_list)
 
     def build_format_selector(self, format_spec):
+        """
+        Return a function selecting formats according to format_spec
+
+        The function is called with a context dict holding the sorted
+        'formats' and whether they are 'incomplete_formats', it yields the
+        selected formats without copying or modifying the given ones.
+        Selectors are compiled once per format_spec.
+        """
+        selector = self._format_selectors.get(format_spec)
+        if selector is None:
+            selector = self._format_selectors[format_spec] = self._compile_format_selector(format_spec)
+        return selector
+
+    def _compile_format_selector(self, format_spec):
         def syntax_error(note, start):
             message = (
                 'Invalid format specification: '
@@ -1244,7 +1534,7 @@ class YoutubeDL(object):
                 format_spec = selector.selector
 
                 def selector_function(ctx):
-                    formats = list(ctx['formats'])
+                    formats = ctx['formats']
                     if not formats:
                         return
                     if format_spec == 'all':
@@ -1335,17 +1625,22 @@ class YoutubeDL(object):
                 video_selector, audio_selector = map(_build_selector_function, selector.selector)
 
                 def selector_function(ctx):
-                    for pair in itertools.product(
-                            video_selector(copy.deepcopy(ctx)), audio_selector(copy.deepcopy(ctx))):
+                    for pair in itertools.product(video_selector(ctx), audio_selector(ctx)):
                         yield _merge(pair)
 
             filters = [self._build_format_filter(f) for f in selector.filters]
+            if not filters:
+                return selector_function
 
             def final_selector(ctx):
-                ctx_copy = copy.deepcopy(ctx)
+                # Filters narrow down a new list of the same format dicts,
+                # neither the formats nor the given context are modified
+                formats = ctx['formats']
                 for _filter in filters:
-                    ctx_copy['formats'] = list(filter(_filter, ctx_copy['formats']))
-                return selector_function(ctx_copy)
+                    formats = [f for f in formats if _filter(f)]
+                filtered_ctx = dict(ctx)
+                filtered_ctx['formats'] = formats
+                return selector_function(filtered_ctx)
             return final_selector
 
         stream = io.BytesIO(format_spec.encode('utf-8'))
@@ -1575,7 +1870,8 @@ class YoutubeDL(object):
         if '__x_forwarded_for_ip' in info_dict:
             del info_dict['__x_forwarded_for_ip']
 
-        # TODO Central sorting goes here
+        if self.params.get('format_sort'):
+            self.sort_formats(formats)
 
         if formats[0] is not info_dict:
             # only set the 'formats' fields if the original info_dict list them
@@ -1629,14 +1925,30 @@ class YoutubeDL(object):
         if download:
             if len(formats_to_download) > 1:
                 self.to_screen('[info] %s: downloading video in %s formats' % (info_dict['id'], len(formats_to_download)))
-            for format in formats_to_download:
-                new_info = dict(info_dict)
-                new_info.update(format)
-                self.process_info(new_info)
+                self._hold_entry_turns()
+            try:
+                for format in formats_to_download:
+                    new_info = dict(info_dict)
+                    new_info.update(format)
+                    self.process_info(new_info)
+            finally:
+                self._release_entry_turns()
         # We update the info dict with the best quality format (backwards compatibility)
         info_dict.update(formats_to_download[-1])
         return info_dict
 
+    def sort_formats(self, formats):
+        """
+        Sort formats in place from the worst to the best by the format_sort
+        fields, ties keep the order the extractor sorted them in
+
+        Formats listing and selection both use the resulting order.
+        """
+        FormatSorter(
+            self.params.get('format_sort'),
+            prefer_free_formats=self.params.get('prefer_free_formats'),
+            default_ranking=False).sort(formats)
+
     def process_subtitles(self, video_id, normal_subtitles, automatic_captions):
         """Select the requested subtitles and their format"""
         available_subs = {}
@@ -1686,11 +1998,88 @@ class YoutubeDL(object):
             subs[lang] = f
         return subs
 
+    def _download_concurrently(self, dl, downloads):
+        """Run dl(filename, info, progress_hook) for all (filename, info)
+        pairs of downloads at the same time.
+
+        Progress hooks get the status of each download, while a single
+        progress line sums them up. Returns True if all downloads succeeded.
+        """
+        reporter = FileDownloader(self, self.params)
+        lock = threading.Lock()
+        statuses = {}
+        start = time.time()
+
+        def total(field, fallback=None):
+            if len(statuses) < len(downloads):
+                return None
+            values = [s.get(field) if s.get(field) is not None else s.get(fallback)
+                      for s in statuses.values()]
+            return None if None in values else sum(values)
+
+        def progress_hook(status):
+            with lock:
+                for ph in self._progress_hooks:
+                    ph(status)
+                if status['status'] not in ('downloading', 'finished'):
+                    return
+                statuses[status['filename']] = status
+                finished = (
+                    len(statuses) == len(downloads)
+                    and all(s['status'] == 'finished' for s in statuses.values()))
+                downloaded_bytes = sum(
+                    s.get('downloaded_bytes')
+                    or (s.get('total_bytes') if s['status'] == 'finished' else None)
+                    or 0 for s in statuses.values())
+                speed = sum(
+                    s.get('speed') or 0 for s in statuses.values()
+                    if s['status'] == 'downloading') or None
+                aggregated = {
+                    'status': 'finished' if finished else 'downloading',
+                    'filename': status['filename'],
+                    'downloaded_bytes': downloaded_bytes,
+                    'total_bytes': total('total_bytes'),
+                    'total_bytes_estimate': total('total_bytes', 'total_bytes_estimate'),
+                    'elapsed': time.time() - start,
+                    'speed': speed,
+                    'eta': None,
+                }
+                if finished and aggregated['total_bytes'] is None:
+                    aggregated['total_bytes'] = downloaded_bytes
+                remaining = aggregated['total_bytes'] or aggregated['total_bytes_estimate']
+                if remaining and speed:
+                    aggregated['eta'] = max(remaining - downloaded_bytes, 0) / speed
+                reporter.report_progress(aggregated)
+
+        results = [None] * len(downloads)
+
+        def download(idx, name, info):
+            try:
+                results[idx] = (dl(name, info, progress_hook), None)
+            except BaseException as e:
+                results[idx] = (False, e)
+
+        threads = []
+        for idx, (name, info) in enumerate(downloads):
+            thread = threading.Thread(target=download, args=(idx, name, info))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        for _, err in results:
+            if err is not None:
+                raise err
+        return all(success for success, _ in results)
+
     def process_info(self, info_dict):
         """Process a single resolved IE result."""
 
         assert info_dict.get('_type', 'video') == 'video'
 
+        self._wait_entry_turn('start')
+
         max_downloads = self.params.get('max_downloads')
         if max_downloads is not None:
             if self._num_downloads >= int(max_downloads):
@@ -1709,6 +2098,8 @@ class YoutubeDL(object):
             return
 
         self._num_downloads += 1
+        if getattr(self._entry_ctx, 'turns', None) is not None:
+            self._entry_ctx.num_downloads = self._num_downloads
 
         info_dict['_filename'] = filename = self.prepare_filename(info_dict)
 
@@ -1735,7 +2126,9 @@ class YoutubeDL(object):
         if self.params.get('forceformat', False):
             self.to_stdout(info_dict['format'])
         if self.params.get('forcejson', False):
-            self.to_stdout(json.dumps(info_dict))
+            self.to_stdout_json(info_dict)
+
+        self._end_entry_turn('start')
 
         # Do nothing else if in simulate mode
         if self.params.get('simulate', False):
@@ -1838,10 +2231,14 @@ class YoutubeDL(object):
 
         if not self.params.get('skip_download', False):
             try:
-                def dl(name, info):
+                def dl(name, info, progress_hook=None):
                     fd = get_suitable_downloader(info, self.params)(self, self.params)
-                    for ph in self._progress_hooks:
-                        fd.add_progress_hook(ph)
+                    if progress_hook is not None:
+                        # The progress of concurrent downloads is reported as a whole
+                        fd._progress_hooks = [progress_hook]
+                    else:
+                        for ph in self._progress_hooks:
+                            fd.add_progress_hook(ph)
                     if self.params.get('verbose'):
                         self.to_stdout('[debug] Invoking downloader on %r' % info.get('url'))
                     return fd.download(name, info)
@@ -1890,6 +2287,7 @@ class YoutubeDL(object):
                             '[download] %s has already been downloaded and '
                             'merged' % filename)
                     else:
+                        downloads = []
                         for f in requested_formats:
                             new_info = dict(info_dict)
                             new_info.update(f)
@@ -1899,8 +2297,13 @@ class YoutubeDL(object):
                             if not ensure_dir_exists(fname):
                                 return
                             downloaded.append(fname)
-                            partial_success = dl(fname, new_info)
-                            success = success and partial_success
+                            downloads.append((fname, new_info))
+                        if self.params.get('concurrent_format_downloads'):
+                            success = self._download_concurrently(dl, downloads)
+                        else:
+                            for fname, new_info in downloads:
+                                partial_success = dl(fname, new_info)
+                                success = success and partial_success
                         info_dict['__postprocessors'] = postprocessors
                         info_dict['__files_to_merge'] = downloaded
                 else:
@@ -1949,7 +2352,7 @@ class YoutubeDL(object):
                             % info_dict['id'])
                     elif fixup_policy == 'detect_or_warn':
                         fixup_pp = FFmpegFixupM4aPP(self)
-                        if fixup_pp.available:
+                        if fixup_pp.supports(muxers=['mp4']):
                             info_dict.setdefault('__postprocessors', [])
                             info_dict['__postprocessors'].append(fixup_pp)
                         else:
@@ -1960,15 +2363,16 @@ class YoutubeDL(object):
                     else:
                         assert fixup_policy in ('ignore', 'never')
 
+                # hlsnative remuxes to MP4 itself when it can
                 if (info_dict.get('protocol') == 'm3u8_native' or
                         info_dict.get('protocol') == 'm3u8' and
-                        self.params.get('hls_prefer_native')):
+                        self.params.get('hls_prefer_native')) and not info_dict.get('__remuxed'):
                     if fixup_policy == 'warn':
                         self.report_warning('%s: malformed AAC bitstream detected.' % (
                             info_dict['id']))
                     elif fixup_policy == 'detect_or_warn':
                         fixup_pp = FFmpegFixupM3u8PP(self)
-                        if fixup_pp.available:
+                        if fixup_pp.supports(muxers=['mp4'], bsfs=['aac_adtstoasc']):
                             info_dict.setdefault('__postprocessors', [])
                             info_dict['__postprocessors'].append(fixup_pp)
                         else:
@@ -1983,7 +2387,9 @@ class YoutubeDL(object):
                 except (PostProcessingError) as err:
                     self.report_error('postprocessing: %s' % str(err))
                     return
+                self._wait_entry_turn('archive')
                 self.record_download_archive(info_dict)
+                self._end_entry_turn('archive')
 
     def download(self, url_list):
         """Download a given list of URLs."""
@@ -1995,21 +2401,196 @@ class YoutubeDL(object):
             raise SameFileError(outtmpl)
 
         for url in url_list:
-            try:
-                # It also downloads the videos
-                res = self.extract_info(
-                    url, force_generic_extractor=self.params.get('force_generic_extractor', False))
-            except UnavailableVideoError:
-                self.report_error('unable to download video')
-            except MaxDownloadsReached:
-                self.to_screen('[info] Maximum number of downloaded files reached.')
-                raise
-            else:
-                if self.params.get('dump_single_json', False):
-                    self.to_stdout(json.dumps(res))
+            self._download_url(url)
+
+        return self._download_retcode
+
+    def _download_url(self, url):
+        try:
+            # It also downloads the videos
+            res = self.extract_info(
+                url, force_generic_extractor=self.params.get('force_generic_extractor', False))
+        except UnavailableVideoError:
+            self.report_error('unable to download video')
+        except MaxDownloadsReached:
+            self.to_screen('[info] Maximum number of downloaded files reached.')
+            raise
+        else:
+            if self.params.get('dump_single_json', False):
+                self.to_stdout(json.dumps(res))
+            return res
+
+    def download_batch(self, urls):
+        """
+        Download the URLs of an iterable, like the lines of a batch file as
+        they are read.
+
+        URLs of videos that have been seen before in the batch or that are
+        in the download archive are skipped before any network access. With
+        batch_prefetch, the info of the next URL is extracted while the
+        current one is being downloaded. The result of every URL is recorded
+        in batch_log.
+        """
+        outtmpl = self.params.get('outtmpl', DEFAULT_OUTTMPL)
+        log_fn = self.params.get('batch_log')
+        done = self._read_batch_log(log_fn) if log_fn is not None else set()
+        log_file = io.open(log_fn, 'a', encoding='utf-8') if log_fn is not None else None
+
+        def log_result(url, status, info=None, error=None):
+            if log_file is None:
+                return
+            record = {'url': url, 'status': status}
+            if info:
+                record['extractor_key'] = info.get('extractor_key') or info.get('ie_key')
+                record['id'] = info.get('id')
+            if error is not None:
+                record['error'] = error
+            log_file.write(compat_str(json.dumps(record)) + '\n')
+            log_file.flush()
+
+        def batch_jobs():
+            seen = set()
+            for url in urls:
+                job = {'url': url}
+                job['video'] = video = self._identify_url(url)
+                key = self._make_archive_id(video) if video else url
+                if url in done:
+                    job['skip'] = ('has already been processed', None)
+                elif key in seen:
+                    job['skip'] = ('has already been queued', 'duplicate')
+                elif video and self.in_download_archive(video):
+                    job['skip'] = ('has already been recorded in archive', 'archived')
+                seen.add(key)
+                yield job
+
+        jobs = batch_jobs()
+        queue = collections.deque()
+        pulled = [0]
+
+        prefetch = self.params.get('batch_prefetch', False)
+
+        def pull_next():
+            # Queue jobs up to the next URL to download and start extracting it
+            for job in jobs:
+                pulled[0] += 1
+                queue.append(job)
+                if 'skip' not in job:
+                    if prefetch:
+                        job['thread'] = threading.Thread(
+                            target=self._prefetch_extraction, args=(job,))
+                        job['thread'].daemon = True
+                        job['thread'].start()
+                    return
+
+        try:
+            pull_next()
+            first = True
+            while queue:
+                job = queue.popleft()
+                url = job['url']
+                if 'skip' in job:
+                    message, status = job['skip']
+                    self.to_screen('[batch] %s: %s' % (url, message))
+                    if status is not None:
+                        log_result(url, status, job['video'])
+                    continue
+
+                pull_next()
+                if (first and pulled[0] > 1 and
+                        outtmpl != '-' and
+                        '%' not in outtmpl and
+                        self.params.get('max_downloads') != 1):
+                    raise SameFileError(outtmpl)
+                first = False
+
+                if 'thread' in job:
+                    job['thread'].join()
+                    for output, out in job['output']:
+                        self._write_string(output, out)
+                if 'ie_key' in job:
+                    self._prefetched_extractions[url] = job
+                retcode, self._download_retcode = self._download_retcode, 0
+                try:
+                    res = self._download_url(url)
+                except DownloadError as e:
+                    log_result(url, 'error', error=error_to_compat_str(e))
+                    raise
+                finally:
+                    self._prefetched_extractions.pop(url, None)
+                    failed = self._download_retcode != 0
+                    self._download_retcode = max(retcode, self._download_retcode)
+                log_result(url, 'error' if failed or res is None else 'ok', res)
+        finally:
+            if log_file is not None:
+                log_file.close()
 
         return self._download_retcode
 
+    @staticmethod
+    def _read_batch_log(log_fn):
+        done = set()
+        try:
+            with io.open(log_fn, 'r', encoding='utf-8') as log_file:
+                for line in log_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Incomplete record of an interrupted run
+                        continue
+                    if record.get('status') == 'ok':
+                        done.add(record['url'])
+                    else:
+                        done.discard(record.get('url'))
+        except IOError as ioe:
+            if ioe.errno != errno.ENOENT:
+                raise
+        return done
+
+    def _identify_url(self, url):
+        """
+        Return the ie_key and id of the video at url as far as they can be
+        told from the URL itself, or None.
+        """
+        if self.params.get('force_generic_extractor', False):
+            return None
+        for ie in self._candidate_ies(url):
+            if not ie.suitable(url):
+                continue
+            try:
+                video_id = self.get_info_extractor(ie.ie_key())._match_id(url)
+            except (AssertionError, AttributeError, IndexError, TypeError):
+                # The extractor has no id in its _VALID_URL
+                return None
+            if not video_id:
+                return None
+            return {'ie_key': ie.ie_key(), 'id': video_id}
+        return None
+
+    def _prefetch_extraction(self, prefetched):
+        """
+        Extract the info of prefetched['url'] for a later extract_info()
+
+        This runs in the background, with an extractor instance of its own.
+        Its screen output is kept in prefetched['output'].
+        """
+        url = prefetched['url']
+        self._entry_ctx.screen_buffer = prefetched['output'] = []
+        if self.params.get('force_generic_extractor', False):
+            ies = [self.get_info_extractor('Generic')]
+        else:
+            ies = self._candidate_ies(url)
+        for ie in ies:
+            if not ie.suitable(url):
+                continue
+            prefetched['ie_key'] = ie.ie_key()
+            # Extractors keep state, the registered ones may be in use
+            ie_class = ie if isinstance(ie, type) else type(ie)
+            try:
+                prefetched['result'] = ie_class(self).extract(url)
+            except Exception:
+                prefetched['exc_info'] = sys.exc_info()
+            return
+
     def download_with_info_file(self, info_filename):
         with contextlib.closing(fileinput.FileInput(
                 [info_filename], mode='r',
@@ -2041,7 +2622,9 @@ class YoutubeDL(object):
         if ie_info.get('__postprocessors') is not None:
             pps_chain.extend(ie_info['__postprocessors'])
         pps_chain.extend(self._pps)
-        for pp in pps_chain:
+        # Remux in a single ffmpeg invocation where possible instead of
+        # rewriting the file once for each postprocessor
+        for pp in fuse_postprocessors(pps_chain, self):
             files_to_delete = []
             try:
                 files_to_delete, info = pp.run(info)
@@ -2067,32 +2650,21 @@ class YoutubeDL(object):
         return extractor.lower() + ' ' + info_dict['id']
 
     def in_download_archive(self, info_dict):
-        fn = self.params.get('download_archive')
-        if fn is None:
+        if self.archive is None:
             return False
 
         vid_id = self._make_archive_id(info_dict)
         if vid_id is None:
             return False  # Incomplete video information
 
-        try:
-            with locked_file(fn, 'r', encoding='utf-8') as archive_file:
-                for line in archive_file:
-                    if line.strip() == vid_id:
-                        return True
-        except IOError as ioe:
-            if ioe.errno != errno.ENOENT:
-                raise
-        return False
+        return vid_id in self.archive
 
     def record_download_archive(self, info_dict):
-        fn = self.params.get('download_archive')
-        if fn is None:
+        if self.archive is None:
             return
         vid_id = self._make_archive_id(info_dict)
         assert vid_id
-        with locked_file(fn, 'a', encoding='utf-8') as archive_file:
-            archive_file.write(vid_id + '\n')
+        self.archive.add(vid_id)
 
     @staticmethod
     def format_resolution(format, default='unknown'):
@@ -7,6 +7,7 @@ __license__ = 'Public Domain'
 
 import codecs
 import io
+import itertools
 import os
 import random
 import sys
@@ -26,10 +27,10 @@ from .utils import (
     DEFAULT_OUTTMPL,
     DownloadError,
     expand_path,
+    iter_batch_urls,
     match_filter_func,
     MaxDownloadsReached,
     preferredencoding,
-    read_batch_urls,
     SameFileError,
     setproctitle,
     std_headers,
@@ -42,6 +43,7 @@ from .downloader import (
 )
 from .extractor import gen_extractors, list_extractors
 from .extractor.adobepass import MSO_INFO
+from .formatsort import SORT_FIELDS
 from .YoutubeDL import YoutubeDL
 
 
@@ -90,16 +92,23 @@ def _real_main(argv=None):
                 batchfd = io.open(
                     expand_path(opts.batchfile),
                     'r', encoding='utf-8', errors='ignore')
-            batch_urls = read_batch_urls(batchfd)
-            if opts.verbose:
-                write_string('[debug] Batch file urls: ' + repr(batch_urls) + '\n')
         except IOError:
             sys.exit('ERROR: batch file could not be read')
-    all_urls = batch_urls + [url.strip() for url in args]  # batch_urls are already striped in read_batch_urls
+        # The batch file is read as the URLs are downloaded
+        batch_urls = iter_batch_urls(batchfd)
+        if opts.verbose:
+            batch_urls = _debug_batch_urls(batch_urls)
     _enc = preferredencoding()
-    all_urls = [url.decode(_enc, 'ignore') if isinstance(url, bytes) else url for url in all_urls]
+    all_urls = (
+        url.decode(_enc, 'ignore') if isinstance(url, bytes) else url
+        # batch_urls are already striped in iter_batch_urls
+        for url in itertools.chain(batch_urls, [url.strip() for url in args]))
+    first_url = next(all_urls, None)
+    if first_url is not None:
+        all_urls = itertools.chain([first_url], all_urls)
 
     if opts.list_extractors:
+        all_urls = list(all_urls)
         for ie in list_extractors(opts.age_limit):
             write_string(ie.IE_NAME + (' (CURRENTLY BROKEN)' if not ie._WORKING else '') + '\n', out=sys.stdout)
             matchedUrls = [url for url in all_urls if ie.suitable(url)]
@@ -186,6 +195,14 @@ def _real_main(argv=None):
         opts.retries = parse_retries(opts.retries)
     if opts.fragment_retries is not None:
         opts.fragment_retries = parse_retries(opts.fragment_retries)
+    if opts.concurrent_fragment_downloads <= 0:
+        parser.error('number of concurrent fragments must be positive')
+    if opts.lazy_playlist and (opts.playlist_reverse or opts.playlist_random):
+        parser.error('lazy playlists cannot be reversed or shuffled')
+    if opts.concurrent_playlist_entries <= 0:
+        parser.error('number of concurrent playlist entries must be positive')
+    if opts.http_connections <= 0:
+        parser.error('number of HTTP connections must be positive')
     if opts.buffersize is not None:
         numeric_buffersize = FileDownloader.parse_bytes(opts.buffersize)
         if numeric_buffersize is None:
@@ -210,6 +227,10 @@ def _real_main(argv=None):
     if opts.recodevideo is not None:
         if opts.recodevideo not in ['mp4', 'flv', 'webm', 'ogg', 'mkv', 'avi']:
             parser.error('invalid video recode format specified')
+    if opts.format_sort is not None:
+        for field in opts.format_sort:
+            if field not in SORT_FIELDS:
+                parser.error('invalid format sort field %s specified' % field)
     if opts.convertsubtitles is not None:
         if opts.convertsubtitles not in ['srt', 'vtt', 'ass', 'lrc']:
             parser.error('invalid subtitle format specified')
@@ -333,6 +354,10 @@ def _real_main(argv=None):
         'forceformat': opts.getformat,
         'forcejson': opts.dumpjson or opts.print_json,
         'dump_single_json': opts.dump_single_json,
+        # JSON lines are printed as entries are processed, nothing else
+        # uses their results
+        'keep_playlist_results': not opts.dumpjson,
+        'json_fields': opts.json_fields,
         'simulate': opts.simulate or any_getting,
         'skip_download': opts.skip_download,
         'format': opts.format,
@@ -348,6 +373,8 @@ def _real_main(argv=None):
         'retries': opts.retries,
         'fragment_retries': opts.fragment_retries,
         'skip_unavailable_fragments': opts.skip_unavailable_fragments,
+        'concurrent_fragment_downloads': opts.concurrent_fragment_downloads,
+        'http_connections': opts.http_connections,
         'keep_fragments': opts.keep_fragments,
         'buffersize': opts.buffersize,
         'noresizebuffer': opts.noresizebuffer,
@@ -359,6 +386,8 @@ def _real_main(argv=None):
         'playlistend': opts.playlistend,
         'playlistreverse': opts.playlist_reverse,
         'playlistrandom': opts.playlist_random,
+        'lazy_playlist': opts.lazy_playlist,
+        'concurrent_playlist_entries': opts.concurrent_playlist_entries,
         'noplaylist': opts.noplaylist,
         'logtostderr': opts.outtmpl == '-',
         'consoletitle': opts.consoletitle,
@@ -378,6 +407,7 @@ def _real_main(argv=None):
         'matchtitle': decodeOption(opts.matchtitle),
         'rejecttitle': decodeOption(opts.rejecttitle),
         'max_downloads': opts.max_downloads,
+        'format_sort': opts.format_sort,
         'prefer_free_formats': opts.prefer_free_formats,
         'verbose': opts.verbose,
         'dump_intermediate_pages': opts.dump_intermediate_pages,
@@ -393,6 +423,8 @@ def _real_main(argv=None):
         'youtube_print_sig_code': opts.youtube_print_sig_code,
         'age_limit': opts.age_limit,
         'download_archive': download_archive_fn,
+        'batch_log': expand_path(opts.batch_log) if opts.batch_log is not None else None,
+        'batch_prefetch': opts.batch_prefetch,
         'cookiefile': opts.cookiefile,
         'nocheckcertificate': opts.no_check_certificate,
         'prefer_insecure': opts.prefer_insecure,
@@ -408,9 +440,11 @@ def _real_main(argv=None):
         'extract_flat': opts.extract_flat,
         'mark_watched': opts.mark_watched,
         'merge_output_format': opts.merge_output_format,
+        'concurrent_format_downloads': opts.concurrent_format_downloads,
         'postprocessors': postprocessors,
         'fixup': opts.fixup,
         'source_address': opts.source_address,
+        'no_keep_alive': opts.no_keep_alive,
         'call_home': opts.call_home,
         'sleep_interval': opts.sleep_interval,
         'max_sleep_interval': opts.max_sleep_interval,
@@ -446,7 +480,7 @@ def _real_main(argv=None):
             ydl.cache.remove()
 
         # Maybe do nothing
-        if (len(all_urls) < 1) and (opts.load_info_filename is None):
+        if first_url is None and opts.load_info_filename is None:
             if opts.update_self or opts.rm_cachedir:
                 sys.exit()
 
@@ -458,8 +492,10 @@ def _real_main(argv=None):
         try:
             if opts.load_info_filename is not None:
                 retcode = ydl.download_with_info_file(expand_path(opts.load_info_filename))
+            elif opts.batch_log is not None or opts.batch_prefetch:
+                retcode = ydl.download_batch(all_urls)
             else:
-                retcode = ydl.download(all_urls)
+                retcode = ydl.download(list(all_urls))
         except MaxDownloadsReached:
             ydl.to_screen('--max-download limit reached, aborting.')
             retcode = 101
@@ -467,6 +503,12 @@ def _real_main(argv=None):
     sys.exit(retcode)
 
 
+def _debug_batch_urls(batch_urls):
+    for url in batch_urls:
+        write_string('[debug] Batch file url: ' + repr(url) + '\n')
+        yield url
+
+
 def main(argv=None):
     try:
         _real_main(argv)
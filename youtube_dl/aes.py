@@ -1,12 +1,100 @@
 from __future__ import unicode_literals
 
+import struct
 from math import ceil
 
 from .compat import compat_b64decode
 from .utils import bytes_to_intlist, intlist_to_bytes
 
+try:
+    from Cryptodome.Cipher import AES as _CryptoAES
+except ImportError:
+    try:
+        from Crypto.Cipher import AES as _CryptoAES
+    except ImportError:
+        _CryptoAES = None
+
 BLOCK_SIZE_BYTES = 16
 
+# A block as four big endian 32-bit words, the columns of the AES state
+_BLOCK = struct.Struct(str('>4I'))
+
+
+def aes_cbc_decrypt_bytes(data, key, iv):
+    """
+    Decrypt with aes in CBC mode, no padding is removed
+
+    @param {bytes} data        cipher, a multiple of 16 bytes long
+    @param {bytes} key         16/24/32-Byte cipher key
+    @param {bytes} iv          16-Byte IV
+    @returns {bytes}           decrypted data
+    """
+    if _CryptoAES is not None:
+        return _CryptoAES.new(bytes(key), _CryptoAES.MODE_CBC, bytes(iv)).decrypt(bytes(data))
+    buf = bytearray(data)
+    _cbc_decrypt_inplace(buf, _key_schedule(key), iv)
+    return bytes(buf)
+
+
+def aes_cbc_encrypt_bytes(data, key, iv):
+    """
+    Encrypt with aes in CBC mode. Using PKCS#7 padding, except when data
+    is a multiple of 16 bytes long
+
+    @param {bytes} data        cleartext
+    @param {bytes} key         16/24/32-Byte cipher key
+    @param {bytes} iv          16-Byte IV
+    @returns {bytes}           encrypted data
+    """
+    buf = bytearray(data)
+    remaining_length = -len(buf) % BLOCK_SIZE_BYTES
+    buf.extend([remaining_length] * remaining_length)
+    if _CryptoAES is not None:
+        return _CryptoAES.new(bytes(key), _CryptoAES.MODE_CBC, bytes(iv)).encrypt(bytes(buf))
+    _cbc_encrypt_inplace(buf, _key_schedule(key), iv)
+    return bytes(buf)
+
+
+def aes_ctr_decrypt_bytes(data, key, iv):
+    """
+    Decrypt with aes in counter mode, the counter being the whole block
+
+    @param {bytes} data        cipher
+    @param {bytes} key         16/24/32-Byte cipher key
+    @param {bytes} iv          16-Byte initial counter block
+    @returns {bytes}           decrypted data
+    """
+    return _ctr_xcrypt(data, key, _counter_blocks(_BLOCK.unpack(bytes(iv))))
+
+
+def _counter_blocks(counter):
+    c0, c1, c2, c3 = counter
+    while True:
+        yield c0, c1, c2, c3
+        c3 = (c3 + 1) & 0xFFFFFFFF
+        if not c3:
+            c2 = (c2 + 1) & 0xFFFFFFFF
+            if not c2:
+                c1 = (c1 + 1) & 0xFFFFFFFF
+                if not c1:
+                    c0 = (c0 + 1) & 0xFFFFFFFF
+
+
+def _ctr_xcrypt(data, key, counter_blocks):
+    buf = bytearray(data)
+    size = len(buf)
+    buf.extend(b'\0' * (-size % BLOCK_SIZE_BYTES))
+    block_count = len(buf) // BLOCK_SIZE_BYTES
+    if _CryptoAES is not None:
+        counters = b''.join(
+            _BLOCK.pack(*counter) for _, counter in zip(range(block_count), counter_blocks))
+        keystream = bytearray(_CryptoAES.new(bytes(key), _CryptoAES.MODE_ECB).encrypt(counters))
+        for i in range(size):
+            buf[i] ^= keystream[i]
+    else:
+        _ctr_xcrypt_inplace(buf, _key_schedule(key), counter_blocks)
+    return bytes(buf[:size])
+
 
 def aes_ctr_decrypt(data, key, counter):
     """
@@ -18,20 +106,12 @@ def aes_ctr_decrypt(data, key, counter):
                                returns the next counter block
     @returns {int[]}           decrypted data
     """
-    expanded_key = key_expansion(key)
-    block_count = int(ceil(float(len(data)) / BLOCK_SIZE_BYTES))
-
-    decrypted_data = []
-    for i in range(block_count):
-        counter_block = counter.next_value()
-        block = data[i * BLOCK_SIZE_BYTES: (i + 1) * BLOCK_SIZE_BYTES]
-        block += [0] * (BLOCK_SIZE_BYTES - len(block))
-
-        cipher_counter_block = aes_encrypt(counter_block, expanded_key)
-        decrypted_data += xor(block, cipher_counter_block)
-    decrypted_data = decrypted_data[:len(data)]
+    def counter_blocks():
+        while True:
+            yield _BLOCK.unpack(intlist_to_bytes(counter.next_value()))
 
-    return decrypted_data
+    return bytes_to_intlist(_ctr_xcrypt(
+        intlist_to_bytes(data), intlist_to_bytes(key), counter_blocks()))
 
 
 def aes_cbc_decrypt(data, key, iv):
@@ -43,21 +123,12 @@ def aes_cbc_decrypt(data, key, iv):
     @param {int[]} iv          16-Byte IV
     @returns {int[]}           decrypted data
     """
-    expanded_key = key_expansion(key)
-    block_count = int(ceil(float(len(data)) / BLOCK_SIZE_BYTES))
-
-    decrypted_data = []
-    previous_cipher_block = iv
-    for i in range(block_count):
-        block = data[i * BLOCK_SIZE_BYTES: (i + 1) * BLOCK_SIZE_BYTES]
-        block += [0] * (BLOCK_SIZE_BYTES - len(block))
-
-        decrypted_block = aes_decrypt(block, expanded_key)
-        decrypted_data += xor(decrypted_block, previous_cipher_block)
-        previous_cipher_block = block
-    decrypted_data = decrypted_data[:len(data)]
-
-    return decrypted_data
+    data_len = len(data)
+    block_count = int(ceil(float(data_len) / BLOCK_SIZE_BYTES))
+    padded_data = data + [0] * (block_count * BLOCK_SIZE_BYTES - data_len)
+    decrypted_data = bytes_to_intlist(aes_cbc_decrypt_bytes(
+        intlist_to_bytes(padded_data), intlist_to_bytes(key), intlist_to_bytes(iv)))
+    return decrypted_data[:data_len]
 
 
 def aes_cbc_encrypt(data, key, iv):
@@ -69,23 +140,8 @@ def aes_cbc_encrypt(data, key, iv):
     @param {int[]} iv          16-Byte IV
     @returns {int[]}           encrypted data
     """
-    expanded_key = key_expansion(key)
-    block_count = int(ceil(float(len(data)) / BLOCK_SIZE_BYTES))
-
-    encrypted_data = []
-    previous_cipher_block = iv
-    for i in range(block_count):
-        block = data[i * BLOCK_SIZE_BYTES: (i + 1) * BLOCK_SIZE_BYTES]
-        remaining_length = BLOCK_SIZE_BYTES - len(block)
-        block += [remaining_length] * remaining_length
-        mixed_block = xor(block, previous_cipher_block)
-
-        encrypted_block = aes_encrypt(mixed_block, expanded_key)
-        encrypted_data += encrypted_block
-
-        previous_cipher_block = encrypted_block
-
-    return encrypted_data
+    return bytes_to_intlist(aes_cbc_encrypt_bytes(
+        intlist_to_bytes(data), intlist_to_bytes(key), intlist_to_bytes(iv)))
 
 
 def key_expansion(data):
@@ -127,6 +183,38 @@ def aes_encrypt(data, expanded_key):
     """
     Encrypt one block with aes
 
+    @param {int[]} data          16-Byte state
+    @param {int[]} expanded_key  176/208/240-Byte expanded key
+    @returns {int[]}             16-Byte cipher
+    """
+    if len(data) < BLOCK_SIZE_BYTES or len(expanded_key) < 2 * BLOCK_SIZE_BYTES:
+        # Less than a block or no round at all
+        return _reference_aes_encrypt(data, expanded_key)
+    buf = bytearray(intlist_to_bytes(data[:BLOCK_SIZE_BYTES]))
+    _ecb_encrypt_inplace(buf, _round_key_words(expanded_key))
+    return bytes_to_intlist(bytes(buf))
+
+
+def aes_decrypt(data, expanded_key):
+    """
+    Decrypt one block with aes
+
+    @param {int[]} data          16-Byte cipher
+    @param {int[]} expanded_key  176/208/240-Byte expanded key
+    @returns {int[]}             16-Byte state
+    """
+    if len(data) < BLOCK_SIZE_BYTES or len(expanded_key) < 2 * BLOCK_SIZE_BYTES:
+        # Less than a block or no round at all
+        return _reference_aes_decrypt(data, expanded_key)
+    buf = bytearray(intlist_to_bytes(data[:BLOCK_SIZE_BYTES]))
+    _ecb_decrypt_inplace(buf, _decryption_round_keys(_round_key_words(expanded_key)))
+    return bytes_to_intlist(bytes(buf))
+
+
+def _reference_aes_encrypt(data, expanded_key):
+    """
+    Encrypt one block with aes, straight from the specification
+
     @param {int[]} data          16-Byte state
     @param {int[]} expanded_key  176/208/240-Byte expanded key
     @returns {int[]}             16-Byte cipher
@@ -144,9 +232,9 @@ def aes_encrypt(data, expanded_key):
     return data
 
 
-def aes_decrypt(data, expanded_key):
+def _reference_aes_decrypt(data, expanded_key):
     """
-    Decrypt one block with aes
+    Decrypt one block with aes, straight from the specification
 
     @param {int[]} data          16-Byte cipher
     @param {int[]} expanded_key  176/208/240-Byte expanded key
@@ -180,27 +268,18 @@ def aes_decrypt_text(data, password, key_size_bytes):
     """
     NONCE_LENGTH_BYTES = 8
 
-    data = bytes_to_intlist(compat_b64decode(data))
-    password = bytes_to_intlist(password.encode('utf-8'))
+    data = compat_b64decode(data)
+    password = password.encode('utf-8')
 
-    key = password[:key_size_bytes] + [0] * (key_size_bytes - len(password))
-    key = aes_encrypt(key[:BLOCK_SIZE_BYTES], key_expansion(key)) * (key_size_bytes // BLOCK_SIZE_BYTES)
+    key = password[:key_size_bytes].ljust(key_size_bytes, b'\0')
+    first_block = bytearray(key[:BLOCK_SIZE_BYTES])
+    _ecb_encrypt_inplace(first_block, _key_schedule(key))
+    key = bytes(first_block) * (key_size_bytes // BLOCK_SIZE_BYTES)
 
     nonce = data[:NONCE_LENGTH_BYTES]
     cipher = data[NONCE_LENGTH_BYTES:]
 
-    class Counter(object):
-        __value = nonce + [0] * (BLOCK_SIZE_BYTES - NONCE_LENGTH_BYTES)
-
-        def next_value(self):
-            temp = self.__value
-            self.__value = inc(self.__value)
-            return temp
-
-    decrypted_data = aes_ctr_decrypt(cipher, key, Counter())
-    plaintext = intlist_to_bytes(decrypted_data)
-
-    return plaintext
+    return aes_ctr_decrypt_bytes(cipher, key, nonce + b'\0' * (BLOCK_SIZE_BYTES - NONCE_LENGTH_BYTES))
 
 
 RCON = (0x8d, 0x01, 0x02, 0x04, 0x08, 0x10, 0x20, 0x40, 0x80, 0x1b, 0x36)
@@ -358,4 +437,138 @@ def inc(data):
     return data
 
 
-__all__ = ['aes_encrypt', 'key_expansion', 'aes_ctr_decrypt', 'aes_cbc_decrypt', 'aes_decrypt_text']
+# Table driven implementation working on 32-bit words, see section 5.2.1 of
+# "AES Proposal: Rijndael" by J. Daemen and V. Rijmen. Each T-table combines
+# SubBytes and MixColumns (or their inverses) for one byte of a column.
+
+def _rotate_word(word):
+    return ((word >> 8) | (word << 24)) & 0xFFFFFFFF
+
+
+def _make_tables(sbox, matrix_row):
+    t0 = tuple(
+        rijndael_mul(s, matrix_row[0]) << 24 | rijndael_mul(s, matrix_row[1]) << 16 |
+        rijndael_mul(s, matrix_row[2]) << 8 | rijndael_mul(s, matrix_row[3])
+        for s in sbox)
+    t1 = tuple(_rotate_word(w) for w in t0)
+    t2 = tuple(_rotate_word(w) for w in t1)
+    t3 = tuple(_rotate_word(w) for w in t2)
+    return t0, t1, t2, t3
+
+
+_TE = _make_tables(SBOX, (2, 1, 1, 3))
+_TD = _make_tables(SBOX_INV, (14, 9, 13, 11))
+
+
+def _round_key_words(expanded_key):
+    return struct.unpack(
+        str('>%dI' % (len(expanded_key) // 4)), intlist_to_bytes(expanded_key))
+
+
+def _key_schedule(key):
+    return _round_key_words(key_expansion(bytes_to_intlist(bytes(key))))
+
+
+def _decryption_round_keys(rk):
+    # Round keys of the equivalent inverse cipher: in reverse order, with
+    # InvMixColumns applied to the ones of the inner rounds
+    td0, td1, td2, td3 = _TD
+    rounds = len(rk) // 4 - 1
+    drk = list(rk[rounds * 4:rounds * 4 + 4])
+    for i in range(rounds - 1, 0, -1):
+        for w in rk[i * 4:i * 4 + 4]:
+            drk.append(
+                td0[SBOX[w >> 24]] ^ td1[SBOX[w >> 16 & 255]] ^
+                td2[SBOX[w >> 8 & 255]] ^ td3[SBOX[w & 255]])
+    drk.extend(rk[:4])
+    return tuple(drk)
+
+
+def _encrypt_block(s0, s1, s2, s3, rk):
+    te0, te1, te2, te3 = _TE
+    s0 ^= rk[0]
+    s1 ^= rk[1]
+    s2 ^= rk[2]
+    s3 ^= rk[3]
+    for k in range(4, len(rk) - 4, 4):
+        s0, s1, s2, s3 = (
+            te0[s0 >> 24] ^ te1[s1 >> 16 & 255] ^ te2[s2 >> 8 & 255] ^ te3[s3 & 255] ^ rk[k],
+            te0[s1 >> 24] ^ te1[s2 >> 16 & 255] ^ te2[s3 >> 8 & 255] ^ te3[s0 & 255] ^ rk[k + 1],
+            te0[s2 >> 24] ^ te1[s3 >> 16 & 255] ^ te2[s0 >> 8 & 255] ^ te3[s1 & 255] ^ rk[k + 2],
+            te0[s3 >> 24] ^ te1[s0 >> 16 & 255] ^ te2[s1 >> 8 & 255] ^ te3[s2 & 255] ^ rk[k + 3])
+    k = len(rk) - 4
+    sbox = SBOX
+    return (
+        (sbox[s0 >> 24] << 24 | sbox[s1 >> 16 & 255] << 16 | sbox[s2 >> 8 & 255] << 8 | sbox[s3 & 255]) ^ rk[k],
+        (sbox[s1 >> 24] << 24 | sbox[s2 >> 16 & 255] << 16 | sbox[s3 >> 8 & 255] << 8 | sbox[s0 & 255]) ^ rk[k + 1],
+        (sbox[s2 >> 24] << 24 | sbox[s3 >> 16 & 255] << 16 | sbox[s0 >> 8 & 255] << 8 | sbox[s1 & 255]) ^ rk[k + 2],
+        (sbox[s3 >> 24] << 24 | sbox[s0 >> 16 & 255] << 16 | sbox[s1 >> 8 & 255] << 8 | sbox[s2 & 255]) ^ rk[k + 3])
+
+
+def _decrypt_block(s0, s1, s2, s3, drk):
+    td0, td1, td2, td3 = _TD
+    s0 ^= drk[0]
+    s1 ^= drk[1]
+    s2 ^= drk[2]
+    s3 ^= drk[3]
+    for k in range(4, len(drk) - 4, 4):
+        s0, s1, s2, s3 = (
+            td0[s0 >> 24] ^ td1[s3 >> 16 & 255] ^ td2[s2 >> 8 & 255] ^ td3[s1 & 255] ^ drk[k],
+            td0[s1 >> 24] ^ td1[s0 >> 16 & 255] ^ td2[s3 >> 8 & 255] ^ td3[s2 & 255] ^ drk[k + 1],
+            td0[s2 >> 24] ^ td1[s1 >> 16 & 255] ^ td2[s0 >> 8 & 255] ^ td3[s3 & 255] ^ drk[k + 2],
+            td0[s3 >> 24] ^ td1[s2 >> 16 & 255] ^ td2[s1 >> 8 & 255] ^ td3[s0 & 255] ^ drk[k + 3])
+    k = len(drk) - 4
+    sbox = SBOX_INV
+    return (
+        (sbox[s0 >> 24] << 24 | sbox[s3 >> 16 & 255] << 16 | sbox[s2 >> 8 & 255] << 8 | sbox[s1 & 255]) ^ drk[k],
+        (sbox[s1 >> 24] << 24 | sbox[s0 >> 16 & 255] << 16 | sbox[s3 >> 8 & 255] << 8 | sbox[s2 & 255]) ^ drk[k + 1],
+        (sbox[s2 >> 24] << 24 | sbox[s1 >> 16 & 255] << 16 | sbox[s0 >> 8 & 255] << 8 | sbox[s3 & 255]) ^ drk[k + 2],
+        (sbox[s3 >> 24] << 24 | sbox[s2 >> 16 & 255] << 16 | sbox[s1 >> 8 & 255] << 8 | sbox[s0 & 255]) ^ drk[k + 3])
+
+
+# The functions below work in place on a bytearray a multiple of 16 bytes long
+
+def _ecb_encrypt_inplace(buf, rk):
+    unpack_from, pack_into = _BLOCK.unpack_from, _BLOCK.pack_into
+    for offset in range(0, len(buf), BLOCK_SIZE_BYTES):
+        pack_into(buf, offset, *_encrypt_block(*unpack_from(buf, offset), rk=rk))
+
+
+def _ecb_decrypt_inplace(buf, drk):
+    unpack_from, pack_into = _BLOCK.unpack_from, _BLOCK.pack_into
+    for offset in range(0, len(buf), BLOCK_SIZE_BYTES):
+        pack_into(buf, offset, *_decrypt_block(*unpack_from(buf, offset), drk=drk))
+
+
+def _cbc_decrypt_inplace(buf, rk, iv):
+    drk = _decryption_round_keys(rk)
+    unpack_from, pack_into = _BLOCK.unpack_from, _BLOCK.pack_into
+    p0, p1, p2, p3 = _BLOCK.unpack(bytes(iv))
+    for offset in range(0, len(buf), BLOCK_SIZE_BYTES):
+        c0, c1, c2, c3 = unpack_from(buf, offset)
+        s0, s1, s2, s3 = _decrypt_block(c0, c1, c2, c3, drk)
+        pack_into(buf, offset, s0 ^ p0, s1 ^ p1, s2 ^ p2, s3 ^ p3)
+        p0, p1, p2, p3 = c0, c1, c2, c3
+
+
+def _cbc_encrypt_inplace(buf, rk, iv):
+    unpack_from, pack_into = _BLOCK.unpack_from, _BLOCK.pack_into
+    c0, c1, c2, c3 = _BLOCK.unpack(bytes(iv))
+    for offset in range(0, len(buf), BLOCK_SIZE_BYTES):
+        s0, s1, s2, s3 = unpack_from(buf, offset)
+        c0, c1, c2, c3 = _encrypt_block(s0 ^ c0, s1 ^ c1, s2 ^ c2, s3 ^ c3, rk)
+        pack_into(buf, offset, c0, c1, c2, c3)
+
+
+def _ctr_xcrypt_inplace(buf, rk, counter_blocks):
+    unpack_from, pack_into = _BLOCK.unpack_from, _BLOCK.pack_into
+    for offset, counter in zip(range(0, len(buf), BLOCK_SIZE_BYTES), counter_blocks):
+        k0, k1, k2, k3 = _encrypt_block(*counter, rk=rk)
+        s0, s1, s2, s3 = unpack_from(buf, offset)
+        pack_into(buf, offset, s0 ^ k0, s1 ^ k1, s2 ^ k2, s3 ^ k3)
+
+
+__all__ = [
+    'aes_encrypt', 'key_expansion', 'aes_ctr_decrypt', 'aes_cbc_decrypt', 'aes_decrypt_text',
+    'aes_cbc_decrypt_bytes', 'aes_cbc_encrypt_bytes', 'aes_ctr_decrypt_bytes',
+]
@@ -0,0 +1,135 @@
+from __future__ import unicode_literals
+
+import errno
+import os
+import threading
+
+try:
+    import sqlite3
+except ImportError:  # Python built without sqlite support
+    sqlite3 = None
+
+from .utils import locked_file
+
+
+SQLITE_EXTENSIONS = ('.sqlite', '.sqlite3', '.db')
+
+
+class DownloadArchive(object):
+    """Download archive kept in a text file with one ID per line
+
+    The IDs are read once into a set. Afterwards only lines appended to
+    the file since the last read (e.g. by other youtube-dl processes
+    sharing the archive) are read, and only when an ID is not found.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._ids = set()
+        self._offset = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _sync(self):
+        try:
+            size = os.path.getsize(self.filename)
+        except OSError as ose:
+            if ose.errno != errno.ENOENT:
+                raise
+            return
+        if size == self._size:
+            return
+        if size < self._size:
+            # The archive has been rewritten by someone else
+            self._ids.clear()
+            self._offset = 0
+        try:
+            with locked_file(self.filename, 'r', encoding='utf-8') as archive_file:
+                archive_file.seek(self._offset)
+                data = archive_file.read()
+                self._offset = archive_file.tell()
+        except IOError as ioe:
+            if ioe.errno != errno.ENOENT:
+                raise
+            return
+        self._size = size
+        self._ids.update(
+            line.strip() for line in data.splitlines() if line.strip())
+
+    def __contains__(self, vid_id):
+        with self._lock:
+            if vid_id not in self._ids:
+                self._sync()
+            return vid_id in self._ids
+
+    def add(self, vid_id):
+        with self._lock:
+            with locked_file(self.filename, 'a', encoding='utf-8') as archive_file:
+                archive_file.write(vid_id + '\n')
+            self._ids.add(vid_id)
+
+
+class SqliteDownloadArchive(object):
+    """Download archive kept in an SQLite database
+
+    SQLite takes care of locking, so that the archive can be shared by
+    concurrent youtube-dl processes. IDs found in the database are
+    remembered in memory.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._ids = set()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            filename, timeout=60, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS archive (id TEXT PRIMARY KEY)')
+
+    def __contains__(self, vid_id):
+        with self._lock:
+            if vid_id in self._ids:
+                return True
+            found = self._conn.execute(
+                'SELECT 1 FROM archive WHERE id = ?', (vid_id,)).fetchone()
+            if found:
+                self._ids.add(vid_id)
+            return bool(found)
+
+    def add(self, vid_id):
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    'INSERT OR IGNORE INTO archive (id) VALUES (?)', (vid_id,))
+            self._ids.add(vid_id)
+
+
+def _is_sqlite_file(filename):
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(16) == b'SQLite format 3\x00'
+    except IOError as ioe:
+        if ioe.errno != errno.ENOENT:
+            raise
+    return None
+
+
+def open_download_archive(filename):
+    """Open the download archive stored in filename
+
+    Existing SQLite databases and new files with an SQLite extension are
+    opened as SQLite download archives, any other file as a text file.
+    """
+    is_sqlite = _is_sqlite_file(filename)
+    if is_sqlite is None:
+        is_sqlite = (
+            sqlite3 is not None
+            and os.path.splitext(filename)[1].lower() in SQLITE_EXTENSIONS)
+    if is_sqlite:
+        if sqlite3 is None:
+            raise IOError(
+                'Download archive %s is an SQLite database, but sqlite3 '
+                'is not available' % filename)
+        return SqliteDownloadArchive(filename)
+    return DownloadArchive(filename)
@@ -1,13 +1,22 @@
 from __future__ import unicode_literals
 
+import copy
 import errno
 import io
 import json
 import os
 import re
 import shutil
+import threading
+import time
 import traceback
 
+try:
+    import sqlite3
+except ImportError:  # Python built without sqlite support
+    sqlite3 = None
+
+from .archive import SQLITE_EXTENSIONS
 from .compat import compat_getenv
 from .utils import (
     expand_path,
@@ -15,9 +24,218 @@ from .utils import (
 )
 
 
+class MemoryLRU(object):
+    """
+    Thread-safe in-memory mapping holding at most max_size items
+
+    Storing an item beyond that drops the least recently stored or
+    retrieved one.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = {}
+        self._tick = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+            self._tick += 1
+            item[1] = self._tick
+            return item[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._tick += 1
+            self._items[key] = [value, self._tick]
+            while len(self._items) > self.max_size:
+                del self._items[min(self._items, key=lambda k: self._items[k][1])]
+
+    def pop(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class FileCacheStore(object):
+    """
+    Cache entries kept in JSON files, one per entry in a directory per
+    section
+
+    Files are replaced atomically. Their modification time is the time the
+    entry was stored and their access time the time it was last used, other
+    processes may share the directory.
+    """
+
+    def __init__(self, root_dir):
+        self.location = root_dir
+
+    def _fn(self, section, key):
+        return os.path.join(self.location, section, '%s.json' % key)
+
+    def stamp(self, section, key):
+        """Return the time the entry was stored, or None if there is none"""
+        try:
+            return os.path.getmtime(self._fn(section, key))
+        except OSError:
+            return None
+
+    def get(self, section, key):
+        fn = self._fn(section, key)
+        try:
+            with io.open(fn, 'r', encoding='utf-8') as cachef:
+                return json.load(cachef)
+        except ValueError:
+            try:
+                file_size = os.path.getsize(fn)
+            except (OSError, IOError) as oe:
+                file_size = str(oe)
+            raise ValueError('Cache retrieval from %s failed (%s)' % (fn, file_size))
+
+    def put(self, section, key, data):
+        fn = self._fn(section, key)
+        try:
+            os.makedirs(os.path.dirname(fn))
+        except OSError as ose:
+            if ose.errno != errno.EEXIST:
+                raise
+        write_json_file(data, fn)
+        return os.path.getmtime(fn)
+
+    def touch(self, section, key):
+        fn = self._fn(section, key)
+        try:
+            os.utime(fn, (time.time(), os.path.getmtime(fn)))
+        except OSError:
+            pass
+
+    def delete(self, section, key):
+        try:
+            os.remove(self._fn(section, key))
+        except OSError:
+            pass
+
+    def evict(self, section, max_entries):
+        dirname = os.path.join(self.location, section)
+        entries = []
+        for name in os.listdir(dirname):
+            if not name.endswith('.json'):
+                continue
+            fn = os.path.join(dirname, name)
+            try:
+                entries.append((os.path.getatime(fn), fn))
+            except OSError:
+                pass
+        entries.sort()
+        for _, fn in entries[:max(len(entries) - max_entries, 0)]:
+            try:
+                os.remove(fn)
+            except OSError:
+                pass
+
+    def remove(self, section=None):
+        path = self.location if section is None else os.path.join(self.location, section)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+
+class SqliteCacheStore(object):
+    """Cache entries kept in a single SQLite database"""
+
+    def __init__(self, filename):
+        self.location = filename
+        self._lock = threading.Lock()
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self._conn = sqlite3.connect(
+            filename, timeout=60, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'section TEXT, key TEXT, data TEXT, stored REAL, used REAL, '
+                'PRIMARY KEY (section, key))')
+
+    def _query(self, sql, args=()):
+        with self._lock:
+            return self._conn.execute(sql, args).fetchone()
+
+    def _update(self, sql, args=()):
+        with self._lock:
+            with self._conn:
+                self._conn.execute(sql, args)
+
+    def stamp(self, section, key):
+        row = self._query(
+            'SELECT stored FROM cache WHERE section = ? AND key = ?', (section, key))
+        return row[0] if row else None
+
+    def get(self, section, key):
+        row = self._query(
+            'SELECT data FROM cache WHERE section = ? AND key = ?', (section, key))
+        if row is None:
+            raise IOError('No cache entry for %s/%s' % (section, key))
+        return json.loads(row[0])
+
+    def put(self, section, key, data):
+        now = time.time()
+        self._update(
+            'INSERT OR REPLACE INTO cache (section, key, data, stored, used) '
+            'VALUES (?, ?, ?, ?, ?)', (section, key, json.dumps(data), now, now))
+        return now
+
+    def touch(self, section, key):
+        self._update(
+            'UPDATE cache SET used = ? WHERE section = ? AND key = ?',
+            (time.time(), section, key))
+
+    def delete(self, section, key):
+        self._update(
+            'DELETE FROM cache WHERE section = ? AND key = ?', (section, key))
+
+    def evict(self, section, max_entries):
+        self._update(
+            'DELETE FROM cache WHERE section = ? AND key IN ('
+            'SELECT key FROM cache WHERE section = ? '
+            'ORDER BY used DESC LIMIT -1 OFFSET ?)', (section, section, max_entries))
+
+    def remove(self, section=None):
+        if section is None:
+            self._update('DELETE FROM cache')
+        else:
+            self._update('DELETE FROM cache WHERE section = ?', (section,))
+
+
 class Cache(object):
+    """
+    Persistent cache of JSON data by section and key
+
+    The cache lives either in a directory or, when cachedir has an SQLite
+    extension, in a single SQLite database. Loaded and stored entries are
+    also kept in memory, they are only read again when they have been
+    stored anew, possibly by another process.
+    """
+
+    # Number of entries kept in memory by each cache
+    _MEMORY_SIZE = 256
+    # Minimum interval between two updates of the last use time of an entry
+    _TOUCH_INTERVAL = 60
+
     def __init__(self, ydl):
         self._ydl = ydl
+        self._store = None
+        self._store_lock = threading.Lock()
+        # (stored time, data, last use update time) by (section, key)
+        self._memory = MemoryLRU(self._MEMORY_SIZE)
 
     def _get_root_dir(self):
         res = self._ydl.params.get('cachedir')
@@ -26,60 +244,99 @@ class Cache(object):
             res = os.path.join(cache_root, 'youtube-dl')
         return expand_path(res)
 
-    def _get_cache_fn(self, section, key, dtype):
+    def _get_store(self):
+        root_dir = self._get_root_dir()
+        with self._store_lock:
+            if self._store is None or self._store.location != root_dir:
+                self._memory.clear()
+                if (sqlite3 is not None
+                        and os.path.splitext(root_dir)[1].lower() in SQLITE_EXTENSIONS
+                        and not os.path.isdir(root_dir)):
+                    self._store = SqliteCacheStore(root_dir)
+                else:
+                    self._store = FileCacheStore(root_dir)
+            return self._store
+
+    @staticmethod
+    def _check_key(section, key):
         assert re.match(r'^[a-zA-Z0-9_.-]+$', section), \
             'invalid section %r' % section
         assert re.match(r'^[a-zA-Z0-9_.-]+$', key), 'invalid key %r' % key
-        return os.path.join(
-            self._get_root_dir(), section, '%s.%s' % (key, dtype))
 
     @property
     def enabled(self):
         return self._ydl.params.get('cachedir') is not False
 
-    def store(self, section, key, data, dtype='json'):
+    def store(self, section, key, data, dtype='json', max_entries=None):
+        """
+        Store data under key in section
+
+        If max_entries is given, the least recently stored or loaded entries
+        of the section are then removed so that at most max_entries remain.
+        """
         assert dtype in ('json',)
 
         if not self.enabled:
             return
 
-        fn = self._get_cache_fn(section, key, dtype)
+        self._check_key(section, key)
         try:
-            try:
-                os.makedirs(os.path.dirname(fn))
-            except OSError as ose:
-                if ose.errno != errno.EEXIST:
-                    raise
-            write_json_file(data, fn)
+            store = self._get_store()
+            stamp = store.put(section, key, data)
+            self._memory.put((section, key), (stamp, copy.deepcopy(data), time.time()))
+            if max_entries is not None:
+                store.evict(section, max_entries)
         except Exception:
             tb = traceback.format_exc()
             self._ydl.report_warning(
-                'Writing cache to %r failed: %s' % (fn, tb))
+                'Writing cache to %r failed: %s' % (
+                    os.path.join(self._get_root_dir(), section, key), tb))
+
+    def load(self, section, key, dtype='json', default=None, ttl=None):
+        """
+        Return the data stored under key in section, or default
 
-    def load(self, section, key, dtype='json', default=None):
+        If ttl is given, data stored more than ttl seconds ago is dropped.
+        """
         assert dtype in ('json',)
 
         if not self.enabled:
             return default
 
-        cache_fn = self._get_cache_fn(section, key, dtype)
+        self._check_key(section, key)
+        mem_key = (section, key)
         try:
-            try:
-                with io.open(cache_fn, 'r', encoding='utf-8') as cachef:
-                    return json.load(cachef)
-            except ValueError:
-                try:
-                    file_size = os.path.getsize(cache_fn)
-                except (OSError, IOError) as oe:
-                    file_size = str(oe)
-                self._ydl.report_warning(
-                    'Cache retrieval from %s failed (%s)' % (cache_fn, file_size))
-        except IOError:
+            store = self._get_store()
+            stamp = store.stamp(section, key)
+            if stamp is None:
+                self._memory.pop(mem_key)
+                return default
+            now = time.time()
+            if ttl is not None and now - stamp > ttl:
+                self._memory.pop(mem_key)
+                store.delete(section, key)
+                return default
+            cached = self._memory.get(mem_key)
+            if cached is None or cached[0] != stamp:
+                cached = (stamp, store.get(section, key), 0)
+            if now - cached[2] > self._TOUCH_INTERVAL:
+                # Mark the entry as recently used
+                store.touch(section, key)
+                cached = (stamp, cached[1], now)
+            self._memory.put(mem_key, cached)
+            return copy.deepcopy(cached[1])
+        except ValueError as ve:
+            self._ydl.report_warning(str(ve))
+        except (IOError, OSError):
             pass  # No cache available
+        except Exception as e:
+            if sqlite3 is None or not isinstance(e, sqlite3.Error):
+                raise
 
         return default
 
-    def remove(self):
+    def remove(self, section=None):
+        """Remove the whole cache, or only the given section"""
         if not self.enabled:
             self._ydl.to_screen('Cache is disabled (Did you combine --no-cache-dir and --rm-cache-dir?)')
             return
@@ -92,5 +349,6 @@ class Cache(object):
             'Removing cache dir %s .' % cachedir, skip_eol=True)
         if os.path.exists(cachedir):
             self._ydl.to_screen('.', skip_eol=True)
-            shutil.rmtree(cachedir)
+            self._get_store().remove(section)
+        self._memory.clear()
         self._ydl.to_screen('.')
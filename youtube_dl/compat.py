@@ -2925,6 +2925,12 @@ except ImportError:  # not 2.6+ or is 3.x
         compat_zip = zip
 
 
+try:
+    import re._parser as compat_sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse as compat_sre_parse
+
+
 if sys.version_info < (3, 3):
     def compat_b64decode(s, *args, **kwargs):
         if isinstance(s, compat_str):
@@ -2985,6 +2991,7 @@ __all__ = [
     'compat_shlex_quote',
     'compat_shlex_split',
     'compat_socket_create_connection',
+    'compat_sre_parse',
     'compat_str',
     'compat_struct_pack',
     'compat_struct_unpack',
@@ -51,6 +51,8 @@ class FileDownloader(object):
     http_chunk_size:    Size of a chunk for chunk-based HTTP downloading. May be
                         useful for bypassing bandwidth throttling imposed by
                         a webserver (experimental)
+    http_connections:   Number of connections to download a file of known size
+                        over HTTP with, each one fetching its own byte range.
 
     Subclasses of this one must re-define the real_download method.
     """
@@ -180,6 +182,8 @@ class FileDownloader(object):
 
     def temp_name(self, filename):
         """Returns a temporary filename for the given filename."""
+        if hasattr(filename, 'write'):
+            return filename
         if self.params.get('nopart', False) or filename == '-' or \
                 (os.path.exists(encodeFilename(filename)) and not os.path.isfile(encodeFilename(filename))):
             return filename
@@ -1,8 +1,65 @@
 from __future__ import unicode_literals
 
+import itertools
+import re
+
 from .fragment import FragmentFD
-from ..compat import compat_urllib_error
-from ..utils import urljoin
+from ..utils import (
+    float_or_none,
+    urljoin,
+)
+
+
+def _repeat_count(s):
+    # Number of segments of an S element, r=-1 (repeat until the next S
+    # element or the end of the period) is taken as a single segment
+    return 1 + max(s.get('r', 0), 0)
+
+
+def count_template_fragments(fragment_template):
+    """Return the number of fragments described by a fragment_template"""
+    s_list = fragment_template.get('s')
+    if s_list is None:
+        return fragment_template['total_number']
+    return sum(_repeat_count(s) for s in s_list)
+
+
+def iter_template_fragments(fragment_template):
+    """Yield the fragments described by a fragment_template one at a time"""
+    media = fragment_template['media']
+    location_key = 'url' if re.match(r'^https?://', media) else 'path'
+    bandwidth = fragment_template.get('bandwidth')
+    segment_number = fragment_template.get('start_number', 1)
+
+    s_list = fragment_template.get('s')
+    if s_list is None:
+        duration = fragment_template.get('segment_duration')
+        for number in range(segment_number, segment_number + fragment_template['total_number']):
+            yield {
+                location_key: media % {
+                    'Number': number,
+                    'Bandwidth': bandwidth,
+                },
+                'duration': duration,
+            }
+        return
+
+    timescale = fragment_template.get('timescale') or 1
+    segment_time = 0
+    for s in s_list:
+        segment_time = s.get('t') or segment_time
+        duration = float_or_none(s['d'], timescale)
+        for r in range(_repeat_count(s)):
+            yield {
+                location_key: media % {
+                    'Time': segment_time,
+                    'Bandwidth': bandwidth,
+                    'Number': segment_number,
+                },
+                'duration': duration,
+            }
+            segment_number += 1
+            segment_time += s['d']
 
 
 class DashSegmentsFD(FragmentFD):
@@ -14,55 +71,47 @@ class DashSegmentsFD(FragmentFD):
 
     def real_download(self, filename, info_dict):
         fragment_base_url = info_dict.get('fragment_base_url')
-        fragments = info_dict['fragments'][:1] if self.params.get(
-            'test', False) else info_dict['fragments']
+        fragments = info_dict.get('fragments') or []
+        total_frags = len(fragments)
+        fragment_template = info_dict.get('fragment_template')
+        if fragment_template:
+            # Expand the template as the fragments are downloaded
+            total_frags += count_template_fragments(fragment_template)
+            fragments = itertools.chain(
+                fragments, iter_template_fragments(fragment_template))
+        if self.params.get('test', False):
+            fragments = itertools.islice(fragments, 1)
+            total_frags = min(total_frags, 1)
 
         ctx = {
             'filename': filename,
-            'total_frags': len(fragments),
+            'total_frags': total_frags,
         }
 
         self._prepare_and_start_frag_download(ctx)
 
-        fragment_retries = self.params.get('fragment_retries', 0)
-        skip_unavailable_fragments = self.params.get('skip_unavailable_fragments', True)
-
-        frag_index = 0
-        for i, fragment in enumerate(fragments):
-            frag_index += 1
-            if frag_index <= ctx['fragment_index']:
-                continue
-            # In DASH, the first segment contains necessary headers to
-            # generate a valid MP4 file, so always abort for the first segment
-            fatal = i == 0 or not skip_unavailable_fragments
-            count = 0
-            while count <= fragment_retries:
-                try:
-                    fragment_url = fragment.get('url')
-                    if not fragment_url:
-                        assert fragment_base_url
-                        fragment_url = urljoin(fragment_base_url, fragment['path'])
-                    success, frag_content = self._download_fragment(ctx, fragment_url, info_dict)
-                    if not success:
-                        return False
-                    self._append_fragment(ctx, frag_content)
-                    break
-                except compat_urllib_error.HTTPError as err:
-                    # YouTube may often return 404 HTTP error for a fragment causing the
-                    # whole download to fail. However if the same fragment is immediately
-                    # retried with the same request data this usually succeeds (1-2 attemps
-                    # is usually enough) thus allowing to download the whole file successfully.
-                    # To be future-proof we will retry all fragments that fail with any
-                    # HTTP error.
-                    count += 1
-                    if count <= fragment_retries:
-                        self.report_retry_fragment(err, frag_index, count, fragment_retries)
-            if count > fragment_retries:
-                if not fatal:
-                    self.report_skip_fragment(frag_index)
-                    continue
-                self.report_error('giving up after %s fragment retries' % fragment_retries)
-                return False
+        def fragments_to_download():
+            for i, fragment in enumerate(fragments):
+                fragment_url = fragment.get('url')
+                if not fragment_url:
+                    assert fragment_base_url
+                    fragment_url = urljoin(fragment_base_url, fragment['path'])
+                yield {
+                    'frag_index': i + 1,
+                    'url': fragment_url,
+                    # In DASH, the first segment contains necessary headers to
+                    # generate a valid MP4 file, so always abort for the first segment
+                    'fatal': i == 0,
+                }
+
+        # YouTube may often return 404 HTTP error for a fragment causing the
+        # whole download to fail. However if the same fragment is immediately
+        # retried with the same request data this usually succeeds (1-2 attemps
+        # is usually enough) thus allowing to download the whole file successfully.
+        # To be future-proof we will retry all fragments that fail with any
+        # HTTP error.
+        if not self.download_and_append_fragments(ctx, fragments_to_download(), info_dict):
+            return False
 
         self._finish_frag_download(ctx)
 
@@ -381,12 +381,7 @@ class F4mFD(FragmentFD):
 
         self._start_frag_download(ctx)
 
-        frag_index = 0
-        while fragments_list:
-            seg_i, frag_i = fragments_list.pop(0)
-            frag_index += 1
-            if frag_index <= ctx['fragment_index']:
-                continue
+        def fragment_url(seg_i, frag_i):
             name = 'Seg%d-Frag%d' % (seg_i, frag_i)
             query = []
             if base_url_parsed.query:
@@ -396,28 +391,48 @@ class F4mFD(FragmentFD):
             if info_dict.get('extra_param_to_segment_url'):
                 query.append(info_dict['extra_param_to_segment_url'])
             url_parsed = base_url_parsed._replace(path=base_url_parsed.path + name, query='&'.join(query))
+            return url_parsed.geturl()
+
+        def pack_fragment(down_data, fragment=None):
+            reader = FlvReader(down_data)
+            while True:
+                try:
+                    _, box_type, box_data = reader.read_box_info()
+                except DataTruncatedError:
+                    if test:
+                        # In tests, segments may be truncated, and thus
+                        # FlvReader may not be able to parse the whole
+                        # chunk. If so, write the segment as is
+                        # See https://github.com/rg3/youtube-dl/issues/9214
+                        return down_data
+                    raise
+                if box_type == b'mdat':
+                    return box_data
+
+        if not live:
+            fragments = [{
+                'frag_index': frag_index,
+                'url': fragment_url(seg_i, frag_i),
+            } for frag_index, (seg_i, frag_i) in enumerate(fragments_list, 1)]
+            if not self.download_and_append_fragments(
+                    ctx, fragments, info_dict, pack_func=pack_fragment):
+                return False
+            self._finish_frag_download(ctx)
+            return True
+
+        frag_index = 0
+        while fragments_list:
+            seg_i, frag_i = fragments_list.pop(0)
+            frag_index += 1
+            if frag_index <= ctx['fragment_index']:
+                continue
             try:
-                success, down_data = self._download_fragment(ctx, url_parsed.geturl(), info_dict)
+                success, down_data = self._download_fragment(ctx, fragment_url(seg_i, frag_i), info_dict)
                 if not success:
                     return False
-                reader = FlvReader(down_data)
-                while True:
-                    try:
-                        _, box_type, box_data = reader.read_box_info()
-                    except DataTruncatedError:
-                        if test:
-                            # In tests, segments may be truncated, and thus
-                            # FlvReader may not be able to parse the whole
-                            # chunk. If so, write the segment as is
-                            # See https://github.com/rg3/youtube-dl/issues/9214
-                            dest_stream.write(down_data)
-                            break
-                        raise
-                    if box_type == b'mdat':
-                        self._append_fragment(ctx, box_data)
-                        break
+                self._append_fragment(ctx, pack_fragment(down_data))
             except (compat_urllib_error.HTTPError, ) as err:
-                if live and (err.code == 404 or err.code == 410):
+                if err.code == 404 or err.code == 410:
                     # We didn't keep up with the live window. Continue
                     # with the next available fragment.
                     msg = 'Fragment %d unavailable' % frag_i
@@ -426,7 +441,7 @@ class F4mFD(FragmentFD):
                 else:
                     raise
 
-            if not fragments_list and not test and live and bootstrap_url:
+            if not fragments_list and not test and bootstrap_url:
                 fragments_list = self._update_live_fragments(bootstrap_url, frag_i)
                 total_frags += len(fragments_list)
                 if fragments_list and (fragments_list[0][1] > frag_i + 1):
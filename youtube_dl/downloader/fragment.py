@@ -1,11 +1,16 @@
 from __future__ import division, unicode_literals
 
+import collections
+import functools
+import io
 import os
+import threading
 import time
 import json
 
 from .common import FileDownloader
 from .http import HttpFD
+from ..compat import compat_urllib_error
 from ..utils import (
     error_to_compat_str,
     encodeFilename,
@@ -19,6 +24,51 @@ class HttpQuietDownloader(HttpFD):
         pass
 
 
+class DecryptingWriter(object):
+    """
+    Write-only stream that decrypts data with a block cipher before passing
+    it on to another stream
+
+    new_cipher is called for the cipher to use, which must have a decrypt()
+    method chaining successive calls on data made of whole blocks, as CBC
+    ciphers do. Data is decrypted as soon as whole blocks have arrived,
+    close() decrypts what remains. Seeking back to the start, when the
+    download is restarted, resets the cipher.
+    """
+
+    def __init__(self, stream, new_cipher, block_size=16):
+        self._stream = stream
+        self._new_cipher = new_cipher
+        self._block_size = block_size
+        self.reset()
+
+    def reset(self):
+        """Decrypt the next data as the start of the encrypted data"""
+        self._cipher = self._new_cipher()
+        self._pending = b''
+
+    def seek(self, offset):
+        # Only rewinding is supported
+        assert offset == 0
+        self.reset()
+        self._stream.seek(0)
+
+    def truncate(self):
+        self._stream.truncate()
+
+    def write(self, data):
+        data = self._pending + data
+        size = len(data) - len(data) % self._block_size
+        self._pending = data[size:]
+        if size:
+            self._stream.write(self._cipher.decrypt(data[:size]))
+
+    def close(self):
+        if self._pending:
+            self._stream.write(self._cipher.decrypt(self._pending))
+            self._pending = b''
+
+
 class FragmentFD(FileDownloader):
     """
     A base file downloader class for fragmented media (e.g. f4m/m3u8 manifests).
@@ -31,6 +81,9 @@ class FragmentFD(FileDownloader):
                         Skip unavailable fragments (DASH and hlsnative only)
     keep_fragments:     Keep downloaded fragments on disk after downloading is
                         finished
+    concurrent_fragment_downloads:
+                        Number of fragments to download concurrently (DASH,
+                        hlsnative, ISM and non-live HDS only, default is 1)
 
     For each incomplete fragment download youtube-dl keeps on disk a special
     bookkeeping file with download state and metadata (in future such files will
@@ -95,18 +148,40 @@ class FragmentFD(FileDownloader):
         frag_index_stream.write(json.dumps({'downloader': downloader}))
         frag_index_stream.close()
 
-    def _download_fragment(self, ctx, frag_url, info_dict, headers=None):
-        fragment_filename = '%s-Frag%d' % (ctx['tmpfilename'], ctx['fragment_index'])
-        success = ctx['dl'].download(fragment_filename, {
+    def _download_fragment(self, ctx, frag_url, info_dict, headers=None, new_cipher=None):
+        """
+        Download a fragment, return a (success, content) tuple
+
+        If new_cipher is given the content is decrypted with the ciphers it
+        returns, see DecryptingWriter.
+        """
+        fragment_info_dict = {
             'url': frag_url,
             'http_headers': headers or info_dict.get('http_headers'),
-        })
+        }
+        if not self.params.get('keep_fragments', False):
+            # Fragments that are not kept are downloaded straight into memory
+            # rather than written to a temporary file and read back, and
+            # decrypted while they are being downloaded
+            frag_stream = io.BytesIO()
+            writer = DecryptingWriter(frag_stream, new_cipher) if new_cipher else frag_stream
+            success = ctx['dl'].download(writer, fragment_info_dict)
+            if not success:
+                return False, None
+            if new_cipher:
+                writer.close()
+            return True, frag_stream.getvalue()
+        fragment_filename = '%s-Frag%d' % (ctx['tmpfilename'], ctx['fragment_index'])
+        success = ctx['dl'].download(fragment_filename, fragment_info_dict)
         if not success:
             return False, None
         down, frag_sanitized = sanitize_open(fragment_filename, 'rb')
         ctx['fragment_filename_sanitized'] = frag_sanitized
         frag_content = down.read()
         down.close()
+        if new_cipher:
+            # Kept fragments stay encrypted on disk
+            frag_content = new_cipher().decrypt(frag_content)
         return True, frag_content
 
     def _append_fragment(self, ctx, frag_content):
@@ -116,9 +191,7 @@ class FragmentFD(FileDownloader):
         finally:
             if self.__do_ytdl_file(ctx):
                 self._write_ytdl_file(ctx)
-            if not self.params.get('keep_fragments', False):
-                os.remove(encodeFilename(ctx['fragment_filename_sanitized']))
-            del ctx['fragment_filename_sanitized']
+            ctx.pop('fragment_filename_sanitized', None)
 
     def _prepare_frag_download(self, ctx):
         if 'live' not in ctx:
@@ -205,46 +278,173 @@ class FragmentFD(FileDownloader):
         start = time.time()
         ctx.update({
             'started': start,
-            # Amount of fragment's bytes downloaded by the time of the previous
-            # frag progress hook invocation
-            'prev_frag_downloaded_bytes': 0,
+            # Amount of bytes downloaded by the time of the previous frag
+            # progress hook invocation for each of the fragments being
+            # downloaded, keyed by fragment filename
+            'prev_frag_downloaded_bytes': {},
+            # Fragments may be downloaded by several threads at once
+            'progress_lock': threading.Lock(),
         })
 
         def frag_progress_hook(s):
             if s['status'] not in ('downloading', 'finished'):
                 return
 
-            time_now = time.time()
-            state['elapsed'] = time_now - start
-            frag_total_bytes = s.get('total_bytes') or 0
-            if not ctx['live']:
-                estimated_size = (
-                    (ctx['complete_frags_downloaded_bytes'] + frag_total_bytes) /
-                    (state['fragment_index'] + 1) * total_frags)
-                state['total_bytes_estimate'] = estimated_size
-
-            if s['status'] == 'finished':
-                state['fragment_index'] += 1
-                ctx['fragment_index'] = state['fragment_index']
-                state['downloaded_bytes'] += frag_total_bytes - ctx['prev_frag_downloaded_bytes']
-                ctx['complete_frags_downloaded_bytes'] = state['downloaded_bytes']
-                ctx['prev_frag_downloaded_bytes'] = 0
-            else:
-                frag_downloaded_bytes = s['downloaded_bytes']
-                state['downloaded_bytes'] += frag_downloaded_bytes - ctx['prev_frag_downloaded_bytes']
+            with ctx['progress_lock']:
+                time_now = time.time()
+                state['elapsed'] = time_now - start
+                frag_total_bytes = s.get('total_bytes') or 0
+                prev_frag_downloaded_bytes = ctx['prev_frag_downloaded_bytes'].get(s['filename'], 0)
                 if not ctx['live']:
-                    state['eta'] = self.calc_eta(
-                        start, time_now, estimated_size,
-                        state['downloaded_bytes'])
-                state['speed'] = s.get('speed') or ctx.get('speed')
-                ctx['speed'] = state['speed']
-                ctx['prev_frag_downloaded_bytes'] = frag_downloaded_bytes
-            self._hook_progress(state)
+                    estimated_size = (
+                        (ctx['complete_frags_downloaded_bytes'] + frag_total_bytes) /
+                        (state['fragment_index'] + 1) * total_frags)
+                    state['total_bytes_estimate'] = estimated_size
+
+                if s['status'] == 'finished':
+                    state['fragment_index'] += 1
+                    state['downloaded_bytes'] += frag_total_bytes - prev_frag_downloaded_bytes
+                    ctx['complete_frags_downloaded_bytes'] = state['downloaded_bytes']
+                    ctx['prev_frag_downloaded_bytes'].pop(s['filename'], None)
+                else:
+                    frag_downloaded_bytes = s['downloaded_bytes']
+                    state['downloaded_bytes'] += frag_downloaded_bytes - prev_frag_downloaded_bytes
+                    if not ctx['live']:
+                        state['eta'] = self.calc_eta(
+                            start, time_now, estimated_size,
+                            state['downloaded_bytes'])
+                    state['speed'] = s.get('speed') or ctx.get('speed')
+                    ctx['speed'] = state['speed']
+                    ctx['prev_frag_downloaded_bytes'][s['filename']] = frag_downloaded_bytes
+                self._hook_progress(state)
 
         ctx['dl'].add_progress_hook(frag_progress_hook)
 
         return start
 
+    def download_and_append_fragments(self, ctx, fragments, info_dict, pack_func=None, cipher_func=None):
+        """
+        Download fragments and append them to the destination stream in order.
+
+        fragments is an iterable of dicts with the following keys:
+        frag_index: 1-based index of the fragment, fragments with an index not
+                    greater than ctx['fragment_index'] are considered already
+                    downloaded and are skipped
+        url:        URL of the fragment
+        headers:    (optional) HTTP headers to use instead of the ones from
+                    info_dict
+        fatal:      (optional) abort the whole download if the fragment is
+                    still unavailable after all the retries even if
+                    skip_unavailable_fragments is set
+
+        pack_func, if given, is called as pack_func(frag_content, fragment) in
+        the order of fragments right before the fragment is appended and must
+        return the data to be written to the destination stream.
+
+        cipher_func, if given, is called as cipher_func(fragment) whenever a
+        fragment is downloaded from its start and may return a new cipher to
+        decrypt it with while it is downloaded (see DecryptingWriter), or
+        None. It is called from the downloading threads.
+
+        Up to concurrent_fragment_downloads fragments are downloaded at once,
+        fragments downloaded ahead are held until all the preceding ones are
+        appended. Returns True on success and False otherwise.
+        """
+        fragment_retries = self.params.get('fragment_retries', 0)
+        skip_unavailable_fragments = self.params.get('skip_unavailable_fragments', True)
+        max_workers = self.params.get('concurrent_fragment_downloads') or 1
+        if self.params.get('test', False):
+            max_workers = 1
+
+        def download_fragment(fragment, frag_ctx):
+            frag_index = fragment['frag_index']
+            # Keep fragment file naming of sequential download
+            frag_ctx['fragment_index'] = frag_index - 1
+            count = 0
+            while count <= fragment_retries:
+                try:
+                    new_cipher = None
+                    if cipher_func and cipher_func(fragment) is not None:
+                        new_cipher = functools.partial(cipher_func, fragment)
+                    return self._download_fragment(
+                        frag_ctx, fragment['url'], info_dict, fragment.get('headers'), new_cipher)
+                except compat_urllib_error.HTTPError as err:
+                    # Unavailable (possibly temporary) fragments may be served.
+                    # First we try to retry then either skip or abort.
+                    # See https://github.com/rg3/youtube-dl/issues/10165,
+                    # https://github.com/rg3/youtube-dl/issues/10448).
+                    count += 1
+                    if count <= fragment_retries:
+                        self.report_retry_fragment(err, frag_index, count, fragment_retries)
+            return True, None
+
+        def append_fragment(fragment, success, frag_content):
+            if not success:
+                return False
+            frag_index = fragment['frag_index']
+            if frag_content is None:
+                if fragment.get('fatal') or not skip_unavailable_fragments:
+                    self.report_error(
+                        'giving up after %s fragment retries' % fragment_retries)
+                    return False
+                self.report_skip_fragment(frag_index)
+                return True
+            if pack_func:
+                frag_content = pack_func(frag_content, fragment)
+            ctx['fragment_index'] = frag_index
+            self._append_fragment(ctx, frag_content)
+            return True
+
+        resume_index = ctx['fragment_index']
+        fragments = (f for f in fragments if f['frag_index'] > resume_index)
+
+        if max_workers <= 1:
+            for fragment in fragments:
+                if not append_fragment(fragment, *download_fragment(fragment, ctx)):
+                    return False
+            return True
+
+        pending = collections.deque()
+
+        def submit(fragment):
+            frag_ctx = ctx.copy()
+            result = {}
+
+            def run():
+                try:
+                    result['value'] = download_fragment(fragment, frag_ctx)
+                except Exception as e:
+                    result['error'] = e
+
+            thread = threading.Thread(target=run)
+            thread.daemon = True
+            thread.start()
+            pending.append((fragment, thread, result))
+
+        def collect():
+            fragment, thread, result = pending.popleft()
+            thread.join()
+            if 'error' in result:
+                raise result['error']
+            return append_fragment(fragment, *result['value'])
+
+        def discard_pending():
+            # Fragments downloaded ahead will never be appended
+            while pending:
+                pending.popleft()[1].join()
+
+        try:
+            for fragment in fragments:
+                if len(pending) >= max_workers and not collect():
+                    return False
+                submit(fragment)
+            while pending:
+                if not collect():
+                    return False
+        finally:
+            discard_pending()
+        return True
+
     def _finish_frag_download(self, ctx):
         ctx['dest_stream'].close()
         if self.__do_ytdl_file(ctx):
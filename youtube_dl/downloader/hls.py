@@ -1,7 +1,9 @@
 from __future__ import unicode_literals
 
-import re
-import binascii
+import codecs
+import itertools
+import threading
+import time
 try:
     from Crypto.Cipher import AES
     can_decrypt_frag = True
@@ -10,14 +12,23 @@ except ImportError:
 
 from .fragment import FragmentFD
 from .external import FFmpegFD
+from .remux import (
+    RemuxError,
+    TSRemuxer,
+)
 
 from ..compat import (
     compat_urllib_error,
     compat_urlparse,
     compat_struct_pack,
 )
+from ..m3u8 import (
+    M3U8Parser,
+    parse_m3u8,
+)
 from ..utils import (
-    parse_m3u8_attributes,
+    encodeFilename,
+    error_to_compat_str,
     update_url_query,
 )
 
@@ -27,43 +38,137 @@ class HlsFD(FragmentFD):
 
     FD_NAME = 'hlsnative'
 
+    _PLAYLIST_CHUNK_SIZE = 64 * 1024
+    # Used when a live playlist lacks EXT-X-TARGETDURATION
+    _LIVE_DEFAULT_TARGET_DURATION = 10
+    _LIVE_STALE_TARGET_DURATIONS = 3
+
+    @classmethod
+    def can_download(cls, manifest, info_dict):
+        return cls._can_download_playlist(parse_m3u8(manifest), info_dict)
+
     @staticmethod
-    def can_download(manifest, info_dict):
+    def _can_download_playlist(playlist, info_dict):
         UNSUPPORTED_FEATURES = (
-            r'#EXT-X-KEY:METHOD=(?!NONE|AES-128)',  # encrypted streams [1]
-            # r'#EXT-X-BYTERANGE',  # playlists composed of byte ranges of media files [2]
+            # encrypted streams [1]
+            lambda p: p.key_methods - set(['NONE', 'AES-128']),
+            # lambda p: '#EXT-X-BYTERANGE' in p.tags,  # playlists composed of byte ranges of media files [2]
 
             # Live streams heuristic does not always work (e.g. geo restricted to Germany
             # http://hls-geo.daserste.de/i/videoportal/Film/c_620000/622873/format,716451,716457,716450,716458,716459,.mp4.csmil/index_4_av.m3u8?null=0)
-            # r'#EXT-X-MEDIA-SEQUENCE:(?!0$)',  # live streams [3]
+            # lambda p: p.media_sequence != 0,  # live streams [3]
 
             # This heuristic also is not correct since segments may not be appended as well.
             # Twitch vods of finished streams have EXT-X-PLAYLIST-TYPE:EVENT despite
             # no segments will definitely be appended to the end of the playlist.
-            # r'#EXT-X-PLAYLIST-TYPE:EVENT',  # media segments may be appended to the end of
-            #                                 # event media playlists [4]
+            # lambda p: '#EXT-X-PLAYLIST-TYPE:EVENT' ...,  # media segments may be appended to the end of
+            #                                               # event media playlists [4]
 
             # 1. https://tools.ietf.org/html/draft-pantos-http-live-streaming-17#section-4.3.2.4
             # 2. https://tools.ietf.org/html/draft-pantos-http-live-streaming-17#section-4.3.2.2
             # 3. https://tools.ietf.org/html/draft-pantos-http-live-streaming-17#section-4.3.3.2
             # 4. https://tools.ietf.org/html/draft-pantos-http-live-streaming-17#section-4.3.3.5
         )
-        check_results = [not re.search(feature, manifest) for feature in UNSUPPORTED_FEATURES]
-        is_aes128_enc = '#EXT-X-KEY:METHOD=AES-128' in manifest
+        check_results = [not feature(playlist) for feature in UNSUPPORTED_FEATURES]
+        is_aes128_enc = 'AES-128' in playlist.key_methods
         check_results.append(can_decrypt_frag or not is_aes128_enc)
-        check_results.append(not (is_aes128_enc and r'#EXT-X-BYTERANGE' in manifest))
-        check_results.append(not info_dict.get('is_live'))
+        check_results.append(not (is_aes128_enc and '#EXT-X-BYTERANGE' in playlist.tags))
         return all(check_results)
 
+    def _download_playlist(self, info_dict, man_url):
+        urlh = self.ydl.urlopen(self._prepare_url(info_dict, man_url))
+        parser = M3U8Parser(urlh.geturl())
+        decoder = codecs.getincrementaldecoder('utf-8')('ignore')
+        while True:
+            chunk = urlh.read(self._PLAYLIST_CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.feed(decoder.decode(chunk))
+        parser.feed(decoder.decode(b'', True))
+        return parser.close()
+
+    def report_live_gap(self, count):
+        self.report_warning(
+            '%d fragment%s dropped out of the live playlist before %s could be downloaded'
+            % (count, '' if count == 1 else 's', 'it' if count == 1 else 'they'))
+
+    def _live_segments(self, playlist, info_dict, man_url):
+        """
+        Generate the media segments of a live playlist as they are added to it
+
+        The playlist is reloaded as advised in [1, 6.3.4]: a target duration
+        after the previous reload if that one had new segments, half of it
+        otherwise. Segments are told apart by their media sequence number.
+        The stream is considered over once the playlist has EXT-X-ENDLIST or
+        has not been updated for _LIVE_STALE_TARGET_DURATIONS target
+        durations.
+
+        1. https://tools.ietf.org/html/rfc8216
+        """
+        last_sequence = None
+        loaded = last_update = time.time()
+        while True:
+            new_segments = [
+                s for s in playlist.segments
+                if not s.is_ad and (last_sequence is None or s.media_sequence > last_sequence)]
+            if new_segments:
+                first_sequence = new_segments[0].media_sequence
+                if last_sequence is not None and first_sequence > last_sequence + 1:
+                    self.report_live_gap(first_sequence - last_sequence - 1)
+                last_sequence = new_segments[-1].media_sequence
+                last_update = loaded
+                for segment in new_segments:
+                    yield segment
+            if playlist.endlist:
+                return
+
+            target_duration = playlist.target_duration or self._LIVE_DEFAULT_TARGET_DURATION
+            if loaded - last_update > self._LIVE_STALE_TARGET_DURATIONS * target_duration:
+                self.to_screen(
+                    '[%s] Live playlist has not been updated for %d seconds, '
+                    'assuming the stream has ended' % (self.FD_NAME, loaded - last_update))
+                return
+            delay = target_duration if new_segments else target_duration / 2
+            wait = loaded + delay - time.time()
+            if wait > 0:
+                time.sleep(wait)
+
+            loaded = time.time()
+            try:
+                playlist = self._download_playlist(info_dict, man_url)
+            except compat_urllib_error.URLError as err:
+                # Keep the previous playlist, it has no new segments
+                self.report_warning(
+                    'Unable to reload live playlist: %s' % error_to_compat_str(err))
+
+    def _should_remux(self, info_dict):
+        # Same conditions as for the FFmpegFixupM3u8PP the remux replaces
+        return (
+            info_dict.get('ext') in ('mp4', 'm4a') and
+            not self.params.get('hls_use_mpegts', False) and
+            self.params.get('fixup') in (None, 'detect_or_warn'))
+
+    def _restart_remuxed_download(self, ctx):
+        """Restart a resumed download if it has been remuxed, since its remux cannot be resumed"""
+        if ctx['fragment_index'] == 0 or ctx['tmpfilename'] == '-':
+            return
+        with open(encodeFilename(ctx['tmpfilename']), 'rb') as f:
+            # Nothing is written before the MP4 header, the fragments
+            # downloaded so far were only held by the remuxer
+            if f.read(8)[4:] not in (b'', b'ftyp'):
+                return
+        self.report_warning('Unable to resume a remuxed download. Restarting from the beginning...')
+        ctx['dest_stream'].truncate(0)
+        ctx['fragment_index'] = 0
+        ctx['complete_frags_downloaded_bytes'] = 0
+
     def real_download(self, filename, info_dict):
         man_url = info_dict['url']
         self.to_screen('[%s] Downloading m3u8 manifest' % self.FD_NAME)
 
-        urlh = self.ydl.urlopen(self._prepare_url(info_dict, man_url))
-        man_url = urlh.geturl()
-        s = urlh.read().decode('utf-8', 'ignore')
+        playlist = self._download_playlist(info_dict, man_url)
 
-        if not self.can_download(s, info_dict):
+        if not self._can_download_playlist(playlist, info_dict):
             if info_dict.get('extra_param_to_segment_url'):
                 self.report_error('pycrypto not found. Please install it.')
                 return False
@@ -75,129 +180,126 @@ class HlsFD(FragmentFD):
                 fd.add_progress_hook(ph)
             return fd.real_download(filename, info_dict)
 
-        def is_ad_fragment(s):
-            return (s.startswith('#ANVATO-SEGMENT-INFO') and 'type=ad' in s or
-                    s.startswith('#UPLYNK-SEGMENT') and s.endswith(',ad'))
-
-        media_frags = 0
-        ad_frags = 0
-        ad_frag_next = False
-        for line in s.splitlines():
-            line = line.strip()
-            if not line:
-                continue
-            if line.startswith('#'):
-                if is_ad_fragment(line):
-                    ad_frags += 1
-                    ad_frag_next = True
-                continue
-            if ad_frag_next:
-                ad_frag_next = False
-                continue
-            media_frags += 1
+        test = self.params.get('test', False)
+
+        extra_query = None
+        extra_param_to_segment_url = info_dict.get('extra_param_to_segment_url')
+        if extra_param_to_segment_url:
+            extra_query = compat_urlparse.parse_qs(extra_param_to_segment_url)
+        http_headers = info_dict.get('http_headers') or {}
 
+        is_live = info_dict.get('is_live')
         ctx = {
             'filename': filename,
-            'total_frags': media_frags,
-            'ad_frags': ad_frags,
+            'live': bool(is_live),
+            'total_frags': len(playlist.segments) - playlist.ad_segments,
+            'ad_frags': playlist.ad_segments,
         }
 
-        self._prepare_and_start_frag_download(ctx)
+        self._prepare_frag_download(ctx)
+        # The MPEG-TS fragments are remuxed into an MP4 file as they are
+        # appended, unless the download is resumed without remuxing
+        remux = {'remuxer': None}
+        if self._should_remux(info_dict):
+            self._restart_remuxed_download(ctx)
+            if ctx['fragment_index'] == 0:
+                remux['remuxer'] = TSRemuxer()
+        self._start_frag_download(ctx)
 
-        fragment_retries = self.params.get('fragment_retries', 0)
-        skip_unavailable_fragments = self.params.get('skip_unavailable_fragments', True)
-        test = self.params.get('test', False)
+        def make_fragment(segment, frag_index):
+            frag_url = segment.url
+            if extra_query:
+                frag_url = update_url_query(frag_url, extra_query)
+            headers = dict(http_headers)
+            if segment.byte_range:
+                headers['Range'] = 'bytes=%d-%d' % (segment.byte_range['start'], segment.byte_range['end'])
+            return {
+                'frag_index': frag_index,
+                'url': frag_url,
+                'headers': headers,
+                'decrypt_info': segment.key,
+                'media_sequence': segment.media_sequence,
+            }
 
-        extra_query = None
-        extra_param_to_segment_url = info_dict.get('extra_param_to_segment_url')
-        if extra_param_to_segment_url:
-            extra_query = compat_urlparse.parse_qs(extra_param_to_segment_url)
-        i = 0
-        media_sequence = 0
-        decrypt_info = {'METHOD': 'NONE'}
-        byte_range = {}
-        frag_index = 0
-        ad_frag_next = False
-        for line in s.splitlines():
-            line = line.strip()
-            if line:
-                if not line.startswith('#'):
-                    if ad_frag_next:
-                        ad_frag_next = False
-                        continue
-                    frag_index += 1
-                    if frag_index <= ctx['fragment_index']:
-                        continue
-                    frag_url = (
-                        line
-                        if re.match(r'^https?://', line)
-                        else compat_urlparse.urljoin(man_url, line))
+        segments = (
+            self._live_segments(playlist, info_dict, man_url) if is_live
+            else (s for s in playlist.segments if not s.is_ad))
+        fragments_to_download = (
+            make_fragment(segment, frag_index)
+            for frag_index, segment in enumerate(segments, 1))
+        # We only download the first fragment during the test
+        if test:
+            fragments_to_download = itertools.islice((
+                f for f in fragments_to_download
+                if f['frag_index'] > ctx['fragment_index']), 1)
+
+        # Keys by URI, shared by all the EXT-X-KEY tags (and playlist reloads)
+        # pointing to the same key
+        keys = {}
+        keys_lock = threading.Lock()
+
+        def get_key(key_url):
+            with keys_lock:
+                if key_url not in keys:
                     if extra_query:
-                        frag_url = update_url_query(frag_url, extra_query)
-                    count = 0
-                    headers = info_dict.get('http_headers', {})
-                    if byte_range:
-                        headers['Range'] = 'bytes=%d-%d' % (byte_range['start'], byte_range['end'])
-                    while count <= fragment_retries:
-                        try:
-                            success, frag_content = self._download_fragment(
-                                ctx, frag_url, info_dict, headers)
-                            if not success:
-                                return False
-                            break
-                        except compat_urllib_error.HTTPError as err:
-                            # Unavailable (possibly temporary) fragments may be served.
-                            # First we try to retry then either skip or abort.
-                            # See https://github.com/rg3/youtube-dl/issues/10165,
-                            # https://github.com/rg3/youtube-dl/issues/10448).
-                            count += 1
-                            if count <= fragment_retries:
-                                self.report_retry_fragment(err, frag_index, count, fragment_retries)
-                    if count > fragment_retries:
-                        if skip_unavailable_fragments:
-                            i += 1
-                            media_sequence += 1
-                            self.report_skip_fragment(frag_index)
-                            continue
-                        self.report_error(
-                            'giving up after %s fragment retries' % fragment_retries)
-                        return False
-                    if decrypt_info['METHOD'] == 'AES-128':
-                        iv = decrypt_info.get('IV') or compat_struct_pack('>8xq', media_sequence)
-                        decrypt_info['KEY'] = decrypt_info.get('KEY') or self.ydl.urlopen(
-                            self._prepare_url(info_dict, decrypt_info['URI'])).read()
-                        frag_content = AES.new(
-                            decrypt_info['KEY'], AES.MODE_CBC, iv).decrypt(frag_content)
-                    self._append_fragment(ctx, frag_content)
-                    # We only download the first fragment during the test
-                    if test:
-                        break
-                    i += 1
-                    media_sequence += 1
-                elif line.startswith('#EXT-X-KEY'):
-                    decrypt_url = decrypt_info.get('URI')
-                    decrypt_info = parse_m3u8_attributes(line[11:])
-                    if decrypt_info['METHOD'] == 'AES-128':
-                        if 'IV' in decrypt_info:
-                            decrypt_info['IV'] = binascii.unhexlify(decrypt_info['IV'][2:].zfill(32))
-                        if not re.match(r'^https?://', decrypt_info['URI']):
-                            decrypt_info['URI'] = compat_urlparse.urljoin(
-                                man_url, decrypt_info['URI'])
-                        if extra_query:
-                            decrypt_info['URI'] = update_url_query(decrypt_info['URI'], extra_query)
-                        if decrypt_url != decrypt_info['URI']:
-                            decrypt_info['KEY'] = None
-                elif line.startswith('#EXT-X-MEDIA-SEQUENCE'):
-                    media_sequence = int(line[22:])
-                elif line.startswith('#EXT-X-BYTERANGE'):
-                    splitted_byte_range = line[17:].split('@')
-                    sub_range_start = int(splitted_byte_range[1]) if len(splitted_byte_range) == 2 else byte_range['end']
-                    byte_range = {
-                        'start': sub_range_start,
-                        'end': sub_range_start + int(splitted_byte_range[0]),
-                    }
-                elif is_ad_fragment(line):
-                    ad_frag_next = True
+                        url = update_url_query(key_url, extra_query)
+                    else:
+                        url = key_url
+                    keys[key_url] = self.ydl.urlopen(
+                        self._prepare_url(info_dict, url)).read()
+                return keys[key_url]
+
+        def fragment_cipher(fragment):
+            decrypt_info = fragment['decrypt_info']
+            if not decrypt_info or decrypt_info['METHOD'] != 'AES-128':
+                return None
+            iv = decrypt_info.get('IV') or compat_struct_pack('>8xq', fragment['media_sequence'])
+            return AES.new(get_key(decrypt_info['URI']), AES.MODE_CBC, iv)
+
+        def stop_remuxing(err):
+            # The MPEG-TS stream is written as is if no MP4 data has been
+            # written yet, there's no way back otherwise
+            data = remux['remuxer'].unremuxed_data()
+            if data is None:
+                raise err
+            if self.params.get('verbose', False):
+                self.to_screen('[debug] Not remuxing to MP4: %s' % error_to_compat_str(err))
+            remux['remuxer'] = None
+            return data
+
+        def remux_fragment(frag_content, fragment):
+            remuxer = remux['remuxer']
+            if remuxer is None:
+                return frag_content
+            try:
+                return remuxer.feed(frag_content)
+            except RemuxError as err:
+                return stop_remuxing(err)
+
+        try:
+            if not self.download_and_append_fragments(
+                    ctx, fragments_to_download, info_dict,
+                    pack_func=remux_fragment, cipher_func=fragment_cipher):
+                return False
+        except KeyboardInterrupt:
+            if not is_live:
+                raise
+            # Stopping the recording of a live stream is not an error
+            self.to_screen('[%s] Interrupted by user' % self.FD_NAME)
+        except RemuxError as err:
+            self.report_error('unable to remux to MP4: %s' % error_to_compat_str(err))
+            return False
+
+        if remux['remuxer'] is not None:
+            try:
+                ctx['dest_stream'].write(remux['remuxer'].close())
+                info_dict['__remuxed'] = True
+            except RemuxError as err:
+                try:
+                    ctx['dest_stream'].write(stop_remuxing(err))
+                except RemuxError as err:
+                    self.report_error('unable to remux to MP4: %s' % error_to_compat_str(err))
+                    return False
 
         self._finish_frag_download(ctx)
 
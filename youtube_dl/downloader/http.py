@@ -1,14 +1,18 @@
 from __future__ import unicode_literals
 
 import errno
+import io
+import json
 import os
 import socket
+import threading
 import time
 import random
 import re
 
 from .common import FileDownloader
 from ..compat import (
+    compat_http_client,
     compat_str,
     compat_urllib_error,
 )
@@ -25,6 +29,20 @@ from ..utils import (
 
 
 class HttpFD(FileDownloader):
+    """
+    With the http_connections option, files of known size are split into
+    byte ranges that are downloaded over several connections at the same
+    time. The state of such a download is kept in the .ytdl file:
+
+    downloader:
+        http_segments:
+            total:      Size of the file in bytes
+            segments:   List of {start, end, downloaded} dictionaries
+    """
+
+    # Files are not split into segments smaller than this
+    _MIN_SEGMENT_SIZE = 1024 * 1024
+
     def real_download(self, filename, info_dict):
         url = info_dict['url']
 
@@ -37,6 +55,8 @@ class HttpFD(FileDownloader):
         ctx.filename = filename
         ctx.tmpfilename = self.temp_name(filename)
         ctx.stream = None
+        # Data may be downloaded into a file-like object instead of a file
+        ctx.to_stream = hasattr(filename, 'write')
 
         # Do not include the Accept-Encoding header
         headers = {'Youtubedl-no-compression': 'True'}
@@ -56,7 +76,25 @@ class HttpFD(FileDownloader):
         ctx.start_time = time.time()
         ctx.chunk_size = None
 
-        if self.params.get('continuedl', True):
+        if ((self.params.get('http_connections') or 1) > 1 and not is_test
+                and not ctx.to_stream and ctx.tmpfilename != '-'):
+            success = self._download_segmented(ctx, url, headers, info_dict, chunk_size)
+            if success is not None:
+                return success
+
+        if (not ctx.to_stream and ctx.tmpfilename != '-'
+                and self._has_segments_state(ctx.filename)):
+            # Segmented downloads leave holes in the temporary file, it can't
+            # be resumed from its end
+            if self.params.get('continuedl', True) and os.path.isfile(encodeFilename(ctx.tmpfilename)):
+                self.report_unable_to_resume()
+            for fn in (ctx.tmpfilename, self.ytdl_filename(ctx.filename)):
+                try:
+                    os.remove(encodeFilename(fn))
+                except (OSError, IOError):
+                    pass
+
+        if self.params.get('continuedl', True) and not ctx.to_stream:
             # Establish possible resume length
             if os.path.isfile(encodeFilename(ctx.tmpfilename)):
                 ctx.resume_len = os.path.getsize(
@@ -217,7 +255,7 @@ class HttpFD(FileDownloader):
             before = start  # start measuring
 
             def retry(e):
-                to_stdout = ctx.tmpfilename == '-'
+                to_stdout = ctx.tmpfilename == '-' or ctx.to_stream
                 if not to_stdout:
                     ctx.stream.close()
                 ctx.stream = None
@@ -244,7 +282,15 @@ class HttpFD(FileDownloader):
                     break
 
                 # Open destination file just in time
-                if ctx.stream is None:
+                if ctx.stream is None and ctx.to_stream:
+                    if ctx.open_mode == 'wb' and ctx.stream_opened:
+                        # Restarted from the first byte, drop what an
+                        # earlier attempt has written
+                        ctx.tmpfilename.seek(0)
+                        ctx.tmpfilename.truncate()
+                    ctx.stream = ctx.tmpfilename
+                    ctx.stream_opened = True
+                elif ctx.stream is None:
                     try:
                         ctx.stream, ctx.tmpfilename = sanitize_open(
                             ctx.tmpfilename, ctx.open_mode)
@@ -311,7 +357,7 @@ class HttpFD(FileDownloader):
                 self.to_stderr('\n')
                 self.report_error('Did not get any data blocks')
                 return False
-            if ctx.tmpfilename != '-':
+            if ctx.tmpfilename != '-' and not ctx.to_stream:
                 ctx.stream.close()
 
             if data_len is not None and byte_counter != data_len:
@@ -323,7 +369,7 @@ class HttpFD(FileDownloader):
             self.try_rename(ctx.tmpfilename, ctx.filename)
 
             # Update file modification time
-            if self.params.get('updatetime', True):
+            if self.params.get('updatetime', True) and not ctx.to_stream:
                 info_dict['filetime'] = self.try_utime(ctx.filename, ctx.data.info().get('last-modified', None))
 
             self._hook_progress({
@@ -352,3 +398,263 @@ class HttpFD(FileDownloader):
 
         self.report_error('giving up after %s retries' % retries)
         return False
+
+    def _read_segments_state(self, filename):
+        try:
+            with io.open(encodeFilename(self.ytdl_filename(filename)), 'r', encoding='utf-8') as f:
+                state = json.loads(f.read())['downloader']['http_segments']
+            assert all(
+                seg['start'] + seg['downloaded'] <= seg['end'] + 1
+                for seg in state['segments'])
+            return state
+        except Exception:
+            return None
+
+    def _has_segments_state(self, filename):
+        try:
+            with io.open(encodeFilename(self.ytdl_filename(filename)), 'r', encoding='utf-8') as f:
+                return 'http_segments' in json.loads(f.read())['downloader']
+        except Exception:
+            return False
+
+    def _write_segments_state(self, filename, state):
+        stream, _ = sanitize_open(self.ytdl_filename(filename), 'w')
+        try:
+            stream.write(json.dumps({'downloader': {'http_segments': state}}))
+        finally:
+            stream.close()
+
+    def _download_segmented(self, ctx, url, headers, info_dict, chunk_size):
+        """Download url over several connections, each one fetching its own
+        byte range into the preallocated temporary file.
+
+        Returns None if the download can't be segmented, e.g. because the
+        server does not support range requests.
+        """
+        state = None
+        if os.path.isfile(encodeFilename(ctx.tmpfilename)):
+            if not self.params.get('continuedl', True):
+                return None
+            # Only downloads started in segmented mode are resumed in it
+            state = self._read_segments_state(ctx.filename)
+            if state is None:
+                return None
+
+        request = sanitized_Request(url, None, headers)
+        request.add_header('Range', 'bytes=0-0')
+        try:
+            probe = self.ydl.urlopen(request)
+            try:
+                content_range = probe.headers.get('Content-Range') or ''
+                last_modified = probe.headers.get('Last-Modified')
+                if probe.getcode() != 206:
+                    # The whole file is served, it is not read for nothing
+                    content_range = ''
+                elif content_range.startswith('bytes 0-0/'):
+                    probe.read(1)
+            finally:
+                probe.close()
+        except (compat_urllib_error.URLError, compat_http_client.HTTPException, socket.error):
+            # Leave error handling and retries to the regular download
+            return None
+        mobj = re.search(r'^bytes 0-0/(\d+)', content_range)
+        if not mobj:
+            return None
+        total = int(mobj.group(1))
+
+        min_data_len = self.params.get('min_filesize')
+        max_data_len = self.params.get('max_filesize')
+        if min_data_len is not None and total < min_data_len:
+            self.to_screen('\r[download] File is smaller than min-filesize (%s bytes < %s bytes). Aborting.' % (total, min_data_len))
+            return False
+        if max_data_len is not None and total > max_data_len:
+            self.to_screen('\r[download] File is larger than max-filesize (%s bytes > %s bytes). Aborting.' % (total, max_data_len))
+            return False
+
+        if state is not None and state['total'] != total:
+            self.report_unable_to_resume()
+            state = None
+
+        tmpfilename = ctx.tmpfilename
+        if state is None:
+            count = min(self.params['http_connections'], total // self._MIN_SEGMENT_SIZE)
+            if count < 2:
+                return None
+            segment_size = -(-total // count)
+            state = {
+                'total': total,
+                'segments': [{
+                    'start': start,
+                    'end': min(start + segment_size, total) - 1,
+                    'downloaded': 0,
+                } for start in range(0, total, segment_size)],
+            }
+            try:
+                stream, tmpfilename = sanitize_open(tmpfilename, 'wb')
+                try:
+                    filename = self.undo_temp_name(tmpfilename)
+                    # Written first so that a preallocated file is never
+                    # mistaken for a sequential download
+                    self._write_segments_state(filename, state)
+                    stream.truncate(total)
+                finally:
+                    stream.close()
+            except (OSError, IOError) as err:
+                self.report_error('unable to open for writing: %s' % str(err))
+                return False
+        else:
+            filename = ctx.filename
+            self.report_resuming_byte(
+                sum(seg['downloaded'] for seg in state['segments']))
+        self.report_destination(filename)
+
+        if self.params.get('xattr_set_filesize', False):
+            try:
+                write_xattr(tmpfilename, 'user.ytdl.filesize', str(total).encode('utf-8'))
+            except (XAttrUnavailableError, XAttrMetadataError) as err:
+                self.report_error('unable to set filesize xattr: %s' % str(err))
+
+        segments = state['segments']
+        retries = self.params.get('retries', 0)
+        lock = threading.Lock()
+        start = time.time()
+        resumed = sum(seg['downloaded'] for seg in segments)
+        progress = {
+            'downloaded': resumed,
+            'state_written': start,
+            'error': None,
+            'gave_up': False,
+        }
+
+        def report_progress(segment, byte_count):
+            with lock:
+                segment['downloaded'] += byte_count
+                progress['downloaded'] += byte_count
+                now = time.time()
+                self._hook_progress({
+                    'status': 'downloading',
+                    'downloaded_bytes': progress['downloaded'],
+                    'total_bytes': total,
+                    'tmpfilename': tmpfilename,
+                    'filename': filename,
+                    'eta': self.calc_eta(start, now, total - resumed, progress['downloaded'] - resumed),
+                    'speed': self.calc_speed(start, now, progress['downloaded'] - resumed),
+                    'elapsed': now - ctx.start_time,
+                })
+                if now - progress['state_written'] >= 1:
+                    self._write_segments_state(filename, state)
+                    progress['state_written'] = now
+
+        def download_range(stream, segment):
+            pos = segment['start'] + segment['downloaded']
+            end = segment['end']
+            if chunk_size:
+                end = min(end, pos + chunk_size - 1)
+            request = sanitized_Request(url, None, headers)
+            request.add_header('Range', 'bytes=%d-%d' % (pos, end))
+            data = self.ydl.urlopen(request)
+            try:
+                content_range = data.headers.get('Content-Range') or ''
+                if not content_range.startswith('bytes %d-' % pos):
+                    raise compat_urllib_error.URLError(
+                        'server does not support range requests')
+                stream.seek(pos)
+                block_size = self.params.get('buffersize', 1024)
+                before = time.time()
+                while pos <= end and progress['error'] is None:
+                    data_block = data.read(min(block_size, end - pos + 1))
+                    if not data_block:
+                        raise ContentTooShortError(
+                            pos - segment['start'], end - segment['start'] + 1)
+                    stream.write(data_block)
+                    pos += len(data_block)
+                    report_progress(segment, len(data_block))
+                    self.slow_down(start, None, progress['downloaded'] - resumed)
+                    after = time.time()
+                    if not self.params.get('noresizebuffer', False):
+                        block_size = self.best_block_size(after - before, len(data_block))
+                    before = after
+            finally:
+                data.close()
+
+        def is_retriable(err):
+            if isinstance(err, compat_urllib_error.HTTPError):
+                return 500 <= err.code < 600
+            if isinstance(err, (socket.timeout, ContentTooShortError, compat_http_client.IncompleteRead)):
+                return True
+            return (
+                isinstance(err, socket.error)
+                and not isinstance(err, compat_urllib_error.URLError)
+                and err.errno in (errno.ECONNRESET, errno.ETIMEDOUT))
+
+        def download_segment(segment):
+            count = 0
+            stream = None
+            try:
+                stream = io.open(encodeFilename(tmpfilename), 'r+b', buffering=0)
+                while (progress['error'] is None
+                        and segment['start'] + segment['downloaded'] <= segment['end']):
+                    try:
+                        download_range(stream, segment)
+                    except (compat_urllib_error.HTTPError, socket.error,
+                            ContentTooShortError, compat_http_client.IncompleteRead) as err:
+                        if not is_retriable(err):
+                            raise
+                        count += 1
+                        if count > retries:
+                            progress['gave_up'] = True
+                            raise
+                        self.report_retry(err, count, retries)
+            except BaseException as err:
+                with lock:
+                    if progress['error'] is None:
+                        progress['error'] = err
+            finally:
+                if stream is not None:
+                    stream.close()
+
+        threads = []
+        try:
+            for segment in segments:
+                if segment['start'] + segment['downloaded'] > segment['end']:
+                    continue
+                thread = threading.Thread(target=download_segment, args=(segment,))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+        except BaseException as err:
+            with lock:
+                if progress['error'] is None:
+                    progress['error'] = err
+            for thread in threads:
+                thread.join()
+            raise
+        finally:
+            with lock:
+                self._write_segments_state(filename, state)
+
+        if progress['gave_up']:
+            self.report_error('giving up after %s retries' % retries)
+            return False
+        if progress['error'] is not None:
+            raise progress['error']
+
+        try:
+            os.remove(encodeFilename(self.ytdl_filename(filename)))
+        except (OSError, IOError):
+            pass
+        self.try_rename(tmpfilename, filename)
+
+        if self.params.get('updatetime', True):
+            info_dict['filetime'] = self.try_utime(filename, last_modified)
+
+        self._hook_progress({
+            'downloaded_bytes': total,
+            'total_bytes': total,
+            'filename': filename,
+            'status': 'finished',
+            'elapsed': time.time() - ctx.start_time,
+        })
+        return True
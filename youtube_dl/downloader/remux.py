@@ -0,0 +1,679 @@
+from __future__ import division, unicode_literals
+
+import re
+import time
+
+from .ism import (
+    box,
+    full_box,
+    s16,
+    s1616,
+    s32,
+    s88,
+    u8,
+    u16,
+    u1616,
+    u32,
+    u64,
+    unity_matrix,
+    SELF_CONTAINED,
+    TRACK_ENABLED,
+    TRACK_IN_MOVIE,
+    TRACK_IN_PREVIEW,
+)
+
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+
+# MPEG-TS stream types
+STREAM_TYPE_AAC = 0x0f
+STREAM_TYPE_H264 = 0x1b
+# Audio and video stream types that cannot be remuxed, other streams (ID3
+# timed metadata, private data) are dropped
+UNSUPPORTED_STREAM_TYPES = (
+    0x01, 0x02,  # MPEG-1/2 video
+    0x03, 0x04,  # MPEG-1/2 audio
+    0x10,  # MPEG-4 part 2 video
+    0x11,  # AAC in LATM
+    0x24,  # HEVC
+    0x81, 0x87,  # AC-3, E-AC-3
+)
+
+PES_TIMESCALE = 90000
+# PTS and DTS are 33-bit
+PES_TIMESTAMP_WRAP = 1 << 33
+
+ADTS_SAMPLING_RATES = (
+    96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000,
+    11025, 8000, 7350)
+AAC_FRAME_SAMPLES = 1024
+
+# H.264 NAL unit types
+NAL_IDR = 5
+NAL_SPS = 7
+NAL_PPS = 8
+# Access unit delimiters, parameter sets (moved to avcC) and filler data
+# are not part of the samples
+NAL_DROPPED = (9, NAL_SPS, NAL_PPS, 12)
+
+SAMPLE_FLAGS_SYNC = 0x02000000
+SAMPLE_FLAGS_NON_SYNC = 0x01010000
+
+# Maximum decoding time step in seconds, larger or negative ones are
+# treated as timestamp discontinuities
+MAX_TIMESTAMP_STEP = 10
+# Duration in seconds after which tracks still without samples are dropped
+MAX_TRACK_START_DELAY = 10
+
+
+class RemuxError(Exception):
+    pass
+
+
+class _BitReader(object):
+    def __init__(self, data):
+        self._data = bytearray(data)
+        self._pos = 0
+
+    def read_bits(self, count):
+        value = 0
+        for _ in range(count):
+            byte = self._data[self._pos >> 3] if self._pos >> 3 < len(self._data) else 0
+            value = (value << 1) | ((byte >> (7 - (self._pos & 7))) & 1)
+            self._pos += 1
+        return value
+
+    def read_ue(self):
+        zeros = 0
+        while not self.read_bits(1):
+            zeros += 1
+            if zeros > 31:
+                raise RemuxError('Invalid Exp-Golomb code')
+        return (1 << zeros) - 1 + self.read_bits(zeros)
+
+    def read_se(self):
+        value = self.read_ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+
+def parse_h264_sps(sps):
+    """Return the (width, height) of the pictures of an H.264 SPS NAL unit"""
+    reader = _BitReader(re.sub(b'\x00\x00\x03', b'\x00\x00', sps[1:]))
+    profile_idc = reader.read_bits(8)
+    reader.read_bits(16)  # constraint flags, level
+    reader.read_ue()  # seq_parameter_set_id
+    chroma_format_idc = 1
+    if profile_idc in (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135):
+        chroma_format_idc = reader.read_ue()
+        if chroma_format_idc == 3:
+            reader.read_bits(1)  # separate_colour_plane_flag
+        reader.read_ue()  # bit_depth_luma_minus8
+        reader.read_ue()  # bit_depth_chroma_minus8
+        reader.read_bits(1)  # qpprime_y_zero_transform_bypass_flag
+        if reader.read_bits(1):  # seq_scaling_matrix_present_flag
+            for i in range(8 if chroma_format_idc != 3 else 12):
+                if reader.read_bits(1):
+                    last_scale = next_scale = 8
+                    for _ in range(16 if i < 6 else 64):
+                        if next_scale:
+                            next_scale = (last_scale + reader.read_se()) % 256
+                        last_scale = next_scale or last_scale
+    reader.read_ue()  # log2_max_frame_num_minus4
+    pic_order_cnt_type = reader.read_ue()
+    if pic_order_cnt_type == 0:
+        reader.read_ue()  # log2_max_pic_order_cnt_lsb_minus4
+    elif pic_order_cnt_type == 1:
+        reader.read_bits(1)  # delta_pic_order_always_zero_flag
+        reader.read_se()  # offset_for_non_ref_pic
+        reader.read_se()  # offset_for_top_to_bottom_field
+        for _ in range(reader.read_ue()):
+            reader.read_se()  # offset_for_ref_frame
+    reader.read_ue()  # max_num_ref_frames
+    reader.read_bits(1)  # gaps_in_frame_num_value_allowed_flag
+    width = (reader.read_ue() + 1) * 16
+    height_in_map_units = reader.read_ue() + 1
+    frame_mbs_only_flag = reader.read_bits(1)
+    height = height_in_map_units * 16 * (2 - frame_mbs_only_flag)
+    if not frame_mbs_only_flag:
+        reader.read_bits(1)  # mb_adaptive_frame_field_flag
+    reader.read_bits(1)  # direct_8x8_inference_flag
+    if reader.read_bits(1):  # frame_cropping_flag
+        crop_left, crop_right, crop_top, crop_bottom = [reader.read_ue() for _ in range(4)]
+        if chroma_format_idc == 0:
+            crop_unit_x, crop_unit_y = 1, 1
+        else:
+            crop_unit_x = 1 if chroma_format_idc == 3 else 2
+            crop_unit_y = 2 if chroma_format_idc == 1 else 1
+        crop_unit_y *= 2 - frame_mbs_only_flag
+        width -= (crop_left + crop_right) * crop_unit_x
+        height -= (crop_top + crop_bottom) * crop_unit_y
+    return width, height
+
+
+def split_nal_units(data):
+    """Split an H.264 Annex B byte stream into NAL units"""
+    return [
+        nal.rstrip(b'\x00') for nal in re.split(b'\x00\x00\x01', data)
+        if nal.strip(b'\x00')]
+
+
+class _Track(object):
+    def __init__(self, track_id, kind):
+        self.track_id = track_id
+        self.kind = kind
+        self.timescale = PES_TIMESCALE
+        # Codec configuration, None until known
+        self.config = None
+        # Sample data, (duration, size, flags, composition offset) and
+        # decoding time of the first one, waiting to be written
+        self.data = []
+        self.samples = []
+        self.decode_time = None
+        # Decoding time of the next sample, None until the start of the
+        # presentation is known
+        self.next_decode_time = None
+        # PES timestamp of the first sample
+        self.first_timestamp = None
+        # Last video sample, held back until its duration is known from
+        # the next one
+        self.held = None
+        self.last_timestamp = None
+        self.last_duration = None
+        self.timestamp_offset = 0
+        # Incomplete PES packet
+        self.pes = []
+        # Incomplete ADTS frame (audio only)
+        self.pending_audio = b''
+        # Timestamp of the first audio frame of the current run of
+        # contiguous frames and their count
+        self.run_start = None
+        self.run_frames = 0
+
+
+class TSRemuxer(object):
+    """
+    Streaming remuxer of an MPEG-TS stream of H.264 video and AAC audio into
+    a fragmented MP4 file
+
+    The stream is fed in chunks of any size with feed(), which returns the
+    MP4 data that is ready: the header once the codecs are known, then a
+    movie fragment with the complete samples of each chunk. close() returns
+    the last fragment. RemuxError is raised if the stream is not an MPEG-TS
+    stream, has unsupported audio or video streams or no samples. Until the
+    header is returned, the data fed is kept and unremuxed_data() returns
+    it, so that the stream can still be written as is.
+    """
+
+    def __init__(self):
+        # Data fed before the header is written
+        self._input = []
+        self._pending = b''
+        self._pmt_pid = None
+        # Tracks by PID, None until the PMT has been read
+        self._tracks = None
+        self._header_written = False
+        self._sequence_number = 0
+
+    def feed(self, data):
+        if self._input is not None:
+            self._input.append(data)
+        data = self._pending + data
+        if self._tracks is None and data and bytearray(data[:1])[0] != TS_SYNC_BYTE:
+            raise RemuxError('not an MPEG-TS stream')
+        end = len(data) - len(data) % TS_PACKET_SIZE
+        self._pending = data[end:]
+        for pos in range(0, end, TS_PACKET_SIZE):
+            self._parse_packet(data[pos:pos + TS_PACKET_SIZE])
+        if self._tracks is None and end:
+            raise RemuxError('no program found in the MPEG-TS stream')
+        return self._flush()
+
+    def unremuxed_data(self):
+        """Return the data fed so far, None once MP4 data has been returned"""
+        return b''.join(self._input) if self._input is not None else None
+
+    def close(self):
+        if self._tracks is None:
+            raise RemuxError('no program found in the MPEG-TS stream')
+        for track in self._tracks.values():
+            self._end_pes(track)
+            if track.held is not None:
+                self._add_sample(track, *track.held, duration=track.last_duration or 3000)
+                track.held = None
+        return self._flush(final=True)
+
+    def _parse_packet(self, packet):
+        header = bytearray(packet[:4])
+        if header[0] != TS_SYNC_BYTE:
+            # Lost synchronization, drop the packet
+            return
+        payload_unit_start = header[1] & 0x40
+        pid = ((header[1] & 0x1f) << 8) | header[2]
+        adaptation_field_control = (header[3] >> 4) & 3
+        start = 4
+        if adaptation_field_control & 2:
+            start += 1 + bytearray(packet[4:5])[0]
+        if not adaptation_field_control & 1 or start >= TS_PACKET_SIZE:
+            return
+        payload = packet[start:]
+
+        if self._tracks is not None:
+            track = self._tracks.get(pid)
+            if track is not None:
+                if payload_unit_start:
+                    self._end_pes(track)
+                track.pes.append(payload)
+        elif payload_unit_start and pid == 0:
+            self._parse_pat(bytearray(payload))
+        elif payload_unit_start and pid == self._pmt_pid:
+            self._parse_pmt(bytearray(payload))
+
+    @staticmethod
+    def _section(payload):
+        section = payload[1 + payload[0]:]
+        section_length = ((section[1] & 0x0f) << 8) | section[2]
+        # Without the CRC
+        return section[:3 + section_length - 4]
+
+    def _parse_pat(self, payload):
+        section = self._section(payload)
+        for pos in range(8, len(section) - 3, 4):
+            program_number = (section[pos] << 8) | section[pos + 1]
+            if program_number:
+                self._pmt_pid = ((section[pos + 2] & 0x1f) << 8) | section[pos + 3]
+                return
+
+    def _parse_pmt(self, payload):
+        section = self._section(payload)
+        pos = 12 + (((section[10] & 0x0f) << 8) | section[11])
+        tracks = {}
+        kinds = set()
+        while pos + 5 <= len(section):
+            stream_type = section[pos]
+            pid = ((section[pos + 1] & 0x1f) << 8) | section[pos + 2]
+            pos += 5 + (((section[pos + 3] & 0x0f) << 8) | section[pos + 4])
+            if stream_type in UNSUPPORTED_STREAM_TYPES:
+                raise RemuxError('unsupported stream type 0x%02x' % stream_type)
+            kind = {STREAM_TYPE_H264: 'video', STREAM_TYPE_AAC: 'audio'}.get(stream_type)
+            if kind is None or kind in kinds:
+                continue
+            kinds.add(kind)
+            tracks[pid] = _Track(len(tracks) + 1, kind)
+        if not tracks:
+            raise RemuxError('no H.264 or AAC stream found')
+        self._tracks = tracks
+
+    @staticmethod
+    def _parse_timestamp(data, pos):
+        return (
+            ((data[pos] >> 1) & 7) << 30 | data[pos + 1] << 22 | (data[pos + 2] >> 1) << 15 |
+            data[pos + 3] << 7 | data[pos + 4] >> 1)
+
+    def _end_pes(self, track):
+        pes = b''.join(track.pes)
+        track.pes = []
+        if len(pes) < 9 or pes[:3] != b'\x00\x00\x01':
+            return
+        header = bytearray(pes[:19])
+        pts = dts = None
+        pts_dts_flags = header[7] >> 6
+        if pts_dts_flags & 2 and len(header) >= 14:
+            pts = dts = self._parse_timestamp(header, 9)
+            if pts_dts_flags & 1 and len(header) >= 19:
+                dts = self._parse_timestamp(header, 14)
+        payload = pes[9 + header[8]:]
+        if track.kind == 'video':
+            self._video_access_unit(track, pts, dts, payload)
+        else:
+            self._audio_frames(track, pts, payload)
+
+    def _unwrap(self, track, timestamp):
+        """Return timestamp as a continuation of the timeline of track"""
+        if timestamp is None:
+            return None
+        timestamp += track.timestamp_offset
+        last = track.last_timestamp
+        if last is not None:
+            while timestamp < last - PES_TIMESTAMP_WRAP // 2:
+                timestamp += PES_TIMESTAMP_WRAP
+                track.timestamp_offset += PES_TIMESTAMP_WRAP
+        return timestamp
+
+    def _video_access_unit(self, track, pts, dts, data):
+        dts = self._unwrap(track, dts)
+        pts = self._unwrap(track, pts)
+        sample = []
+        keyframe = False
+        for nal in split_nal_units(data):
+            nal_type = bytearray(nal[:1])[0] & 0x1f
+            if nal_type == NAL_SPS:
+                if track.config is None:
+                    track.config = {'sps': nal}
+            elif nal_type == NAL_PPS:
+                if track.config is not None and 'pps' not in track.config:
+                    track.config['pps'] = nal
+            elif nal_type not in NAL_DROPPED:
+                keyframe = keyframe or nal_type == NAL_IDR
+                sample.append(u32.pack(len(nal)) + nal)
+        if not sample:
+            return
+        if track.last_timestamp is None and (
+                not keyframe or not track.config or 'pps' not in track.config):
+            # Decoding starts with a key frame
+            return
+        if dts is None:
+            dts = track.last_timestamp + (track.last_duration or 3000)
+            pts = dts
+        if track.held is not None:
+            duration = dts - track.last_timestamp
+            if not 0 < duration <= MAX_TIMESTAMP_STEP * PES_TIMESCALE:
+                # Discontinuity, keep the timeline going
+                duration = track.last_duration or 3000
+                shift = track.last_timestamp + duration - dts
+                track.timestamp_offset += shift
+                dts += shift
+                pts += shift
+            self._add_sample(track, *track.held, duration=duration)
+        track.last_timestamp = dts
+        track.held = (
+            dts, b''.join(sample),
+            SAMPLE_FLAGS_SYNC if keyframe else SAMPLE_FLAGS_NON_SYNC,
+            max(pts - dts, 0))
+
+    def _audio_frames(self, track, pts, data):
+        # pts is the timestamp of the first frame starting in data
+        pts_pos = len(track.pending_audio)
+        data = track.pending_audio + data
+        track.pending_audio = b''
+        pos = 0
+        while pos + 7 <= len(data):
+            header = bytearray(data[pos:pos + 7])
+            if header[0] != 0xff or header[1] & 0xf0 != 0xf0:
+                # Not at an ADTS frame, resynchronize
+                pos += 1
+                continue
+            frame_length = ((header[3] & 3) << 11) | (header[4] << 3) | (header[5] >> 5)
+            header_length = 7 if header[1] & 1 else 9
+            if frame_length <= header_length:
+                pos += 1
+                continue
+            if pos + frame_length > len(data):
+                break
+            if track.config is None:
+                object_type = (header[2] >> 6) + 1
+                sampling_index = (header[2] >> 2) & 0xf
+                channels = ((header[2] & 1) << 2) | (header[3] >> 6)
+                if sampling_index >= len(ADTS_SAMPLING_RATES):
+                    raise RemuxError('invalid AAC sampling frequency index')
+                track.timescale = ADTS_SAMPLING_RATES[sampling_index]
+                track.config = {
+                    'asc': u16.pack((object_type << 11) | (sampling_index << 7) | (channels << 3)),
+                    'channels': channels or 2,
+                }
+            if pts is not None and pos >= pts_pos:
+                self._audio_timestamp(track, self._unwrap(track, pts))
+                pts = None
+            if track.run_start is not None:
+                self._add_sample(
+                    track, track.run_start, data[pos + header_length:pos + frame_length],
+                    SAMPLE_FLAGS_SYNC, 0, duration=AAC_FRAME_SAMPLES)
+                track.run_frames += 1
+            pos += frame_length
+        track.pending_audio = data[pos:]
+
+    def _audio_timestamp(self, track, timestamp):
+        """Start a new run of audio frames at timestamp if it is off the current one"""
+        track.last_timestamp = timestamp
+        if track.run_start is None:
+            track.run_start = timestamp
+            return
+        expected = track.run_start + track.run_frames * AAC_FRAME_SAMPLES * PES_TIMESCALE // track.timescale
+        gap = timestamp - expected
+        if abs(gap) <= AAC_FRAME_SAMPLES * PES_TIMESCALE // track.timescale:
+            return
+        if 0 < gap <= MAX_TIMESTAMP_STEP * PES_TIMESCALE:
+            # Missing audio, the last frame lasts until the next one
+            gap = gap * track.timescale // PES_TIMESCALE
+            if track.samples:
+                duration, size, flags, composition_offset = track.samples[-1]
+                track.samples[-1] = (duration + gap, size, flags, composition_offset)
+            if track.next_decode_time is not None:
+                track.next_decode_time += gap
+        else:
+            # Discontinuity, keep the timeline going
+            track.timestamp_offset -= gap
+            track.last_timestamp = timestamp = expected
+        track.run_start = timestamp
+        track.run_frames = 0
+
+    def _add_sample(self, track, timestamp, data, flags, composition_offset, duration):
+        if track.first_timestamp is None:
+            track.first_timestamp = timestamp
+        if not track.samples:
+            track.decode_time = track.next_decode_time
+        track.data.append(data)
+        track.samples.append((duration, len(data), flags, composition_offset))
+        if track.next_decode_time is not None:
+            track.next_decode_time += duration
+        track.last_duration = duration
+
+    def _start_presentation(self):
+        """Return whether the header can be written, setting the start of the presentation"""
+        tracks = list(self._tracks.values())
+        if not all(t.samples for t in tracks):
+            if not any(
+                    sum(s[0] for s in t.samples) >= MAX_TRACK_START_DELAY * t.timescale
+                    for t in tracks):
+                return False
+            # Streams listed in the PMT but absent
+            self._tracks = dict((pid, t) for pid, t in self._tracks.items() if t.samples)
+            tracks = list(self._tracks.values())
+        base_timestamp = min(t.first_timestamp for t in tracks)
+        for track in tracks:
+            # Decoding times are in the timescale of the track from now on
+            track.decode_time = (track.first_timestamp - base_timestamp) * track.timescale // PES_TIMESCALE
+            track.next_decode_time = track.decode_time + sum(s[0] for s in track.samples)
+        return True
+
+    def _flush(self, final=False):
+        if self._tracks is None:
+            return b''
+        output = []
+        if not self._header_written:
+            if not self._start_presentation():
+                if not final:
+                    return b''
+                # Tracks without samples are dropped
+                self._tracks = dict((pid, t) for pid, t in self._tracks.items() if t.samples)
+                if not self._tracks or not self._start_presentation():
+                    raise RemuxError('no H.264 or AAC samples found')
+            output.append(self._header())
+            self._header_written = True
+            self._input = None
+        tracks = [t for t in sorted(self._tracks.values(), key=lambda t: t.track_id) if t.samples]
+        if tracks:
+            output.append(self._fragment(tracks))
+        return b''.join(output)
+
+    def _header(self):
+        creation_time = int(time.time())
+        tracks = sorted(self._tracks.values(), key=lambda t: t.track_id)
+
+        ftyp_payload = b'isom'  # major brand
+        ftyp_payload += u32.pack(0x200)  # minor version
+        ftyp_payload += b'isom' + b'iso6' + b'iso2' + b'avc1' + b'mp41'  # compatible brands
+
+        mvhd_payload = u32.pack(creation_time)
+        mvhd_payload += u32.pack(creation_time)
+        mvhd_payload += u32.pack(1000)  # timescale
+        mvhd_payload += u32.pack(0)  # duration
+        mvhd_payload += s1616.pack(1)  # rate
+        mvhd_payload += s88.pack(1)  # volume
+        mvhd_payload += u16.pack(0)  # reserved
+        mvhd_payload += u32.pack(0) * 2  # reserved
+        mvhd_payload += unity_matrix
+        mvhd_payload += u32.pack(0) * 6  # pre defined
+        mvhd_payload += u32.pack(len(tracks) + 1)  # next track id
+        moov_payload = full_box(b'mvhd', 0, 0, mvhd_payload)  # Movie Header Box
+
+        mvex_payload = b''
+        for track in tracks:
+            moov_payload += self._trak(track, creation_time)
+            trex_payload = u32.pack(track.track_id)  # track id
+            trex_payload += u32.pack(1)  # default sample description index
+            trex_payload += u32.pack(0)  # default sample duration
+            trex_payload += u32.pack(0)  # default sample size
+            trex_payload += u32.pack(0)  # default sample flags
+            mvex_payload += full_box(b'trex', 0, 0, trex_payload)  # Track Extends Box
+        moov_payload += box(b'mvex', mvex_payload)  # Movie Extends Box
+
+        return box(b'ftyp', ftyp_payload) + box(b'moov', moov_payload)
+
+    def _trak(self, track, creation_time):
+        is_audio = track.kind == 'audio'
+        width = height = 0
+        if not is_audio:
+            try:
+                width, height = parse_h264_sps(track.config['sps'])
+            except (IndexError, RemuxError):
+                pass
+
+        tkhd_payload = u32.pack(creation_time)
+        tkhd_payload += u32.pack(creation_time)
+        tkhd_payload += u32.pack(track.track_id)  # track id
+        tkhd_payload += u32.pack(0)  # reserved
+        tkhd_payload += u32.pack(0)  # duration
+        tkhd_payload += u32.pack(0) * 2  # reserved
+        tkhd_payload += s16.pack(0)  # layer
+        tkhd_payload += s16.pack(0)  # alternate group
+        tkhd_payload += s88.pack(1 if is_audio else 0)  # volume
+        tkhd_payload += u16.pack(0)  # reserved
+        tkhd_payload += unity_matrix
+        tkhd_payload += u1616.pack(width)
+        tkhd_payload += u1616.pack(height)
+        trak_payload = full_box(b'tkhd', 0, TRACK_ENABLED | TRACK_IN_MOVIE | TRACK_IN_PREVIEW, tkhd_payload)  # Track Header Box
+
+        mdhd_payload = u32.pack(creation_time)
+        mdhd_payload += u32.pack(creation_time)
+        mdhd_payload += u32.pack(track.timescale)
+        mdhd_payload += u32.pack(0)  # duration
+        mdhd_payload += u16.pack(0x55c4)  # language: und
+        mdhd_payload += u16.pack(0)  # pre defined
+        mdia_payload = full_box(b'mdhd', 0, 0, mdhd_payload)  # Media Header Box
+
+        hdlr_payload = u32.pack(0)  # pre defined
+        hdlr_payload += b'soun' if is_audio else b'vide'  # handler type
+        hdlr_payload += u32.pack(0) * 3  # reserved
+        hdlr_payload += (b'Sound' if is_audio else b'Video') + b'Handler\0'  # name
+        mdia_payload += full_box(b'hdlr', 0, 0, hdlr_payload)  # Handler Reference Box
+
+        if is_audio:
+            smhd_payload = s88.pack(0)  # balance
+            smhd_payload += u16.pack(0)  # reserved
+            minf_payload = full_box(b'smhd', 0, 0, smhd_payload)  # Sound Media Header
+        else:
+            vmhd_payload = u16.pack(0)  # graphics mode
+            vmhd_payload += u16.pack(0) * 3  # opcolor
+            minf_payload = full_box(b'vmhd', 0, 1, vmhd_payload)  # Video Media Header
+
+        dref_payload = u32.pack(1)  # entry count
+        dref_payload += full_box(b'url ', 0, SELF_CONTAINED, b'')  # Data Entry URL Box
+        dinf_payload = full_box(b'dref', 0, 0, dref_payload)  # Data Reference Box
+        minf_payload += box(b'dinf', dinf_payload)  # Data Information Box
+
+        sample_entry_payload = u8.pack(0) * 6  # reserved
+        sample_entry_payload += u16.pack(1)  # data reference index
+        if is_audio:
+            sample_entry_payload += u32.pack(0) * 2  # reserved
+            sample_entry_payload += u16.pack(track.config['channels'])
+            sample_entry_payload += u16.pack(16)  # sample size
+            sample_entry_payload += u16.pack(0)  # pre defined
+            sample_entry_payload += u16.pack(0)  # reserved
+            sample_entry_payload += u1616.pack(track.timescale if track.timescale < 0x10000 else 0)
+
+            def descriptor(tag, payload):
+                return u8.pack(tag) + u8.pack(len(payload)) + payload
+
+            decoder_config = u8.pack(0x40)  # object type: MPEG-4 audio
+            decoder_config += u8.pack(0x15)  # stream type: audio (5), reserved (1)
+            decoder_config += u8.pack(0) * 3  # buffer size
+            decoder_config += u32.pack(0)  # max bitrate
+            decoder_config += u32.pack(0)  # average bitrate
+            decoder_config += descriptor(0x05, track.config['asc'])  # Decoder Specific Info
+            es_payload = u16.pack(track.track_id)  # ES id
+            es_payload += u8.pack(0)  # flags
+            es_payload += descriptor(0x04, decoder_config)  # Decoder Config Descriptor
+            es_payload += descriptor(0x06, b'\x02')  # SL Config Descriptor
+            sample_entry_payload += full_box(b'esds', 0, 0, descriptor(0x03, es_payload))  # ES Descriptor Box
+            sample_entry_box = box(b'mp4a', sample_entry_payload)
+        else:
+            sps, pps = track.config['sps'], track.config['pps']
+            sample_entry_payload += u16.pack(0)  # pre defined
+            sample_entry_payload += u16.pack(0)  # reserved
+            sample_entry_payload += u32.pack(0) * 3  # pre defined
+            sample_entry_payload += u16.pack(width)
+            sample_entry_payload += u16.pack(height)
+            sample_entry_payload += u1616.pack(0x48)  # horiz resolution 72 dpi
+            sample_entry_payload += u1616.pack(0x48)  # vert resolution 72 dpi
+            sample_entry_payload += u32.pack(0)  # reserved
+            sample_entry_payload += u16.pack(1)  # frame count
+            sample_entry_payload += u8.pack(0) * 32  # compressor name
+            sample_entry_payload += u16.pack(0x18)  # depth
+            sample_entry_payload += s16.pack(-1)  # pre defined
+
+            avcc_payload = u8.pack(1)  # configuration version
+            avcc_payload += sps[1:4]  # avc profile indication + profile compatibility + avc level indication
+            avcc_payload += u8.pack(0xfc | 3)  # complete represenation (1) + reserved (11111) + length size minus one
+            avcc_payload += u8.pack(0xe1)  # reserved (111) + number of sps (00001)
+            avcc_payload += u16.pack(len(sps))
+            avcc_payload += sps
+            avcc_payload += u8.pack(1)  # number of pps
+            avcc_payload += u16.pack(len(pps))
+            avcc_payload += pps
+            sample_entry_payload += box(b'avcC', avcc_payload)  # AVC Decoder Configuration Record
+            sample_entry_box = box(b'avc1', sample_entry_payload)  # AVC Simple Entry
+
+        stsd_payload = u32.pack(1)  # entry count
+        stsd_payload += sample_entry_box
+        stbl_payload = full_box(b'stsd', 0, 0, stsd_payload)  # Sample Description Box
+        stbl_payload += full_box(b'stts', 0, 0, u32.pack(0))  # Decoding Time to Sample Box
+        stbl_payload += full_box(b'stsc', 0, 0, u32.pack(0))  # Sample To Chunk Box
+        stbl_payload += full_box(b'stsz', 0, 0, u32.pack(0) * 2)  # Sample Size Box
+        stbl_payload += full_box(b'stco', 0, 0, u32.pack(0))  # Chunk Offset Box
+        minf_payload += box(b'stbl', stbl_payload)  # Sample Table Box
+
+        mdia_payload += box(b'minf', minf_payload)  # Media Information Box
+        trak_payload += box(b'mdia', mdia_payload)  # Media Box
+        return box(b'trak', trak_payload)  # Track Box
+
+    def _fragment(self, tracks):
+        self._sequence_number += 1
+
+        def moof(data_offset):
+            moof_payload = full_box(b'mfhd', 0, 0, u32.pack(self._sequence_number))  # Movie Fragment Header Box
+            for track in tracks:
+                is_video = track.kind == 'video'
+                # default-base-is-moof
+                traf_payload = full_box(b'tfhd', 0, 0x020000, u32.pack(track.track_id))  # Track Fragment Header Box
+                traf_payload += full_box(b'tfdt', 1, 0, u64.pack(track.decode_time))  # Track Fragment Decode Time Box
+                # data offset, sample duration, size, flags and composition time offset
+                trun_flags = 0x000001 | 0x000100 | 0x000200 | 0x000400 | (0x000800 if is_video else 0)
+                trun_payload = u32.pack(len(track.samples))  # sample count
+                trun_payload += s32.pack(data_offset)
+                for duration, size, flags, composition_offset in track.samples:
+                    trun_payload += u32.pack(duration) + u32.pack(size) + u32.pack(flags)
+                    if is_video:
+                        trun_payload += u32.pack(composition_offset)
+                traf_payload += full_box(b'trun', 0, trun_flags, trun_payload)  # Track Fragment Run Box
+                moof_payload += box(b'traf', traf_payload)  # Track Fragment Box
+                data_offset += sum(s[1] for s in track.samples)
+            return box(b'moof', moof_payload)  # Movie Fragment Box
+
+        moof_size = len(moof(0))
+        output = moof(moof_size + 8)
+        output += box(b'mdat', b''.join(b''.join(track.data) for track in tracks))  # Media Data Box
+        for track in tracks:
+            track.data = []
+            track.samples = []
+        return output
@@ -33,6 +33,8 @@ from ..downloader.f4m import (
     get_base_url,
     remove_encrypted_media,
 )
+from ..formatsort import FormatSorter
+from ..m3u8 import parse_m3u8
 from ..utils import (
     NO_DEFAULT,
     age_restricted,
@@ -41,7 +43,6 @@ from ..utils import (
     clean_html,
     compiled_regex_type,
     determine_ext,
-    determine_protocol,
     error_to_compat_str,
     ExtractorError,
     extract_attributes,
@@ -56,7 +57,6 @@ from ..utils import (
     parse_codecs,
     parse_duration,
     parse_iso8601,
-    parse_m3u8_attributes,
     RegexNotFoundError,
     sanitized_Request,
     sanitize_filename,
@@ -146,6 +146,15 @@ class InfoExtractor(object):
                                             fragment_base_url
                                  * "duration" (optional, int or float)
                                  * "filesize" (optional, int)
+                    * fragment_template
+                                 A DASH segment template, describing the
+                                 fragments that follow the ones in fragments.
+                                 Contains the media template as a format
+                                 string with Number, Bandwidth and Time keys
+                                 ("media"), "bandwidth", "timescale",
+                                 "start_number" and either the SegmentTimeline
+                                 as a list of dicts with t, d and r keys ("s")
+                                 or "total_number" and "segment_duration".
                     * preference Order number of this format. If this field is
                                  present and not None, the formats get sorted
                                  by this field, regardless of all other values.
@@ -1195,71 +1204,12 @@ class InfoExtractor(object):
             if 'tbr' not in f and f.get('abr') is not None and f.get('vbr') is not None:
                 f['tbr'] = f['abr'] + f['vbr']
 
-        def _formats_key(f):
-            # TODO remove the following workaround
-            from ..utils import determine_ext
             if not f.get('ext') and 'url' in f:
                 f['ext'] = determine_ext(f['url'])
 
-            if isinstance(field_preference, (list, tuple)):
-                return tuple(
-                    f.get(field)
-                    if f.get(field) is not None
-                    else ('' if field == 'format_id' else -1)
-                    for field in field_preference)
-
-            preference = f.get('preference')
-            if preference is None:
-                preference = 0
-                if f.get('ext') in ['f4f', 'f4m']:  # Not yet supported
-                    preference -= 0.5
-
-            protocol = f.get('protocol') or determine_protocol(f)
-            proto_preference = 0 if protocol in ['http', 'https'] else (-0.5 if protocol == 'rtsp' else -0.1)
-
-            if f.get('vcodec') == 'none':  # audio only
-                preference -= 50
-                if self._downloader.params.get('prefer_free_formats'):
-                    ORDER = ['aac', 'mp3', 'm4a', 'webm', 'ogg', 'opus']
-                else:
-                    ORDER = ['webm', 'opus', 'ogg', 'mp3', 'aac', 'm4a']
-                ext_preference = 0
-                try:
-                    audio_ext_preference = ORDER.index(f['ext'])
-                except ValueError:
-                    audio_ext_preference = -1
-            else:
-                if f.get('acodec') == 'none':  # video only
-                    preference -= 40
-                if self._downloader.params.get('prefer_free_formats'):
-                    ORDER = ['flv', 'mp4', 'webm']
-                else:
-                    ORDER = ['webm', 'flv', 'mp4']
-                try:
-                    ext_preference = ORDER.index(f['ext'])
-                except ValueError:
-                    ext_preference = -1
-                audio_ext_preference = 0
-
-            return (
-                preference,
-                f.get('language_preference') if f.get('language_preference') is not None else -1,
-                f.get('quality') if f.get('quality') is not None else -1,
-                f.get('tbr') if f.get('tbr') is not None else -1,
-                f.get('filesize') if f.get('filesize') is not None else -1,
-                f.get('vbr') if f.get('vbr') is not None else -1,
-                f.get('height') if f.get('height') is not None else -1,
-                f.get('width') if f.get('width') is not None else -1,
-                proto_preference,
-                ext_preference,
-                f.get('abr') if f.get('abr') is not None else -1,
-                audio_ext_preference,
-                f.get('fps') if f.get('fps') is not None else -1,
-                f.get('filesize_approx') if f.get('filesize_approx') is not None else -1,
-                f.get('source_preference') if f.get('source_preference') is not None else -1,
-                f.get('format_id') if f.get('format_id') is not None else '',
-            )
-        formats.sort(key=_formats_key)
+        FormatSorter(
+            prefer_free_formats=self._downloader.params.get('prefer_free_formats'),
+            field_preference=field_preference).sort(formats)
 
     def _check_formats(self, formats, video_id):
         if formats:
@@ -1468,18 +1418,17 @@ class InfoExtractor(object):
     def _parse_m3u8_formats(self, m3u8_doc, m3u8_url, ext=None,
                             entry_protocol='m3u8', preference=None,
                             m3u8_id=None, live=False):
-        if '#EXT-X-FAXS-CM:' in m3u8_doc:  # Adobe Flash Access
+        playlist = parse_m3u8(m3u8_doc, m3u8_url)
+
+        if '#EXT-X-FAXS-CM' in playlist.tags:  # Adobe Flash Access
             return []
 
-        if re.search(r'#EXT-X-SESSION-KEY:.*?URI="skd://', m3u8_doc):  # Apple FairPlay
+        if any(key.get('URI', '').startswith('skd://') for key in playlist.session_keys):  # Apple FairPlay
             return []
 
         formats = []
 
-        format_url = lambda u: (
-            u
-            if re.match(r'^https?://', u)
-            else compat_urlparse.urljoin(m3u8_url, u))
+        format_url = playlist.absolute_url
 
         # References:
         # 1. https://tools.ietf.org/html/draft-pantos-http-live-streaming-21
@@ -1496,7 +1445,7 @@ class InfoExtractor(object):
         # media playlist and MUST NOT appear in master playlist thus we can
         # clearly detect media playlist with this criterion.
 
-        if '#EXT-X-TARGETDURATION' in m3u8_doc:  # media playlist, return as is
+        if playlist.is_media_playlist:  # media playlist, return as is
             return [{
                 'url': m3u8_url,
                 'format_id': m3u8_id,
@@ -1508,8 +1457,7 @@ class InfoExtractor(object):
         groups = {}
         last_stream_inf = {}
 
-        def extract_media(x_media_line):
-            media = parse_m3u8_attributes(x_media_line)
+        def extract_media(media):
             # As per [1, 4.3.4.1] TYPE, GROUP-ID and NAME are REQUIRED
             media_type, group_id, name = media.get('TYPE'), media.get('GROUP-ID'), media.get('NAME')
             if not (media_type and group_id and name):
@@ -1555,73 +1503,71 @@ class InfoExtractor(object):
             rendition = stream_group[0]
             return rendition.get('NAME') or stream_group_id
 
-        for line in m3u8_doc.splitlines():
-            if line.startswith('#EXT-X-STREAM-INF:'):
-                last_stream_inf = parse_m3u8_attributes(line)
-            elif line.startswith('#EXT-X-MEDIA:'):
-                extract_media(line)
-            elif line.startswith('#') or not line.strip():
-                continue
-            else:
-                tbr = float_or_none(
-                    last_stream_inf.get('AVERAGE-BANDWIDTH') or
-                    last_stream_inf.get('BANDWIDTH'), scale=1000)
-                format_id = []
-                if m3u8_id:
-                    format_id.append(m3u8_id)
-                stream_name = build_stream_name()
-                # Bandwidth of live streams may differ over time thus making
-                # format_id unpredictable. So it's better to keep provided
-                # format_id intact.
-                if not live:
-                    format_id.append(stream_name if stream_name else '%d' % (tbr if tbr else len(formats)))
-                manifest_url = format_url(line.strip())
-                f = {
-                    'format_id': '-'.join(format_id),
-                    'url': manifest_url,
-                    'manifest_url': m3u8_url,
-                    'tbr': tbr,
-                    'ext': ext,
-                    'fps': float_or_none(last_stream_inf.get('FRAME-RATE')),
-                    'protocol': entry_protocol,
-                    'preference': preference,
-                }
-                resolution = last_stream_inf.get('RESOLUTION')
-                if resolution:
-                    mobj = re.search(r'(?P<width>\d+)[xX](?P<height>\d+)', resolution)
-                    if mobj:
-                        f['width'] = int(mobj.group('width'))
-                        f['height'] = int(mobj.group('height'))
-                # Unified Streaming Platform
-                mobj = re.search(
-                    r'audio.*?(?:%3D|=)(\d+)(?:-video.*?(?:%3D|=)(\d+))?', f['url'])
+        renditions_done = 0
+        for last_stream_inf, manifest_url, renditions_before in playlist.variants:
+            # Renditions listed before the variant
+            for media in playlist.renditions[renditions_done:renditions_before]:
+                extract_media(media)
+            renditions_done = renditions_before
+            tbr = float_or_none(
+                last_stream_inf.get('AVERAGE-BANDWIDTH') or
+                last_stream_inf.get('BANDWIDTH'), scale=1000)
+            format_id = []
+            if m3u8_id:
+                format_id.append(m3u8_id)
+            stream_name = build_stream_name()
+            # Bandwidth of live streams may differ over time thus making
+            # format_id unpredictable. So it's better to keep provided
+            # format_id intact.
+            if not live:
+                format_id.append(stream_name if stream_name else '%d' % (tbr if tbr else len(formats)))
+            f = {
+                'format_id': '-'.join(format_id),
+                'url': manifest_url,
+                'manifest_url': m3u8_url,
+                'tbr': tbr,
+                'ext': ext,
+                'fps': float_or_none(last_stream_inf.get('FRAME-RATE')),
+                'protocol': entry_protocol,
+                'preference': preference,
+            }
+            resolution = last_stream_inf.get('RESOLUTION')
+            if resolution:
+                mobj = re.search(r'(?P<width>\d+)[xX](?P<height>\d+)', resolution)
                 if mobj:
-                    abr, vbr = mobj.groups()
-                    abr, vbr = float_or_none(abr, 1000), float_or_none(vbr, 1000)
-                    f.update({
-                        'vbr': vbr,
-                        'abr': abr,
-                    })
-                codecs = parse_codecs(last_stream_inf.get('CODECS'))
-                f.update(codecs)
-                audio_group_id = last_stream_inf.get('AUDIO')
-                # As per [1, 4.3.4.1.1] any EXT-X-STREAM-INF tag which
-                # references a rendition group MUST have a CODECS attribute.
-                # However, this is not always respected, for example, [2]
-                # contains EXT-X-STREAM-INF tag which references AUDIO
-                # rendition group but does not have CODECS and despite
-                # referencing audio group an audio group, it represents
-                # a complete (with audio and video) format. So, for such cases
-                # we will ignore references to rendition groups and treat them
-                # as complete formats.
-                if audio_group_id and codecs and f.get('vcodec') != 'none':
-                    audio_group = groups.get(audio_group_id)
-                    if audio_group and audio_group[0].get('URI'):
-                        # TODO: update acodec for audio only formats with
-                        # the same GROUP-ID
-                        f['acodec'] = 'none'
-                formats.append(f)
-                last_stream_inf = {}
+                    f['width'] = int(mobj.group('width'))
+                    f['height'] = int(mobj.group('height'))
+            # Unified Streaming Platform
+            mobj = re.search(
+                r'audio.*?(?:%3D|=)(\d+)(?:-video.*?(?:%3D|=)(\d+))?', f['url'])
+            if mobj:
+                abr, vbr = mobj.groups()
+                abr, vbr = float_or_none(abr, 1000), float_or_none(vbr, 1000)
+                f.update({
+                    'vbr': vbr,
+                    'abr': abr,
+                })
+            codecs = parse_codecs(last_stream_inf.get('CODECS'))
+            f.update(codecs)
+            audio_group_id = last_stream_inf.get('AUDIO')
+            # As per [1, 4.3.4.1.1] any EXT-X-STREAM-INF tag which
+            # references a rendition group MUST have a CODECS attribute.
+            # However, this is not always respected, for example, [2]
+            # contains EXT-X-STREAM-INF tag which references AUDIO
+            # rendition group but does not have CODECS and despite
+            # referencing audio group an audio group, it represents
+            # a complete (with audio and video) format. So, for such cases
+            # we will ignore references to rendition groups and treat them
+            # as complete formats.
+            if audio_group_id and codecs and f.get('vcodec') != 'none':
+                audio_group = groups.get(audio_group_id)
+                if audio_group and audio_group[0].get('URI'):
+                    # TODO: update acodec for audio only formats with
+                    # the same GROUP-ID
+                    f['acodec'] = 'none'
+            formats.append(f)
+        for media in playlist.renditions[renditions_done:]:
+            extract_media(media)
         return formats
 
     @staticmethod
@@ -2042,7 +1988,14 @@ class InfoExtractor(object):
                         if 'segment_urls' not in representation_ms_info and 'media' in representation_ms_info:
 
                             media_template = prepare_template('media', ('Number', 'Bandwidth', 'Time'))
-                            media_location_key = location_key(media_template)
+                            # Segments of a template are only expanded when
+                            # downloaded, see DashSegmentsFD
+                            fragment_template = {
+                                'media': media_template,
+                                'bandwidth': bandwidth,
+                                'start_number': representation_ms_info['start_number'],
+                                'timescale': representation_ms_info['timescale'],
+                            }
 
                             # As per [1, 5.3.9.4.4, Table 16, page 55] $Number$ and $Time$
                             # can't be used at the same time
@@ -2051,45 +2004,16 @@ class InfoExtractor(object):
                                 if 'total_number' not in representation_ms_info and 'segment_duration' in representation_ms_info:
                                     segment_duration = float_or_none(representation_ms_info['segment_duration'], representation_ms_info['timescale'])
                                     representation_ms_info['total_number'] = int(math.ceil(float(period_duration) / segment_duration))
-                                representation_ms_info['fragments'] = [{
-                                    media_location_key: media_template % {
-                                        'Number': segment_number,
-                                        'Bandwidth': bandwidth,
-                                    },
-                                    'duration': segment_duration,
-                                } for segment_number in range(
-                                    representation_ms_info['start_number'],
-                                    representation_ms_info['total_number'] + representation_ms_info['start_number'])]
+                                fragment_template.update({
+                                    'total_number': representation_ms_info['total_number'],
+                                    'segment_duration': segment_duration,
+                                })
                             else:
                                 # $Number*$ or $Time$ in media template with S list available
                                 # Example $Number*$: http://www.svtplay.se/klipp/9023742/stopptid-om-bjorn-borg
                                 # Example $Time$: https://play.arkena.com/embed/avp/v2/player/media/b41dda37-d8e7-4d3f-b1b5-9a9db578bdfe/1/129411
-                                representation_ms_info['fragments'] = []
-                                segment_time = 0
-                                segment_d = None
-                                segment_number = representation_ms_info['start_number']
-
-                                def add_segment_url():
-                                    segment_url = media_template % {
-                                        'Time': segment_time,
-                                        'Bandwidth': bandwidth,
-                                        'Number': segment_number,
-                                    }
-                                    representation_ms_info['fragments'].append({
-                                        media_location_key: segment_url,
-                                        'duration': float_or_none(segment_d, representation_ms_info['timescale']),
-                                    })
-
-                                for num, s in enumerate(representation_ms_info['s']):
-                                    segment_time = s.get('t') or segment_time
-                                    segment_d = s['d']
-                                    add_segment_url()
-                                    segment_number += 1
-                                    for r in range(s.get('r', 0)):
-                                        segment_time += segment_d
-                                        add_segment_url()
-                                        segment_number += 1
-                                    segment_time += segment_d
+                                fragment_template['s'] = representation_ms_info['s']
+                            representation_ms_info['fragment_template'] = fragment_template
                         elif 'segment_urls' in representation_ms_info and 's' in representation_ms_info:
                             # No media template
                             # Example: https://www.youtube.com/watch?v=iXZV5uAYMJI
@@ -2125,7 +2049,7 @@ class InfoExtractor(object):
                             representation_ms_info['fragments'] = fragments
                         # NB: MPD manifest may contain direct URLs to unfragmented media.
                         # No fragments key is present in this case.
-                        if 'fragments' in representation_ms_info:
+                        if 'fragments' in representation_ms_info or 'fragment_template' in representation_ms_info:
                             f.update({
                                 'fragment_base_url': base_url,
                                 'fragments': [],
@@ -2136,7 +2060,10 @@ class InfoExtractor(object):
                                 if not f.get('url'):
                                     f['url'] = initialization_url
                                 f['fragments'].append({location_key(initialization_url): initialization_url})
-                            f['fragments'].extend(representation_ms_info['fragments'])
+                            if 'fragment_template' in representation_ms_info:
+                                f['fragment_template'] = representation_ms_info['fragment_template']
+                            else:
+                                f['fragments'].extend(representation_ms_info['fragments'])
                         # According to [1, 5.3.5.2, Table 7, page 35] @id of Representation
                         # is not necessarily unique within a Period thus formats with
                         # the same `format_id` are quite possible. There are numerous examples
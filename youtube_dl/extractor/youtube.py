@@ -12,6 +12,7 @@ import time
 import traceback
 
 from .common import InfoExtractor, SearchInfoExtractor
+from ..cache import MemoryLRU
 from ..jsinterp import JSInterpreter
 from ..swfinterp import SWFInterpreter
 from ..compat import (
@@ -1055,9 +1056,13 @@ class YoutubeIE(YoutubeBaseInfoExtractor):
         },
     ]
 
-    def __init__(self, *args, **kwargs):
-        super(YoutubeIE, self).__init__(*args, **kwargs)
-        self._player_cache = {}
+    # Signature functions of the players, kept for the whole process by
+    # player, and by player URL and signature length
+    _PLAYER_MEMO = MemoryLRU(8)
+    _SIG_FUNC_MEMO = MemoryLRU(64)
+    # Numbers of player codes and signature specs kept in the cache dir
+    _PLAYER_CACHE_SIZE = 8
+    _SIG_SPEC_CACHE_SIZE = 256
 
     def report_video_info_webpage_download(self, video_id):
         """Report attempt to download video info webpage."""
@@ -1097,34 +1102,52 @@ class YoutubeIE(YoutubeBaseInfoExtractor):
         if cache_spec is not None:
             return lambda s: ''.join(s[i] for i in cache_spec)
 
+        player_key = '%s_%s' % (player_type, player_id)
+        res = self._PLAYER_MEMO.get(player_key)
+        if res is None:
+            res = self._extract_player_function(
+                video_id, player_url, player_type, player_id)
+            self._PLAYER_MEMO.put(player_key, res)
+
+        test_string = ''.join(map(compat_chr, range(len(example_sig))))
+        cache_res = res(test_string)
+        cache_spec = [ord(c) for c in cache_res]
+
+        self._downloader.cache.store(
+            'youtube-sigfuncs', func_id, cache_spec,
+            max_entries=self._SIG_SPEC_CACHE_SIZE)
+        return res
+
+    def _extract_player_function(self, video_id, player_url, player_type, player_id):
+        """Return the signature function of a player, for any signature length"""
+        player_key = '%s_%s' % (player_type, player_id)
         download_note = (
             'Downloading player %s' % player_url
             if self._downloader.params.get('verbose') else
             'Downloading %s player %s' % (player_type, player_id)
         )
         if player_type == 'js':
-            code = self._download_webpage(
-                player_url, video_id,
-                note=download_note,
-                errnote='Download of %s failed' % player_url)
-            res = self._parse_sig_js(code)
+            # Player code is shared between processes through the cache dir
+            code = self._downloader.cache.load('youtube-players', player_key)
+            if code is None:
+                code = self._download_webpage(
+                    player_url, video_id,
+                    note=download_note,
+                    errnote='Download of %s failed' % player_url)
+                self._downloader.cache.store(
+                    'youtube-players', player_key, code,
+                    max_entries=self._PLAYER_CACHE_SIZE)
+            return self._parse_sig_js(code)
         elif player_type == 'swf':
             urlh = self._request_webpage(
                 player_url, video_id,
                 note=download_note,
                 errnote='Download of %s failed' % player_url)
             code = urlh.read()
-            res = self._parse_sig_swf(code)
+            return self._parse_sig_swf(code)
         else:
             assert False, 'Invalid player type %r' % player_type
 
-        test_string = ''.join(map(compat_chr, range(len(example_sig))))
-        cache_res = res(test_string)
-        cache_spec = [ord(c) for c in cache_res]
-
-        self._downloader.cache.store('youtube-sigfuncs', func_id, cache_spec)
-        return res
-
     def _print_sig_code(self, func, example_sig):
         def gen_sig_code(idxs):
             def _genslice(start, end, step):
@@ -1194,12 +1217,12 @@ class YoutubeIE(YoutubeBaseInfoExtractor):
                 'https://www.youtube.com', player_url)
         try:
             player_id = (player_url, self._signature_cache_id(s))
-            if player_id not in self._player_cache:
+            func = self._SIG_FUNC_MEMO.get(player_id)
+            if func is None:
                 func = self._extract_signature_function(
                     video_id, player_url, s
                 )
-                self._player_cache[player_id] = func
-            func = self._player_cache[player_id]
+                self._SIG_FUNC_MEMO.put(player_id, func)
             if self._downloader.params.get('youtube_print_sig_code'):
                 self._print_sig_code(func, s)
             return func(s)
@@ -0,0 +1,124 @@
+from __future__ import unicode_literals
+
+import operator
+
+from .utils import determine_protocol
+
+
+# Fields of the default ranking, from the most to the least significant
+DEFAULT_ORDER = (
+    'preference', 'language_preference', 'quality', 'tbr', 'filesize',
+    'vbr', 'height', 'width', 'proto_preference', 'ext_preference', 'abr',
+    'audio_ext_preference', 'fps', 'filesize_approx', 'source_preference',
+    'format_id',
+)
+# Every field formats can be sorted by
+SORT_FIELDS = DEFAULT_ORDER + ('asr',)
+
+_FIELD_INDEX = dict((field, i) for i, field in enumerate(SORT_FIELDS))
+
+
+def _ext_ranks(order):
+    return dict((ext, i) for i, ext in enumerate(order))
+
+
+_AUDIO_EXT_RANKS = _ext_ranks(['webm', 'opus', 'ogg', 'mp3', 'aac', 'm4a'])
+_FREE_AUDIO_EXT_RANKS = _ext_ranks(['aac', 'mp3', 'm4a', 'webm', 'ogg', 'opus'])
+_VIDEO_EXT_RANKS = _ext_ranks(['webm', 'flv', 'mp4'])
+_FREE_VIDEO_EXT_RANKS = _ext_ranks(['flv', 'mp4', 'webm'])
+
+
+def _numeric(value):
+    return value if value is not None else -1
+
+
+class FormatSorter(object):
+    """
+    Ranks formats from the worst to the best
+
+    The sort values of a format are computed once into a tuple with an item
+    for each of SORT_FIELDS, missing values are -1 (or '' for format_id).
+    Formats are ranked by the fields of sort_order, if given, then by
+    DEFAULT_ORDER, or only by sort_order without default_ranking: ties then
+    keep their order as the sort is stable. field_preference is the legacy
+    raw ordering extractors may ask for, it replaces the whole ranking.
+    """
+
+    def __init__(self, sort_order=None, prefer_free_formats=False, field_preference=None, default_ranking=True):
+        for field in sort_order or ():
+            if field not in _FIELD_INDEX:
+                raise ValueError('Invalid format sort field %r' % field)
+        self.field_preference = field_preference
+        if prefer_free_formats:
+            self._audio_ext_ranks = _FREE_AUDIO_EXT_RANKS
+            self._video_ext_ranks = _FREE_VIDEO_EXT_RANKS
+        else:
+            self._audio_ext_ranks = _AUDIO_EXT_RANKS
+            self._video_ext_ranks = _VIDEO_EXT_RANKS
+        order = tuple(sort_order or ())
+        if default_ranking or not order:
+            order += DEFAULT_ORDER
+        self._rank = operator.itemgetter(*[_FIELD_INDEX[field] for field in order])
+
+    def sort_values(self, f):
+        """Return the tuple of the values of SORT_FIELDS for format f"""
+        get = f.get
+        ext = get('ext')
+
+        preference = get('preference')
+        if preference is None:
+            preference = 0
+            if ext in ('f4f', 'f4m'):  # Not yet supported
+                preference -= 0.5
+
+        protocol = get('protocol') or determine_protocol(f)
+        proto_preference = 0 if protocol in ('http', 'https') else (-0.5 if protocol == 'rtsp' else -0.1)
+
+        if get('vcodec') == 'none':  # audio only
+            preference -= 50
+            ext_preference = 0
+            audio_ext_preference = self._audio_ext_ranks.get(ext, -1)
+        else:
+            if get('acodec') == 'none':  # video only
+                preference -= 40
+            ext_preference = self._video_ext_ranks.get(ext, -1)
+            audio_ext_preference = 0
+
+        tbr = get('tbr')
+        if tbr is None and get('abr') is not None and get('vbr') is not None:
+            tbr = f['abr'] + f['vbr']
+
+        format_id = get('format_id')
+        return (
+            preference,
+            _numeric(get('language_preference')),
+            _numeric(get('quality')),
+            _numeric(tbr),
+            _numeric(get('filesize')),
+            _numeric(get('vbr')),
+            _numeric(get('height')),
+            _numeric(get('width')),
+            proto_preference,
+            ext_preference,
+            _numeric(get('abr')),
+            audio_ext_preference,
+            _numeric(get('fps')),
+            _numeric(get('filesize_approx')),
+            _numeric(get('source_preference')),
+            format_id if format_id is not None else '',
+            _numeric(get('asr')),
+        )
+
+    def key(self, f):
+        """Return the sort key of format f"""
+        if isinstance(self.field_preference, (list, tuple)):
+            return tuple(
+                f.get(field)
+                if f.get(field) is not None
+                else ('' if field == 'format_id' else -1)
+                for field in self.field_preference)
+        return self._rank(self.sort_values(f))
+
+    def sort(self, formats):
+        """Sort formats in place, the best one last"""
+        formats.sort(key=self.key)
@@ -1,5 +1,6 @@
 from __future__ import unicode_literals
 
+import itertools
 import json
 import operator
 import re
@@ -34,8 +35,32 @@ class JSInterpreter(object):
         self.code = code
         self._functions = {}
         self._objects = objects
+        # Names of the temporary variables of compiled expressions
+        self._temp_names = itertools.count()
 
     def interpret_statement(self, stmt, local_vars, allow_recursion=100):
+        return self._compile_statement(stmt, allow_recursion)(local_vars)
+
+    def interpret_expression(self, expr, local_vars, allow_recursion):
+        return self._compile_expression(expr, allow_recursion)(local_vars)
+
+    def compile_statement(self, stmt, allow_recursion=100):
+        """
+        Parse a statement once into a function of the local variables that
+        returns the same (value, should_abort) tuple as interpret_statement.
+
+        Errors are raised when the statement is run, not when it is compiled.
+        """
+        try:
+            return self._compile_statement(stmt, allow_recursion)
+        except ExtractorError as e:
+            error = e
+
+            def fail(local_vars):
+                raise error
+            return fail
+
+    def _compile_statement(self, stmt, allow_recursion):
         if allow_recursion < 0:
             raise ExtractorError('Recursion limit reached')
 
@@ -53,13 +78,13 @@ class JSInterpreter(object):
                 # Try interpreting it as an expression
                 expr = stmt
 
-        v = self.interpret_expression(expr, local_vars, allow_recursion)
-        return v, should_abort
+        expr_func = self._compile_expression(expr, allow_recursion)
+        return lambda local_vars: (expr_func(local_vars), should_abort)
 
-    def interpret_expression(self, expr, local_vars, allow_recursion):
+    def _compile_expression(self, expr, allow_recursion):
         expr = expr.strip()
         if expr == '':  # Empty expression
-            return None
+            return lambda local_vars: None
 
         if expr.startswith('('):
             parens_count = 0
@@ -70,14 +95,21 @@ class JSInterpreter(object):
                     parens_count -= 1
                     if parens_count == 0:
                         sub_expr = expr[1:m.start()]
-                        sub_result = self.interpret_expression(
-                            sub_expr, local_vars, allow_recursion)
+                        sub_func = self._compile_expression(
+                            sub_expr, allow_recursion)
                         remaining_expr = expr[m.end():].strip()
                         if not remaining_expr:
-                            return sub_result
-                        else:
-                            expr = json.dumps(sub_result) + remaining_expr
-                        break
+                            return sub_func
+                        # The rest of the expression refers to the value of
+                        # the parenthesized one through a temporary variable
+                        temp_name = '$$%d' % next(self._temp_names)
+                        rest_func = self._compile_expression(
+                            temp_name + remaining_expr, allow_recursion)
+
+                        def parens(local_vars):
+                            local_vars[temp_name] = sub_func(local_vars)
+                            return rest_func(local_vars)
+                        return parens
             else:
                 raise ExtractorError('Premature end of parens in %r' % expr)
 
@@ -88,75 +120,138 @@ class JSInterpreter(object):
                 (?P<expr>.*)$''' % (_NAME_RE, re.escape(op)), expr)
             if not m:
                 continue
-            right_val = self.interpret_expression(
-                m.group('expr'), local_vars, allow_recursion - 1)
+            right_func = self._compile_expression(
+                m.group('expr'), allow_recursion - 1)
+            out = m.group('out')
 
             if m.groupdict().get('index'):
-                lvar = local_vars[m.group('out')]
-                idx = self.interpret_expression(
-                    m.group('index'), local_vars, allow_recursion)
-                assert isinstance(idx, int)
-                cur = lvar[idx]
-                val = opfunc(cur, right_val)
-                lvar[idx] = val
-                return val
+                idx_func = self._compile_expression(
+                    m.group('index'), allow_recursion)
+
+                def assign_item(local_vars):
+                    right_val = right_func(local_vars)
+                    lvar = local_vars[out]
+                    idx = idx_func(local_vars)
+                    assert isinstance(idx, int)
+                    cur = lvar[idx]
+                    val = opfunc(cur, right_val)
+                    lvar[idx] = val
+                    return val
+                return assign_item
             else:
-                cur = local_vars.get(m.group('out'))
-                val = opfunc(cur, right_val)
-                local_vars[m.group('out')] = val
-                return val
+                def assign(local_vars):
+                    right_val = right_func(local_vars)
+                    cur = local_vars.get(out)
+                    val = opfunc(cur, right_val)
+                    local_vars[out] = val
+                    return val
+                return assign
 
         if expr.isdigit():
-            return int(expr)
+            int_val = int(expr)
+            return lambda local_vars: int_val
 
         var_m = re.match(
             r'(?!if|return|true|false)(?P<name>%s)$' % _NAME_RE,
             expr)
         if var_m:
-            return local_vars[var_m.group('name')]
+            name = var_m.group('name')
+            return lambda local_vars: local_vars[name]
 
         try:
-            return json.loads(expr)
+            json_val = json.loads(expr)
         except ValueError:
             pass
+        else:
+            if isinstance(json_val, (list, dict)):
+                # Every evaluation creates a new one
+                return lambda local_vars: json.loads(expr)
+            return lambda local_vars: json_val
 
         m = re.match(
             r'(?P<in>%s)\[(?P<idx>.+)\]$' % _NAME_RE, expr)
         if m:
-            val = local_vars[m.group('in')]
-            idx = self.interpret_expression(
-                m.group('idx'), local_vars, allow_recursion - 1)
-            return val[idx]
+            name = m.group('in')
+            idx_func = self._compile_expression(
+                m.group('idx'), allow_recursion - 1)
+
+            def item(local_vars):
+                val = local_vars[name]
+                return val[idx_func(local_vars)]
+            return item
 
         m = re.match(
             r'(?P<var>%s)(?:\.(?P<member>[^(]+)|\[(?P<member2>[^]]+)\])\s*(?:\(+(?P<args>[^()]*)\))?$' % _NAME_RE,
             expr)
         if m:
-            variable = m.group('var')
-            member = remove_quotes(m.group('member') or m.group('member2'))
-            arg_str = m.group('args')
+            return self._compile_member(
+                expr, m.group('var'), remove_quotes(m.group('member') or m.group('member2')),
+                m.group('args'), allow_recursion)
 
-            if variable in local_vars:
-                obj = local_vars[variable]
-            else:
-                if variable not in self._objects:
-                    self._objects[variable] = self.extract_object(variable)
-                obj = self._objects[variable]
-
-            if arg_str is None:
-                # Member access
-                if member == 'length':
-                    return len(obj)
-                return obj[member]
-
-            assert expr.endswith(')')
-            # Function call
-            if arg_str == '':
-                argvals = tuple()
-            else:
+        for op, opfunc in _OPERATORS:
+            m = re.match(r'(?P<x>.+?)%s(?P<y>.+)' % re.escape(op), expr)
+            if not m:
+                continue
+            x_func = self._compile_statement(
+                m.group('x'), allow_recursion - 1)
+            y_func = self._compile_statement(
+                m.group('y'), allow_recursion - 1)
+
+            def operation(local_vars):
+                x, abort = x_func(local_vars)
+                if abort:
+                    raise ExtractorError(
+                        'Premature left-side return of %s in %r' % (op, expr))
+                y, abort = y_func(local_vars)
+                if abort:
+                    raise ExtractorError(
+                        'Premature right-side return of %s in %r' % (op, expr))
+                return opfunc(x, y)
+            return operation
+
+        m = re.match(
+            r'^(?P<func>%s)\((?P<args>[a-zA-Z0-9_$,]*)\)$' % _NAME_RE, expr)
+        if m:
+            fname = m.group('func')
+            argnames = m.group('args').split(',') if len(m.group('args')) > 0 else []
+
+            def call(local_vars):
                 argvals = tuple([
-                    self.interpret_expression(v, local_vars, allow_recursion)
-                    for v in arg_str.split(',')])
+                    int(v) if v.isdigit() else local_vars[v]
+                    for v in argnames])
+                if fname not in self._functions:
+                    self._functions[fname] = self.extract_function(fname)
+                return self._functions[fname](argvals)
+            return call
+
+        raise ExtractorError('Unsupported JS expression %r' % expr)
+
+    def _compile_member(self, expr, variable, member, arg_str, allow_recursion):
+        def get_obj(local_vars):
+            if variable in local_vars:
+                return local_vars[variable]
+            if variable not in self._objects:
+                self._objects[variable] = self.extract_object(variable)
+            return self._objects[variable]
+
+        if arg_str is None:
+            # Member access
+            if member == 'length':
+                return lambda local_vars: len(get_obj(local_vars))
+            return lambda local_vars: get_obj(local_vars)[member]
+
+        assert expr.endswith(')')
+        # Function call
+        if arg_str == '':
+            arg_funcs = []
+        else:
+            arg_funcs = [
+                self._compile_expression(v, allow_recursion)
+                for v in arg_str.split(',')]
+
+        def call_member(local_vars):
+            obj = get_obj(local_vars)
+            argvals = tuple([f(local_vars) for f in arg_funcs])
 
             if member == 'split':
                 assert argvals == ('',)
@@ -180,35 +275,7 @@ class JSInterpreter(object):
                 return res
 
             return obj[member](argvals)
-
-        for op, opfunc in _OPERATORS:
-            m = re.match(r'(?P<x>.+?)%s(?P<y>.+)' % re.escape(op), expr)
-            if not m:
-                continue
-            x, abort = self.interpret_statement(
-                m.group('x'), local_vars, allow_recursion - 1)
-            if abort:
-                raise ExtractorError(
-                    'Premature left-side return of %s in %r' % (op, expr))
-            y, abort = self.interpret_statement(
-                m.group('y'), local_vars, allow_recursion - 1)
-            if abort:
-                raise ExtractorError(
-                    'Premature right-side return of %s in %r' % (op, expr))
-            return opfunc(x, y)
-
-        m = re.match(
-            r'^(?P<func>%s)\((?P<args>[a-zA-Z0-9_$,]*)\)$' % _NAME_RE, expr)
-        if m:
-            fname = m.group('func')
-            argvals = tuple([
-                int(v) if v.isdigit() else local_vars[v]
-                for v in m.group('args').split(',')]) if len(m.group('args')) > 0 else tuple()
-            if fname not in self._functions:
-                self._functions[fname] = self.extract_function(fname)
-            return self._functions[fname](argvals)
-
-        raise ExtractorError('Unsupported JS expression %r' % expr)
+        return call_member
 
     def extract_object(self, objname):
         _FUNC_NAME_RE = r'''(?:[a-zA-Z$0-9]+|"[a-zA-Z$0-9]+"|'[a-zA-Z$0-9]+')'''
@@ -252,10 +319,12 @@ class JSInterpreter(object):
         return f(args)
 
     def build_function(self, argnames, code):
+        stmts = [self.compile_statement(stmt) for stmt in code.split(';')]
+
         def resf(args):
             local_vars = dict(zip(argnames, args))
-            for stmt in code.split(';'):
-                res, abort = self.interpret_statement(stmt, local_vars)
+            for stmt in stmts:
+                res, abort = stmt(local_vars)
                 if abort:
                     break
             return res
@@ -0,0 +1,179 @@
+from __future__ import unicode_literals
+
+import binascii
+import collections
+import re
+
+from .compat import compat_urlparse
+from .utils import parse_m3u8_attributes
+
+
+# A media segment of a media playlist
+#   url:            absolute URL of the segment
+#   byte_range:     dict with start and end of the sub-range, or None
+#   key:            attributes of the EXT-X-KEY tag in effect (IV as bytes,
+#                   URI absolute), or None if the segment is not encrypted.
+#                   Segments with the same key share the same dict.
+#   media_sequence: media sequence number of the segment
+#   duration:       duration from EXTINF in seconds, or None
+#   is_ad:          whether the segment has been marked as an advertisement
+M3U8Segment = collections.namedtuple('M3U8Segment', (
+    'url', 'byte_range', 'key', 'media_sequence', 'duration', 'is_ad'))
+
+
+class M3U8Playlist(object):
+    """
+    Result of parsing a media or master M3U8 playlist
+
+    Media playlists fill segments, the compact segment table. Master
+    playlists fill variants, a list of (EXT-X-STREAM-INF attributes,
+    absolute URL, number of renditions before it) tuples, and renditions,
+    a list of EXT-X-MEDIA attributes, in playlist order.
+    """
+
+    def __init__(self, base_url=''):
+        self.base_url = base_url
+        self.tags = set()
+        self.target_duration = None
+        self.media_sequence = 0
+        self.endlist = False
+        self.key_methods = set()
+        self.session_keys = []
+        self.segments = []
+        self.ad_segments = 0
+        self.variants = []
+        self.renditions = []
+
+    @property
+    def is_media_playlist(self):
+        # As of [1, 4.3.3.1] #EXT-X-TARGETDURATION tag is REQUIRED for every
+        # media playlist and MUST NOT appear in master playlist
+        # 1. https://tools.ietf.org/html/draft-pantos-http-live-streaming-21
+        return '#EXT-X-TARGETDURATION' in self.tags
+
+    def absolute_url(self, url):
+        if re.match(r'^https?://', url):
+            return url
+        return compat_urlparse.urljoin(self.base_url, url)
+
+
+class M3U8Parser(object):
+    """
+    Incremental M3U8 parser
+
+    The playlist is fed in text chunks of any size with feed(), close()
+    returns the M3U8Playlist. Every line is looked at only once.
+    """
+
+    def __init__(self, base_url=''):
+        self.playlist = M3U8Playlist(base_url)
+        self._pending = ''
+        self._media_sequence = 0
+        self._key = None
+        self._byte_range = None
+        self._duration = None
+        self._ad_next = False
+        self._stream_inf = None
+
+    def feed(self, data):
+        lines = (self._pending + data).splitlines(True)
+        self._pending = ''
+        if lines and not lines[-1].endswith(('\n', '\r')):
+            # Incomplete last line
+            self._pending = lines.pop()
+        for line in lines:
+            self._parse_line(line)
+
+    def close(self):
+        if self._pending:
+            self._parse_line(self._pending)
+            self._pending = ''
+        return self.playlist
+
+    @staticmethod
+    def _is_ad_marker(line):
+        return (line.startswith('#ANVATO-SEGMENT-INFO') and 'type=ad' in line or
+                line.startswith('#UPLYNK-SEGMENT') and line.endswith(',ad'))
+
+    def _parse_line(self, line):
+        line = line.strip()
+        if not line:
+            return
+        playlist = self.playlist
+        if not line.startswith('#'):
+            self._parse_uri(line)
+            return
+
+        tag = line.split(':', 1)[0]
+        playlist.tags.add(tag)
+        if tag == '#EXTINF':
+            duration = line[8:].split(',', 1)[0]
+            try:
+                self._duration = float(duration)
+            except ValueError:
+                self._duration = None
+        elif tag == '#EXT-X-KEY':
+            key = parse_m3u8_attributes(line[11:])
+            method = key.get('METHOD')
+            playlist.key_methods.add(method)
+            if method == 'NONE':
+                self._key = None
+                return
+            if 'IV' in key:
+                key['IV'] = binascii.unhexlify(key['IV'][2:].zfill(32))
+            if 'URI' in key:
+                key['URI'] = playlist.absolute_url(key['URI'])
+            self._key = key
+        elif tag == '#EXT-X-MEDIA-SEQUENCE':
+            self._media_sequence = int(line[22:])
+            if not playlist.segments:
+                playlist.media_sequence = self._media_sequence
+        elif tag == '#EXT-X-BYTERANGE':
+            splitted_byte_range = line[17:].split('@')
+            sub_range_start = int(splitted_byte_range[1]) if len(splitted_byte_range) == 2 else self._byte_range['end']
+            self._byte_range = {
+                'start': sub_range_start,
+                'end': sub_range_start + int(splitted_byte_range[0]),
+            }
+        elif tag == '#EXT-X-TARGETDURATION':
+            try:
+                playlist.target_duration = float(line[22:])
+            except ValueError:
+                pass
+        elif tag == '#EXT-X-ENDLIST':
+            playlist.endlist = True
+        elif tag == '#EXT-X-STREAM-INF':
+            self._stream_inf = parse_m3u8_attributes(line)
+        elif tag == '#EXT-X-MEDIA':
+            playlist.renditions.append(parse_m3u8_attributes(line))
+        elif tag == '#EXT-X-SESSION-KEY':
+            playlist.session_keys.append(parse_m3u8_attributes(line))
+        elif self._is_ad_marker(line):
+            playlist.ad_segments += 1
+            self._ad_next = True
+
+    def _parse_uri(self, line):
+        playlist = self.playlist
+        if self._stream_inf is not None or playlist.renditions or playlist.variants:
+            playlist.variants.append((
+                self._stream_inf or {}, playlist.absolute_url(line),
+                len(playlist.renditions)))
+            self._stream_inf = None
+            return
+        is_ad = self._ad_next
+        playlist.segments.append(M3U8Segment(
+            playlist.absolute_url(line), self._byte_range, self._key,
+            self._media_sequence, self._duration, is_ad))
+        self._duration = None
+        if is_ad:
+            # Advertisements do not count as media segments
+            self._ad_next = False
+        else:
+            self._media_sequence += 1
+
+
+def parse_m3u8(m3u8_doc, base_url=''):
+    """Parse a whole M3U8 playlist, return an M3U8Playlist"""
+    parser = M3U8Parser(base_url)
+    parser.feed(m3u8_doc)
+    return parser.close()
@@ -226,6 +226,11 @@ def parseOpts(overrideArguments=None):
         action='store_const', const='::', dest='source_address',
         help='Make all connections via IPv6',
     )
+    network.add_option(
+        '--no-keep-alive',
+        action='store_true', dest='no_keep_alive', default=False,
+        help='Do not reuse HTTP connections across requests',
+    )
 
     geo = optparse.OptionGroup(parser, 'Geo Restriction')
     geo.add_option(
@@ -343,7 +348,9 @@ def parseOpts(overrideArguments=None):
     selection.add_option(
         '--download-archive', metavar='FILE',
         dest='download_archive',
-        help='Download only videos not listed in the archive file. Record the IDs of all downloaded videos in it.')
+        help=(
+            'Download only videos not listed in the archive file. Record the IDs of all downloaded videos in it. '
+            'If FILE has a .sqlite, .sqlite3 or .db extension, it is kept as an SQLite database'))
     selection.add_option(
         '--include-ads',
         dest='include_ads', action='store_true',
@@ -402,6 +409,17 @@ def parseOpts(overrideArguments=None):
         '--prefer-free-formats',
         action='store_true', dest='prefer_free_formats', default=False,
         help='Prefer free video formats unless a specific one is requested')
+    video_format.add_option(
+        '--format-sort',
+        metavar='FIELDS', dest='format_sort', default=None,
+        action='callback', type='str', callback=_comma_separated_values_options_callback,
+        help=(
+            'Fields to rank formats by, separated by commas, the most significant first. '
+            'Fields are preference, language_preference, quality, tbr, filesize, vbr, height, width, '
+            'proto_preference, ext_preference, abr, audio_ext_preference, fps, filesize_approx, '
+            'source_preference, format_id and asr, higher values are better. '
+            'Ties keep the order of the extractor, which is the default ranking unless the extractor ranks them otherwise. '
+            'Example: --format-sort height,fps'))
     video_format.add_option(
         '-F', '--list-formats',
         action='store_true', dest='listformats',
@@ -421,6 +439,10 @@ def parseOpts(overrideArguments=None):
             'If a merge is required (e.g. bestvideo+bestaudio), '
             'output to given container format. One of mkv, mp4, ogg, webm, flv. '
             'Ignored if no merge is required'))
+    video_format.add_option(
+        '--concurrent-formats',
+        action='store_true', dest='concurrent_format_downloads', default=False,
+        help='If a merge is required (e.g. bestvideo+bestaudio), download the formats at the same time')
 
     subtitles = optparse.OptionGroup(parser, 'Subtitle Options')
     subtitles.add_option(
@@ -462,6 +484,14 @@ def parseOpts(overrideArguments=None):
         '--fragment-retries',
         dest='fragment_retries', metavar='RETRIES', default=10,
         help='Number of retries for a fragment (default is %default), or "infinite" (DASH, hlsnative and ISM)')
+    downloader.add_option(
+        '--concurrent-fragments',
+        dest='concurrent_fragment_downloads', metavar='N', default=1, type=int,
+        help='Number of fragments to download concurrently (default is %default) (DASH, hlsnative and ISM)')
+    downloader.add_option(
+        '--http-connections',
+        dest='http_connections', metavar='N', default=1, type=int,
+        help='Number of connections to download a single file over HTTP with, each one fetching a part of the file (default is %default)')
     downloader.add_option(
         '--skip-unavailable-fragments',
         action='store_true', dest='skip_unavailable_fragments', default=True,
@@ -499,6 +529,20 @@ def parseOpts(overrideArguments=None):
         '--playlist-random',
         action='store_true',
         help='Download playlist videos in random order')
+    downloader.add_option(
+        '--lazy-playlist',
+        action='store_true', dest='lazy_playlist', default=False,
+        help=(
+            'Download playlist videos as they are listed, without collecting the whole playlist first '
+            'and without keeping the information of downloaded videos in memory. '
+            'The number of videos is not known in advance, --playlist-items are downloaded in playlist order '
+            'and --playlist-reverse and --playlist-random cannot be used. '
+            '%(playlist_index)s in the output template is padded to the digits of the last of --playlist-items, '
+            'of --playlist-end or to 5 digits'))
+    downloader.add_option(
+        '--concurrent-entries',
+        dest='concurrent_playlist_entries', metavar='N', default=1, type=int,
+        help='Number of playlist videos to extract and download concurrently (default is %default)')
     downloader.add_option(
         '--xattr-set-filesize',
         dest='xattr_set_filesize', action='store_true',
@@ -635,6 +679,11 @@ def parseOpts(overrideArguments=None):
         action='store_true', dest='print_json', default=False,
         help='Be quiet and print the video information as JSON (video is still being downloaded).',
     )
+    verbosity.add_option(
+        '--json-fields',
+        metavar='FIELDS', dest='json_fields', default=None,
+        action='callback', type='str', callback=_comma_separated_values_options_callback,
+        help='Fields of the video information to print with --dump-json or --print-json, separated by commas')
     verbosity.add_option(
         '--newline',
         action='store_true', dest='progress_with_newline', default=False,
@@ -682,6 +731,17 @@ def parseOpts(overrideArguments=None):
         dest='batchfile', metavar='FILE',
         help="File containing URLs to download ('-' for stdin), one URL per line. "
              "Lines starting with '#', ';' or ']' are considered as comments and ignored.")
+    filesystem.add_option(
+        '--batch-log',
+        dest='batch_log', metavar='FILE',
+        help='Record the result of every URL as a JSON line in FILE. '
+             'URLs already recorded as successfully processed are skipped, '
+             'so that an interrupted batch can be resumed.')
+    filesystem.add_option(
+        '--batch-prefetch',
+        action='store_true', dest='batch_prefetch', default=False,
+        help='Extract the information of the next URL of the batch file '
+             'while the current one is being downloaded')
     filesystem.add_option(
         '--id', default=False,
         action='store_true', dest='useid', help='Use only video ID in file name')
@@ -755,7 +815,7 @@ def parseOpts(overrideArguments=None):
         help='File to read cookies from and dump cookie jar in')
     filesystem.add_option(
         '--cache-dir', dest='cachedir', default=None, metavar='DIR',
-        help='Location in the filesystem where youtube-dl can store some downloaded information permanently. By default $XDG_CACHE_HOME/youtube-dl or ~/.cache/youtube-dl . At the moment, only YouTube player files (for videos with obfuscated signatures) are cached, but that may change.')
+        help='Location in the filesystem where youtube-dl can store some downloaded information permanently. By default $XDG_CACHE_HOME/youtube-dl or ~/.cache/youtube-dl . A file name ending in .sqlite keeps the whole cache in a single SQLite database. At the moment, only YouTube player files (for videos with obfuscated signatures) are cached, but that may change.')
     filesystem.add_option(
         '--no-cache-dir', action='store_const', const=False, dest='cachedir',
         help='Disable filesystem caching')
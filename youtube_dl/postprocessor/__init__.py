@@ -8,10 +8,12 @@ from .ffmpeg import (
     FFmpegFixupStretchedPP,
     FFmpegFixupM3u8PP,
     FFmpegFixupM4aPP,
+    FFmpegFusedPP,
     FFmpegMergerPP,
     FFmpegMetadataPP,
     FFmpegVideoConvertorPP,
     FFmpegSubtitlesConvertorPP,
+    fuse_postprocessors,
 )
 from .xattrpp import XAttrMetadataPP
 from .execafterdownload import ExecAfterDownloadPP
@@ -30,6 +32,7 @@ __all__ = [
     'FFmpegFixupM3u8PP',
     'FFmpegFixupM4aPP',
     'FFmpegFixupStretchedPP',
+    'FFmpegFusedPP',
     'FFmpegMergerPP',
     'FFmpegMetadataPP',
     'FFmpegPostProcessor',
@@ -37,4 +40,5 @@ __all__ = [
     'FFmpegVideoConvertorPP',
     'MetadataFromTitlePP',
     'XAttrMetadataPP',
+    'fuse_postprocessors',
 ]
@@ -3,6 +3,7 @@ from __future__ import unicode_literals
 import io
 import os
 import subprocess
+import threading
 import time
 import re
 
@@ -10,6 +11,7 @@ import re
 from .common import AudioConversionError, PostProcessor
 
 from ..compat import (
+    compat_getenv,
     compat_subprocess_get_DEVNULL,
 )
 from ..utils import (
@@ -54,11 +56,203 @@ class FFmpegPostProcessorError(PostProcessingError):
     pass
 
 
+FFMPEG_PROGRAMS = ('avprobe', 'avconv', 'ffmpeg', 'ffprobe')
+
+# Executables found for each (ffmpeg_location, PATH), shared by all the
+# postprocessors and downloaders of the process
+_executables_cache = {}
+_executables_lock = threading.Lock()
+
+
+def _probe_executables(location):
+    """
+    Return a dict describing the ffmpeg and avconv executables to use
+
+    paths:          paths by program name
+    versions:       versions by program name, False if not found
+    prefer_ffmpeg:  whether location points to ffmpeg
+    warning:        a warning about location, or None
+    capabilities:   probed muxers, encoders and bitstream filters, see
+                    _probe_capabilities()
+
+    Executables are only looked for once for a given location and PATH.
+    """
+    key = (location, compat_getenv('PATH'))
+    with _executables_lock:
+        executables = _executables_cache.get(key)
+        if executables is None:
+            executables = _executables_cache[key] = _find_executables(location)
+        return executables
+
+
+def _find_executables(location):
+    programs = FFMPEG_PROGRAMS
+    executables = {
+        'paths': None,
+        'versions': {},
+        'prefer_ffmpeg': False,
+        'warning': None,
+        'capabilities': {},
+    }
+    if location is not None:
+        if not os.path.exists(location):
+            executables['warning'] = (
+                'ffmpeg-location %s does not exist! '
+                'Continuing without avconv/ffmpeg.' % (location))
+            return executables
+        elif not os.path.isdir(location):
+            basename = os.path.splitext(os.path.basename(location))[0]
+            if basename not in programs:
+                executables['warning'] = (
+                    'Cannot identify executable %s, its basename should be one of %s. '
+                    'Continuing without avconv/ffmpeg.' %
+                    (location, ', '.join(programs)))
+                return executables
+            location = os.path.dirname(os.path.abspath(location))
+            if basename in ('ffmpeg', 'ffprobe'):
+                executables['prefer_ffmpeg'] = True
+        executables['paths'] = dict(
+            (p, os.path.join(location, p)) for p in programs)
+    else:
+        executables['paths'] = dict((p, p) for p in programs)
+    executables['versions'] = dict(
+        (p, get_exe_version(executables['paths'][p], args=['-version']))
+        for p in programs)
+    return executables
+
+
+def _parse_capabilities(kind, output):
+    """Return the names listed in the output of ffmpeg -muxers, -encoders or -bsfs"""
+    names = set()
+    in_list = False
+    for line in output.splitlines():
+        if not in_list:
+            # Lists start after a separator line, or a header for -bsfs
+            in_list = (
+                line.strip().startswith('--') if kind != 'bsfs'
+                else line.strip().endswith(':'))
+            continue
+        fields = line.split()
+        if kind == 'bsfs':
+            if fields:
+                names.add(fields[0])
+        elif len(fields) >= 2 and (kind != 'muxers' or 'E' in fields[0]):
+            names.update(fields[1].split(','))
+    return names
+
+
+def _probe_capabilities(executables, basename, kind):
+    """
+    Return the set of muxers, encoders or bitstream filters (depending on
+    kind) of the executable basename, or None if they cannot be told
+
+    Each list is only probed once per executable.
+    """
+    with _executables_lock:
+        capabilities = executables['capabilities'].setdefault(basename, {})
+        if kind not in capabilities:
+            try:
+                output, _ = subprocess.Popen(
+                    [encodeFilename(executables['paths'][basename], True), encodeArgument('-' + kind)],
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                    stderr=compat_subprocess_get_DEVNULL()).communicate()
+                capabilities[kind] = _parse_capabilities(
+                    kind, output.decode('ascii', 'ignore')) or None
+            except OSError:
+                capabilities[kind] = None
+        return capabilities[kind]
+
+
+class FFmpegPlan(object):
+    """
+    A single ffmpeg invocation remuxing a file, built by the plan_step()
+    of one or more postprocessors
+
+    Streams are copied. Steps add inputs, maps and output options, the
+    result replaces filename.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.inputs = [filename]
+        # Input the audio stream comes from
+        self.audio_input = filename
+        # None to let ffmpeg select the streams
+        self.maps = None
+        self.output_format = None
+        self.options = []
+        self.files_to_delete = []
+        # Files created for the invocation, removed after it
+        self.temp_files = []
+        self.empty = True
+
+    def add_input(self, path):
+        """Add an input file, return its index"""
+        self.inputs.append(path)
+        return len(self.inputs) - 1
+
+    def add_maps(self, *maps):
+        self.maps = (self.maps or []) + list(maps)
+        self.empty = False
+
+    def add_options(self, *options):
+        self.options.extend(options)
+        self.empty = False
+
+    def set_format(self, output_format):
+        self.output_format = output_format
+        self.empty = False
+
+    def args(self):
+        args = []
+        for m in self.maps or []:
+            args.extend(['-map', m])
+        args.extend(['-c', 'copy'])
+        args.extend(self.options)
+        if self.output_format is not None:
+            args.extend(['-f', self.output_format])
+        return args
+
+
 class FFmpegPostProcessor(PostProcessor):
+    # Postprocessors that only remux the file implement
+    # plan_step(information, plan), adding their work to an FFmpegPlan and
+    # returning the updated information. Consecutive ones can then share a
+    # single ffmpeg invocation, see fuse_postprocessors().
+    plan_step = None
+
     def __init__(self, downloader=None):
         PostProcessor.__init__(self, downloader)
         self._determine_executables()
 
+    def run(self, information):
+        if self.plan_step is None:
+            return PostProcessor.run(self, information)
+        return self.run_plan([self], information)
+
+    def run_plan(self, pps, information):
+        """Run the plan_step() of the given postprocessors in one ffmpeg invocation"""
+        plan = FFmpegPlan(information['filepath'])
+        try:
+            for pp in pps:
+                information = pp.plan_step(information, plan)
+            if plan.empty:
+                return [], information
+
+            filename = plan.filename
+            temp_filename = prepend_extension(filename, 'temp')
+            self.run_ffmpeg_multiple_files(plan.inputs, temp_filename, plan.args())
+        finally:
+            for temp_file in plan.temp_files:
+                try:
+                    os.remove(encodeFilename(temp_file))
+                except OSError:
+                    pass
+        if os.path.exists(encodeFilename(filename)):
+            os.remove(encodeFilename(filename))
+        os.rename(encodeFilename(temp_filename), encodeFilename(filename))
+        return plan.files_to_delete, information
+
     def check_version(self):
         if not self.available:
             raise FFmpegPostProcessorError('ffmpeg or avconv not found. Please install one.')
@@ -73,56 +267,31 @@ class FFmpegPostProcessor(PostProcessor):
 
     @staticmethod
     def get_versions(downloader=None):
-        return FFmpegPostProcessor(downloader)._versions
+        return dict(FFmpegPostProcessor(downloader)._versions)
 
     def _determine_executables(self):
-        programs = ['avprobe', 'avconv', 'ffmpeg', 'ffprobe']
         prefer_ffmpeg = False
-
-        self.basename = None
-        self.probe_basename = None
-
-        self._paths = None
-        self._versions = None
+        location = None
         if self._downloader:
             prefer_ffmpeg = self._downloader.params.get('prefer_ffmpeg', False)
             location = self._downloader.params.get('ffmpeg_location')
-            if location is not None:
-                if not os.path.exists(location):
-                    self._downloader.report_warning(
-                        'ffmpeg-location %s does not exist! '
-                        'Continuing without avconv/ffmpeg.' % (location))
-                    self._versions = {}
-                    return
-                elif not os.path.isdir(location):
-                    basename = os.path.splitext(os.path.basename(location))[0]
-                    if basename not in programs:
-                        self._downloader.report_warning(
-                            'Cannot identify executable %s, its basename should be one of %s. '
-                            'Continuing without avconv/ffmpeg.' %
-                            (location, ', '.join(programs)))
-                        self._versions = {}
-                        return None
-                    location = os.path.dirname(os.path.abspath(location))
-                    if basename in ('ffmpeg', 'ffprobe'):
-                        prefer_ffmpeg = True
-
-                self._paths = dict(
-                    (p, os.path.join(location, p)) for p in programs)
-                self._versions = dict(
-                    (p, get_exe_version(self._paths[p], args=['-version']))
-                    for p in programs)
-        if self._versions is None:
-            self._versions = dict(
-                (p, get_exe_version(p, args=['-version'])) for p in programs)
-            self._paths = dict((p, p) for p in programs)
+
+        self._executables = _probe_executables(location)
+        if self._executables['warning'] and self._downloader:
+            self._downloader.report_warning(self._executables['warning'])
+        self._paths = self._executables['paths']
+        self._versions = self._executables['versions']
+        prefer_ffmpeg = prefer_ffmpeg or self._executables['prefer_ffmpeg']
+
+        self.basename = None
+        self.probe_basename = None
 
         if prefer_ffmpeg:
             prefs = ('ffmpeg', 'avconv')
         else:
             prefs = ('avconv', 'ffmpeg')
         for p in prefs:
-            if self._versions[p]:
+            if self._versions.get(p):
                 self.basename = p
                 break
 
@@ -131,10 +300,27 @@ class FFmpegPostProcessor(PostProcessor):
         else:
             prefs = ('avprobe', 'ffprobe')
         for p in prefs:
-            if self._versions[p]:
+            if self._versions.get(p):
                 self.probe_basename = p
                 break
 
+    def supports(self, muxers=(), encoders=(), bsfs=()):
+        """
+        Return whether the executable supports all the given muxers,
+        encoders and bitstream filters
+
+        Support is assumed if it cannot be told.
+        """
+        if not self.available:
+            return False
+        for kind, names in (('muxers', muxers), ('encoders', encoders), ('bsfs', bsfs)):
+            if not names:
+                continue
+            supported = _probe_capabilities(self._executables, self.basename, kind)
+            if supported is not None and not all(n in supported for n in names):
+                return False
+        return True
+
     @property
     def available(self):
         return self.basename is not None
@@ -288,6 +474,10 @@ class FFmpegExtractAudioPP(FFmpegPostProcessor):
                 extension = 'wav'
                 more_opts += ['-f', 'wav']
 
+        if acodec not in (None, 'copy') and not self.supports(encoders=[acodec]):
+            raise PostProcessingError(
+                '%s does not support the %s encoder' % (self.basename, acodec))
+
         prefix, sep, ext = path.rpartition('.')  # not os.path.splitext, since the latter does not work on unicode in all setups
         new_path = prefix + sep + extension
 
@@ -342,14 +532,14 @@ class FFmpegVideoConvertorPP(FFmpegPostProcessor):
 
 
 class FFmpegEmbedSubtitlePP(FFmpegPostProcessor):
-    def run(self, information):
+    def plan_step(self, information, plan):
         if information['ext'] not in ('mp4', 'webm', 'mkv'):
             self._downloader.to_screen('[ffmpeg] Subtitles can only be embedded in mp4, webm or mkv files')
-            return [], information
+            return information
         subtitles = information.get('requested_subtitles')
         if not subtitles:
             self._downloader.to_screen('[ffmpeg] There aren\'t any subtitles to embed')
-            return [], information
+            return information
 
         filename = information['filepath']
 
@@ -369,36 +559,27 @@ class FFmpegEmbedSubtitlePP(FFmpegPostProcessor):
                     self._downloader.to_screen('[ffmpeg] Only WebVTT subtitles can be embedded in webm files')
 
         if not sub_langs:
-            return [], information
+            return information
 
-        input_files = [filename] + sub_filenames
-
-        opts = [
-            '-map', '0',
-            '-c', 'copy',
+        if plan.maps is None:
             # Don't copy the existing subtitles, we may be running the
             # postprocessor a second time
-            '-map', '-0:s',
-        ]
+            plan.add_maps('0', '-0:s')
         if information['ext'] == 'mp4':
-            opts += ['-c:s', 'mov_text']
-        for (i, lang) in enumerate(sub_langs):
-            opts.extend(['-map', '%d:0' % (i + 1)])
+            plan.add_options('-c:s', 'mov_text')
+        for (i, (lang, sub_filename)) in enumerate(zip(sub_langs, sub_filenames)):
+            plan.add_maps('%d:0' % plan.add_input(sub_filename))
             lang_code = ISO639Utils.short2long(lang)
             if lang_code is not None:
-                opts.extend(['-metadata:s:s:%d' % i, 'language=%s' % lang_code])
+                plan.add_options('-metadata:s:s:%d' % i, 'language=%s' % lang_code)
 
-        temp_filename = prepend_extension(filename, 'temp')
         self._downloader.to_screen('[ffmpeg] Embedding subtitles in \'%s\'' % filename)
-        self.run_ffmpeg_multiple_files(input_files, temp_filename, opts)
-        os.remove(encodeFilename(filename))
-        os.rename(encodeFilename(temp_filename), encodeFilename(filename))
-
-        return sub_filenames, information
+        plan.files_to_delete.extend(sub_filenames)
+        return information
 
 
 class FFmpegMetadataPP(FFmpegPostProcessor):
-    def run(self, info):
+    def plan_step(self, info, plan):
         metadata = {}
 
         def add(meta_list, info_list=None):
@@ -427,20 +608,15 @@ class FFmpegMetadataPP(FFmpegPostProcessor):
 
         if not metadata:
             self._downloader.to_screen('[ffmpeg] There isn\'t any metadata to add')
-            return [], info
+            return info
 
         filename = info['filepath']
-        temp_filename = prepend_extension(filename, 'temp')
-        in_filenames = [filename]
-        options = []
 
         if info['ext'] == 'm4a':
-            options.extend(['-vn', '-acodec', 'copy'])
-        else:
-            options.extend(['-c', 'copy'])
+            plan.add_options('-vn')
 
         for (name, value) in metadata.items():
-            options.extend(['-metadata', '%s=%s' % (name, value)])
+            plan.add_options('-metadata', '%s=%s' % (name, value))
 
         chapters = info.get('chapters', [])
         if chapters:
@@ -458,27 +634,24 @@ class FFmpegMetadataPP(FFmpegPostProcessor):
                     if chapter_title:
                         metadata_file_content += 'title=%s\n' % ffmpeg_escape(chapter_title)
                 f.write(metadata_file_content)
-                in_filenames.append(metadata_filename)
-                options.extend(['-map_metadata', '1'])
+            plan.temp_files.append(metadata_filename)
+            plan.add_options('-map_metadata', '%d' % plan.add_input(metadata_filename))
 
         self._downloader.to_screen('[ffmpeg] Adding metadata to \'%s\'' % filename)
-        self.run_ffmpeg_multiple_files(in_filenames, temp_filename, options)
-        if chapters:
-            os.remove(metadata_filename)
-        os.remove(encodeFilename(filename))
-        os.rename(encodeFilename(temp_filename), encodeFilename(filename))
-        return [], info
+        return info
 
 
 class FFmpegMergerPP(FFmpegPostProcessor):
-    def run(self, info):
-        filename = info['filepath']
-        temp_filename = prepend_extension(filename, 'temp')
-        args = ['-c', 'copy', '-map', '0:v:0', '-map', '1:a:0']
-        self._downloader.to_screen('[ffmpeg] Merging formats into "%s"' % filename)
-        self.run_ffmpeg_multiple_files(info['__files_to_merge'], temp_filename, args)
-        os.rename(encodeFilename(temp_filename), encodeFilename(filename))
-        return info['__files_to_merge'], info
+    def plan_step(self, info, plan):
+        # Merging creates the file the other steps work on
+        assert plan.empty and plan.inputs == [info['filepath']]
+        files_to_merge = info['__files_to_merge']
+        plan.inputs = list(files_to_merge)
+        plan.audio_input = files_to_merge[1]
+        plan.add_maps('0:v:0', '1:a:0')
+        plan.files_to_delete.extend(files_to_merge)
+        self._downloader.to_screen('[ffmpeg] Merging formats into "%s"' % info['filepath'])
+        return info
 
     def can_merge(self):
         # TODO: figure out merge-capable ffmpeg version
@@ -499,55 +672,33 @@ class FFmpegMergerPP(FFmpegPostProcessor):
 
 
 class FFmpegFixupStretchedPP(FFmpegPostProcessor):
-    def run(self, info):
+    def plan_step(self, info, plan):
         stretched_ratio = info.get('stretched_ratio')
         if stretched_ratio is None or stretched_ratio == 1:
-            return [], info
-
-        filename = info['filepath']
-        temp_filename = prepend_extension(filename, 'temp')
-
-        options = ['-c', 'copy', '-aspect', '%f' % stretched_ratio]
-        self._downloader.to_screen('[ffmpeg] Fixing aspect ratio in "%s"' % filename)
-        self.run_ffmpeg(filename, temp_filename, options)
+            return info
 
-        os.remove(encodeFilename(filename))
-        os.rename(encodeFilename(temp_filename), encodeFilename(filename))
-
-        return [], info
+        plan.add_options('-aspect', '%f' % stretched_ratio)
+        self._downloader.to_screen('[ffmpeg] Fixing aspect ratio in "%s"' % info['filepath'])
+        return info
 
 
 class FFmpegFixupM4aPP(FFmpegPostProcessor):
-    def run(self, info):
+    def plan_step(self, info, plan):
         if info.get('container') != 'm4a_dash':
-            return [], info
-
-        filename = info['filepath']
-        temp_filename = prepend_extension(filename, 'temp')
-
-        options = ['-c', 'copy', '-f', 'mp4']
-        self._downloader.to_screen('[ffmpeg] Correcting container in "%s"' % filename)
-        self.run_ffmpeg(filename, temp_filename, options)
+            return info
 
-        os.remove(encodeFilename(filename))
-        os.rename(encodeFilename(temp_filename), encodeFilename(filename))
-
-        return [], info
+        plan.set_format('mp4')
+        self._downloader.to_screen('[ffmpeg] Correcting container in "%s"' % info['filepath'])
+        return info
 
 
 class FFmpegFixupM3u8PP(FFmpegPostProcessor):
-    def run(self, info):
-        filename = info['filepath']
-        if self.get_audio_codec(filename) == 'aac':
-            temp_filename = prepend_extension(filename, 'temp')
-
-            options = ['-c', 'copy', '-f', 'mp4', '-bsf:a', 'aac_adtstoasc']
-            self._downloader.to_screen('[ffmpeg] Fixing malformed AAC bitstream in "%s"' % filename)
-            self.run_ffmpeg(filename, temp_filename, options)
-
-            os.remove(encodeFilename(filename))
-            os.rename(encodeFilename(temp_filename), encodeFilename(filename))
-        return [], info
+    def plan_step(self, info, plan):
+        if self.get_audio_codec(plan.audio_input) == 'aac':
+            plan.set_format('mp4')
+            plan.add_options('-bsf:a', 'aac_adtstoasc')
+            self._downloader.to_screen('[ffmpeg] Fixing malformed AAC bitstream in "%s"' % info['filepath'])
+        return info
 
 
 class FFmpegSubtitlesConvertorPP(FFmpegPostProcessor):
@@ -611,3 +762,43 @@ class FFmpegSubtitlesConvertorPP(FFmpegPostProcessor):
                 }
 
         return sub_filenames, info
+
+
+class FFmpegFusedPP(FFmpegPostProcessor):
+    """Run consecutive remuxing postprocessors in a single ffmpeg invocation"""
+
+    def __init__(self, downloader=None, pps=()):
+        super(FFmpegFusedPP, self).__init__(downloader)
+        self._pps = list(pps)
+
+    def run(self, information):
+        return self.run_plan(self._pps, information)
+
+
+def fuse_postprocessors(pps, downloader=None):
+    """
+    Return the postprocessor chain pps with runs of consecutive
+    postprocessors implementing plan_step() replaced by an FFmpegFusedPP, so
+    that the file is only rewritten once for each run
+    """
+    chain = []
+    group = []
+
+    def flush():
+        if len(group) > 1:
+            chain.append(FFmpegFusedPP(downloader, group))
+        else:
+            chain.extend(group)
+        del group[:]
+
+    for pp in pps:
+        if isinstance(pp, FFmpegPostProcessor) and pp.plan_step is not None:
+            if isinstance(pp, FFmpegMergerPP):
+                # Merging has to come first in an invocation
+                flush()
+            group.append(pp)
+        else:
+            flush()
+            chain.append(pp)
+    flush()
+    return chain
@@ -0,0 +1,217 @@
+from __future__ import unicode_literals
+
+from .compat import (
+    compat_chr,
+    compat_sre_parse as sre_parse,
+)
+
+
+_SLASH = ord('/')
+
+# Character categories that can never match a slash
+_NO_SLASH_CATEGORIES = (
+    sre_parse.CATEGORY_DIGIT,
+    sre_parse.CATEGORY_SPACE,
+    sre_parse.CATEGORY_WORD,
+)
+
+_REPEATS = tuple(
+    getattr(sre_parse, name)
+    for name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+    if hasattr(sre_parse, name))
+
+_ATOMIC_GROUP = getattr(sre_parse, 'ATOMIC_GROUP', None)
+
+
+def _subpattern(op, av):
+    if op == sre_parse.SUBPATTERN:
+        return av[-1]
+    if op == _ATOMIC_GROUP:
+        return av
+    if op in _REPEATS:
+        return av[2]
+    return None
+
+
+def _can_match_slash(tokens):
+    for op, av in tokens:
+        if op == sre_parse.LITERAL:
+            if av == _SLASH:
+                return True
+        elif op == sre_parse.NOT_LITERAL:
+            if av != _SLASH:
+                return True
+        elif op == sre_parse.IN:
+            negate = False
+            explicit = False
+            for item_op, item_av in av:
+                if item_op == sre_parse.NEGATE:
+                    negate = True
+                elif item_op == sre_parse.LITERAL:
+                    explicit = explicit or item_av == _SLASH
+                elif item_op == sre_parse.RANGE:
+                    explicit = explicit or item_av[0] <= _SLASH <= item_av[1]
+                elif item_op == sre_parse.CATEGORY:
+                    if item_av not in _NO_SLASH_CATEGORIES and not negate:
+                        return True
+                else:
+                    return True
+            if explicit != negate:
+                return True
+        elif op == sre_parse.BRANCH:
+            if any(_can_match_slash(alt) for alt in av[1]):
+                return True
+        elif op in (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            # Zero-width
+            continue
+        else:
+            sub = _subpattern(op, av)
+            if sub is None or _can_match_slash(sub):
+                return True
+    return False
+
+
+def _literal_suffixes(tokens):
+    tokens = list(tokens)
+    chars = []
+    for op, av in reversed(tokens):
+        if op != sre_parse.LITERAL:
+            break
+        chars.append(av)
+    if chars:
+        return set([''.join(map(compat_chr, reversed(chars))).lower()])
+    if not tokens:
+        return None
+    op, av = tokens[-1]
+    if op == sre_parse.BRANCH:
+        suffixes = set()
+        for alt in av[1]:
+            alt_suffixes = _literal_suffixes(alt)
+            if alt_suffixes is None:
+                return None
+            suffixes |= alt_suffixes
+        return suffixes
+    if op in _REPEATS and av[0] < 1:
+        return None
+    sub = _subpattern(op, av)
+    return None if sub is None else _literal_suffixes(sub)
+
+
+def url_host_suffixes(valid_url):
+    """
+    Return a tuple of lowercase strings, one of which ends the host part of
+    every URL matching the regular expression valid_url from its start.
+
+    The host part is everything between the first "//" and the next "/".
+    None is returned when this cannot be decided from the expression, e.g.
+    when the scheme is optional or the host is followed by an optional slash.
+    """
+    try:
+        tokens = list(sre_parse.parse(valid_url))
+    except Exception:
+        return None
+
+    slash = (sre_parse.LITERAL, _SLASH)
+    # Nothing before the "//" may match a slash, so that it is the first one
+    # in matching URLs
+    for start in range(len(tokens) - 1):
+        if tokens[start] == slash and tokens[start + 1] == slash:
+            break
+        if _can_match_slash(tokens[start:start + 1]):
+            return None
+    else:
+        return None
+    start += 2
+
+    # The host must be followed by a mandatory slash that it cannot match
+    # itself, so that it is all of the host part
+    for end in range(start, len(tokens)):
+        if tokens[end] == slash:
+            break
+        if _can_match_slash(tokens[end:end + 1]):
+            return None
+    else:
+        return None
+
+    suffixes = _literal_suffixes(tokens[start:end])
+    if not suffixes or '' in suffixes:
+        return None
+    return tuple(sorted(suffixes))
+
+
+def _default_suitable_funcs():
+    from .extractor.common import InfoExtractor
+    funcs = [InfoExtractor.suitable.__func__]
+    try:
+        from .extractor.lazy_extractors import LazyLoadExtractor
+    except ImportError:
+        pass
+    else:
+        funcs.append(LazyLoadExtractor.suitable.__func__)
+    return funcs
+
+
+def ie_host_suffixes(ie, default_suitable_funcs=None):
+    """
+    Return the host suffixes (see url_host_suffixes) of the URLs ie is
+    suitable for, or None if it may be suitable for any URL.
+    """
+    # Lazy extractors come with precomputed suffixes
+    suffixes = getattr(ie, '_URL_HOST_SUFFIXES', False)
+    if suffixes is not False:
+        return suffixes
+    if default_suitable_funcs is None:
+        default_suitable_funcs = _default_suitable_funcs()
+    if ie.suitable.__func__ not in default_suitable_funcs:
+        # The extractor has its own idea of suitable URLs
+        return None
+    valid_url = getattr(ie, '_VALID_URL', None)
+    if not valid_url:
+        return None
+    return url_host_suffixes(valid_url)
+
+
+class URLDispatchIndex(object):
+    """
+    Index of info extractors by the host suffixes of their _VALID_URL
+
+    candidates() returns, in their original order, the extractors that may
+    be suitable for a URL: the ones indexed under a suffix of its host part
+    and the ones that could not be indexed, like GenericIE. Only these need
+    to be tried with suitable(), which also spares compiling the regular
+    expressions of all the other extractors.
+    """
+
+    def __init__(self, ies):
+        self._ies = []
+        self._by_suffix = {}
+        self._unindexed = []
+        self._default_suitable_funcs = _default_suitable_funcs()
+        for ie in ies:
+            self.add(ie)
+
+    def add(self, ie):
+        """Add an extractor after all the others"""
+        pos = len(self._ies)
+        self._ies.append(ie)
+        suffixes = ie_host_suffixes(ie, self._default_suitable_funcs)
+        if suffixes is None:
+            self._unindexed.append(pos)
+            return
+        for suffix in suffixes:
+            self._by_suffix.setdefault(suffix, []).append(pos)
+
+    def __len__(self):
+        return len(self._ies)
+
+    def candidates(self, url):
+        positions = set(self._unindexed)
+        slash = url.find('/')
+        if slash != -1 and url[slash + 1:slash + 2] == '/':
+            host_end = url.find('/', slash + 2)
+            if host_end == -1:
+                host_end = len(url)
+            host = url[slash + 2:host_end].lower()
+            for i in range(len(host)):
+                positions.update(self._by_suffix.get(host[i:], ()))
+        return [self._ies[pos] for pos in sorted(positions)]
@@ -14,7 +14,6 @@ import email.utils
 import email.header
 import errno
 import functools
-import gzip
 import io
 import itertools
 import json
@@ -25,11 +24,14 @@ import os
 import platform
 import random
 import re
+import select
 import socket
 import ssl
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 import traceback
 import xml.etree.ElementTree
 import zlib
@@ -910,6 +912,247 @@ def handle_youtubedl_headers(headers):
     return filtered_headers
 
 
+class HTTPConnectionPool(object):
+    """Pool of idle persistent HTTP connections
+
+    Connections are keyed by the scheme, host, port and proxy they were
+    established with. A connection is only returned to the pool once the
+    response sent over it has been read completely. Connections that have
+    been idle for longer than idle_timeout seconds or that have been closed
+    by the server in the meantime are discarded instead of being reused.
+    """
+
+    def __init__(self, max_idle_per_key=8, idle_timeout=30):
+        self.max_idle_per_key = max_idle_per_key
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _is_dropped(conn):
+        sock = getattr(conn, 'sock', None)
+        if sock is None:
+            return True
+        try:
+            # An idle keep-alive socket has nothing to read unless it has
+            # been closed by the server
+            return bool(select.select([sock], [], [], 0)[0])
+        except (ValueError, select.error, socket.error):
+            return True
+
+    def acquire(self, key):
+        expired = []
+        conn = None
+        with self._lock:
+            idle = self._idle.get(key)
+            while idle:
+                candidate, last_used = idle.pop()
+                if time.time() - last_used > self.idle_timeout or self._is_dropped(candidate):
+                    expired.append(candidate)
+                    continue
+                conn = candidate
+                break
+        for c in expired:
+            c.close()
+        return conn
+
+    def release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_key:
+                idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn, _ in conns:
+                conn.close()
+
+
+class _PooledHTTPResponse(compat_http_client.HTTPResponse):
+    _ytdl_release = None
+
+    def close(self):
+        # A response closed before its body has been read completely leaves
+        # unread data on the connection, so that it can't be reused
+        if self.fp is not None and self.length != 0:
+            release, self._ytdl_release = self._ytdl_release, None
+            if release:
+                release(False)
+        compat_http_client.HTTPResponse.close(self)
+
+    def _close_conn(self):
+        compat_http_client.HTTPResponse._close_conn(self)
+        release, self._ytdl_release = self._ytdl_release, None
+        if release:
+            release(True)
+
+
+def _do_open_pooled(ydl_handler, http_class, req, pool_key, **kwargs):
+    # Python 2 urllib2 wraps responses in socket._fileobject that does not
+    # play well with persistent connections
+    if sys.version_info < (3, 0) or ydl_handler._connection_pool is None:
+        return ydl_handler.do_open(http_class, req, **kwargs)
+
+    host = req.host
+    if not host:
+        raise compat_urllib_error.URLError('no host given')
+
+    pool = ydl_handler._connection_pool
+    pool_key = pool_key + (host, req._tunnel_host)
+
+    headers = dict(req.unredirected_hdrs)
+    headers.update(dict(
+        (k, v) for k, v in req.headers.items() if k not in headers))
+    headers = dict((name.title(), val) for name, val in headers.items())
+    tunnel_headers = {}
+    if req._tunnel_host and 'Proxy-Authorization' in headers:
+        # Proxy-Authorization should not be sent to origin server
+        tunnel_headers['Proxy-Authorization'] = headers.pop('Proxy-Authorization')
+    request_kwargs = {}
+    if req.has_header('Transfer-encoding'):
+        request_kwargs['encode_chunked'] = True
+
+    while True:
+        conn = pool.acquire(pool_key)
+        reused = conn is not None
+        if reused:
+            conn.timeout = req.timeout
+            conn.sock.settimeout(req.timeout)
+        else:
+            conn = http_class(host, timeout=req.timeout, **kwargs)
+            conn.set_debuglevel(ydl_handler._debuglevel)
+            conn.response_class = _PooledHTTPResponse
+            if req._tunnel_host:
+                conn.set_tunnel(req._tunnel_host, headers=tunnel_headers)
+        try:
+            try:
+                conn.request(
+                    req.get_method(), req.selector, req.data, headers,
+                    **request_kwargs)
+            except socket.error as err:
+                if reused and not isinstance(err, socket.timeout):
+                    raise
+                raise compat_urllib_error.URLError(err)
+            resp = conn.getresponse()
+        except Exception as err:
+            conn.close()
+            # The server may have closed an idle connection right before we
+            # reused it, retry on a fresh connection in this case
+            if (reused and isinstance(err, (socket.error, compat_http_client.HTTPException))
+                    and not isinstance(err, (socket.timeout, compat_urllib_error.URLError))):
+                continue
+            raise
+        break
+
+    if not resp.will_close:
+        def release(reusable):
+            if reusable:
+                pool.release(pool_key, conn)
+            else:
+                conn.close()
+        resp._ytdl_release = release
+
+    resp.url = req.get_full_url()
+    resp.msg = resp.reason
+    return resp
+
+
+class DecompressingReader(io.RawIOBase):
+    """Raw stream decompressing a gzip or deflate encoded file object
+
+    Data following the end of the compressed stream is ignored (there may be
+    junk at the end of the file, see http://stackoverflow.com/q/4928560/35070
+    for details), unless it starts another gzip member. A compressed stream
+    that is cut short raises zlib.error.
+    """
+
+    _CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, fp, encoding):
+        assert encoding in ('gzip', 'deflate')
+        self._fp = fp
+        # Deflate is supposed to be zlib wrapped, but some servers send raw
+        # deflate data instead
+        self._wbits = [16 + zlib.MAX_WBITS] if encoding == 'gzip' else [-zlib.MAX_WBITS, zlib.MAX_WBITS]
+        self._decompressor = zlib.decompressobj(self._wbits[0])
+        # Input kept until the format has been figured out
+        self._head = b''
+        self._buf = b''
+        self._pos = 0
+        self._eof = False
+        self._received = False
+
+    def readable(self):
+        return True
+
+    def _stream_ended(self):
+        eof = getattr(self._decompressor, 'eof', None)
+        if eof is not None:
+            return eof
+        # Python < 3.3: data following the end of the stream is left unused
+        probe = self._decompressor.copy()
+        try:
+            probe.decompress(b'\0')
+        except zlib.error:
+            return False
+        return bool(probe.unused_data)
+
+    def _decompress(self, chunk):
+        try:
+            data = self._decompressor.decompress(chunk)
+        except zlib.error:
+            if self._head is None or len(self._wbits) == 1:
+                raise
+            # Try the next format from the start
+            self._wbits.pop(0)
+            self._decompressor = zlib.decompressobj(self._wbits[0])
+            head, self._head = self._head + chunk, None
+            return self._decompressor.decompress(head)
+        if self._head is not None:
+            self._head = None if data else self._head + chunk
+        return data
+
+    def _fill(self):
+        while self._pos >= len(self._buf) and not self._eof:
+            self._pos = 0
+            chunk = self._fp.read(self._CHUNK_SIZE)
+            if not chunk:
+                self._buf = self._decompressor.flush()
+                self._eof = True
+                # An empty body is not compressed data
+                if self._received and not self._stream_ended():
+                    raise zlib.error('Compressed data ended before the end of the stream')
+                break
+            self._received = True
+            buf = self._decompress(chunk)
+            while self._decompressor.unused_data:
+                unused_data = self._decompressor.unused_data
+                buf += self._decompressor.flush()
+                if unused_data[:2] != b'\x1f\x8b' or self._wbits[0] <= zlib.MAX_WBITS:
+                    self._eof = True
+                    break
+                # Concatenated gzip members
+                self._decompressor = zlib.decompressobj(self._wbits[0])
+                buf += self._decompressor.decompress(unused_data)
+            self._buf = buf
+
+    def readinto(self, b):
+        self._fill()
+        n = min(len(b), len(self._buf) - self._pos)
+        b[:n] = self._buf[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._fp.close()
+        io.RawIOBase.close(self)
+
+
 class YoutubeDLHandler(compat_urllib_request.HTTPHandler):
     """Handler for HTTP requests and responses.
 
@@ -931,6 +1174,8 @@ class YoutubeDLHandler(compat_urllib_request.HTTPHandler):
     def __init__(self, params, *args, **kwargs):
         compat_urllib_request.HTTPHandler.__init__(self, *args, **kwargs)
         self._params = params
+        self._connection_pool = (
+            None if params.get('no_keep_alive') else HTTPConnectionPool())
 
     def http_open(self, req):
         conn_class = compat_http_client.HTTPConnection
@@ -940,9 +1185,9 @@ class YoutubeDLHandler(compat_urllib_request.HTTPHandler):
             conn_class = make_socks_conn_class(conn_class, socks_proxy)
             del req.headers['Ytdl-socks-proxy']
 
-        return self.do_open(functools.partial(
+        return _do_open_pooled(self, functools.partial(
             _create_http_connection, self, conn_class, False),
-            req)
+            req, ('http', socks_proxy))
 
     @staticmethod
     def deflate(data):
@@ -984,33 +1229,14 @@ class YoutubeDLHandler(compat_urllib_request.HTTPHandler):
 
     def http_response(self, req, resp):
         old_resp = resp
-        # gzip
-        if resp.headers.get('Content-encoding', '') == 'gzip':
-            content = resp.read()
-            gz = gzip.GzipFile(fileobj=io.BytesIO(content), mode='rb')
-            try:
-                uncompressed = io.BytesIO(gz.read())
-            except IOError as original_ioerror:
-                # There may be junk add the end of the file
-                # See http://stackoverflow.com/q/4928560/35070 for details
-                for i in range(1, 1024):
-                    try:
-                        gz = gzip.GzipFile(fileobj=io.BytesIO(content[:-i]), mode='rb')
-                        uncompressed = io.BytesIO(gz.read())
-                    except IOError:
-                        continue
-                    break
-                else:
-                    raise original_ioerror
+        content_encoding = resp.headers.get('Content-encoding', '')
+        if content_encoding in ('gzip', 'deflate'):
+            # Decompress as the caller reads
+            uncompressed = io.BufferedReader(
+                DecompressingReader(old_resp, content_encoding))
             resp = compat_urllib_request.addinfourl(uncompressed, old_resp.headers, old_resp.url, old_resp.code)
             resp.msg = old_resp.msg
             del resp.headers['Content-encoding']
-        # deflate
-        if resp.headers.get('Content-encoding', '') == 'deflate':
-            gz = io.BytesIO(self.deflate(resp.read()))
-            resp = compat_urllib_request.addinfourl(gz, old_resp.headers, old_resp.url, old_resp.code)
-            resp.msg = old_resp.msg
-            del resp.headers['Content-encoding']
         # Percent-encode redirect URL of Location HTTP header to satisfy RFC 3986 (see
         # https://github.com/rg3/youtube-dl/issues/6457).
         if 300 <= resp.code < 400:
@@ -1081,6 +1307,8 @@ class YoutubeDLHTTPSHandler(compat_urllib_request.HTTPSHandler):
         compat_urllib_request.HTTPSHandler.__init__(self, *args, **kwargs)
         self._https_conn_class = https_conn_class or compat_http_client.HTTPSConnection
         self._params = params
+        self._connection_pool = (
+            None if params.get('no_keep_alive') else HTTPConnectionPool())
 
     def https_open(self, req):
         kwargs = {}
@@ -1096,9 +1324,9 @@ class YoutubeDLHTTPSHandler(compat_urllib_request.HTTPSHandler):
             conn_class = make_socks_conn_class(conn_class, socks_proxy)
             del req.headers['Ytdl-socks-proxy']
 
-        return self.do_open(functools.partial(
+        return _do_open_pooled(self, functools.partial(
             _create_http_connection, self, conn_class, True),
-            req, **kwargs)
+            req, ('https', socks_proxy), **kwargs)
 
 
 class YoutubeDLCookieProcessor(compat_urllib_request.HTTPCookieProcessor):
@@ -1541,6 +1769,12 @@ class locked_file(object):
     def read(self, *args):
         return self.f.read(*args)
 
+    def seek(self, *args):
+        return self.f.seek(*args)
+
+    def tell(self):
+        return self.f.tell()
+
 
 def get_filesystem_encoding():
     encoding = sys.getfilesystemencoding()
@@ -1979,10 +2213,31 @@ def detect_exe_version(output, version_re=None, unrecognized='present'):
 
 
 class PagedList(object):
+    # Number of pages, if known in advance
+    _pagecount = None
+
     def __len__(self):
         # This is only useful for tests
         return len(self.getslice())
 
+    def iterslice(self, start=0, end=None):
+        """
+        Yield the elements of getslice(start, end), fetching each page only
+        when its elements are reached and without keeping it
+        """
+        for pagenum in itertools.count(start // self._pagesize):
+            if self._pagecount is not None and pagenum >= self._pagecount:
+                break
+            firstid = pagenum * self._pagesize
+            if end is not None and firstid >= end:
+                break
+            page = list(self._pagefunc(pagenum))
+            for entry in page[max(start - firstid, 0):None if end is None else end - firstid]:
+                yield entry
+            if self._pagecount is None and len(page) < self._pagesize:
+                # Not a full page, this is the last one
+                break
+
 
 class OnDemandPagedList(PagedList):
     def __init__(self, pagefunc, pagesize, use_cache=True):
@@ -2065,6 +2320,66 @@ class InAdvancePagedList(PagedList):
         return res
 
 
+class TurnsCancelled(BaseException):
+    """Raised to jobs waiting for their turn once their OrderedTurns are
+    cancelled
+
+    Like KeyboardInterrupt, it is not meant to be caught by handlers of
+    Exception.
+    """
+    pass
+
+
+class OrderedTurns(object):
+    """Let concurrent jobs numbered 0, 1, 2... pass named stages in order
+
+    Job n enters a stage only once every job before it has either passed
+    that stage or finished altogether. Once cancelled from job n, jobs
+    numbered n or more get TurnsCancelled instead of their next turn.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._passed = {}
+        self._next_job = {}
+        self._finished = set()
+        self._cancelled_from = None
+
+    def _next(self, stage):
+        passed = self._passed.get(stage, ())
+        n = self._next_job.get(stage, 0)
+        while n in passed or n in self._finished:
+            n += 1
+        self._next_job[stage] = n
+        return n
+
+    def is_cancelled(self, n):
+        return self._cancelled_from is not None and n >= self._cancelled_from
+
+    def wait(self, stage, n):
+        with self._cond:
+            while not self.is_cancelled(n) and self._next(stage) < n:
+                self._cond.wait()
+            if self.is_cancelled(n):
+                raise TurnsCancelled()
+
+    def cancel(self, n=0):
+        with self._cond:
+            if self._cancelled_from is None or n < self._cancelled_from:
+                self._cancelled_from = n
+            self._cond.notify_all()
+
+    def advance(self, stage, n):
+        with self._cond:
+            self._passed.setdefault(stage, set()).add(n)
+            self._cond.notify_all()
+
+    def finish(self, n):
+        with self._cond:
+            self._finished.add(n)
+            self._cond.notify_all()
+
+
 def uppercase_escape(s):
     unicode_escape = codecs.getdecoder('unicode_escape')
     return re.sub(
@@ -2100,7 +2415,8 @@ def escape_url(url):
     ).geturl()
 
 
-def read_batch_urls(batch_fd):
+def iter_batch_urls(batch_fd):
+    """Yield the URLs of a batch file as they are read, then close it"""
     def fixup(url):
         if not isinstance(url, compat_str):
             url = url.decode('utf-8', 'replace')
@@ -2113,7 +2429,14 @@ def read_batch_urls(batch_fd):
         return url
 
     with contextlib.closing(batch_fd) as fd:
-        return [url for url in map(fixup, fd) if url]
+        for line in fd:
+            url = fixup(line)
+            if url:
+                yield url
+
+
+def read_batch_urls(batch_fd):
+    return list(iter_batch_urls(batch_fd))
 
 
 def urlencode_postdata(*args, **kargs):